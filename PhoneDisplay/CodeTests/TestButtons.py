@@ -1,5 +1,6 @@
 import datetime
-from PhoneDisplay.dashboard import status, toggle, log_change, recent_changes, card
+from dash import no_update
+from PhoneDisplay.dashboard import status, toggle, log_change, recent_changes, card, update, create_app
 
 def test_toggle_changes_state():
     # Ensure known starting state
@@ -25,4 +26,21 @@ def test_card_renders_correct_state():
     c = card("Gas", "gas", "💨")
     assert c.id == "gas-card"
     assert "off" in c.className
-    assert c.children[1].children == "Off"
\ No newline at end of file
+    assert c.children[1].children == "Off"
+
+def test_click_patches_only_the_clicked_card():
+    status["gas"] = False
+    gas_class, gas_patch, heating_class, _, water_class, _, log = update(1, None, None, None)
+    assert gas_class == "utility on gas"
+    assert heating_class is no_update and water_class is no_update
+    values = [op["params"].get("value") for op in gas_patch.to_plotly_json()["operations"]]
+    assert "Turn Off" in values and "btn-off" in values
+    assert log.to_plotly_json()["operations"][0]["operation"] == "Prepend"
+
+def test_change_history_limit_is_clamped():
+    client = create_app(weather_source="stub", state="memory", event_log=None).server.test_client()
+    for i in range(3):
+        log_change("Test", True)
+    for limit, expected in (("-1", 1), ("0", 1), ("2", 2)):
+        body = client.get(f"/api/changes?limit={limit}").get_json()
+        assert len(body["changes"]) == expected
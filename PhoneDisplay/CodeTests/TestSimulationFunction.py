@@ -5,6 +5,6 @@ def test_simulation_updates_state():
     recent_changes.clear()
 
     # simulate-btn is the last input → only that triggers
-    update(None, None, None, None, None, 1)
+    update(None, None, None, 1)
 
     assert len(recent_changes) >= 1
\ No newline at end of file
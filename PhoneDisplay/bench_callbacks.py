@@ -0,0 +1,271 @@
+"""
+Load test of the dashboard callbacks: how many phones one process serves.
+
+N simulated clients (threads, each with its own Flask test client) post
+to /_dash-update-component the way the page does: an interval tick fires
+every callback on main-interval, toggle clicks, chart-type changes and
+simulate clicks. The sensor and light-history queries are replaced by
+fixed rows (--db-ms adds a round trip), the weather by StubSource, so
+only the dashboard's own work is measured.
+
+With the default --think 0 every client posts as fast as it can, so the
+process is saturated: requests/s is its capacity and the latencies are
+mostly time spent queueing for the interpreter behind the other clients.
+--think gives each client pauses like a real phone.
+
+Reports requests/s and p50/p95/p99 latency per callback for each number
+of clients, and appends the run to a JSON-lines file; the next run with
+the same settings is compared against it, so a slower version shows up.
+
+    python bench_callbacks.py --clients 1,8,32 --seconds 10
+    python bench_callbacks.py --clients 32,128 --think 0.1
+    python bench_callbacks.py --db-ms 5 --results /tmp/bench.jsonl
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Timings only compare on the same machine, so the file stays local (.gitignore)
+RESULTS_PATH = os.path.join(HERE, "bench_results.jsonl")
+
+# What a client does next, with weights: mostly ticks, now and then a click
+ACTIONS = {"tick": 6, "toggle": 3, "chart": 1, "simulate": 1}
+CHART_TYPES = ["line", "scatter", "bar"]
+REPORTED = ["update", "update_weather", "update_energy_graph", "update_smart_graph",
+            "refresh_cards", "update_light_graph"]
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    i = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[i]
+
+
+# -----------------------------
+# App with stubbed data sources
+# -----------------------------
+def build_app(db_ms):
+    import dashboard
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    sensors = {"ldr": (now, 40000.0, "Light"), "rfid": (now - datetime.timedelta(minutes=5), None, "tag")}
+    history = [(now - datetime.timedelta(hours=24 - h), 30000.0 + h, 20000.0, 40000.0) for h in range(24)]
+
+    def query_sensors():
+        time.sleep(db_ms / 1000)
+        return sensors
+
+    def query_light_history(hours):
+        time.sleep(db_ms / 1000)
+        return history
+
+    # The callbacks look these up in the module at call time
+    dashboard.query_sensors = query_sensors
+    dashboard.query_light_history = query_light_history
+    return dashboard.create_app(weather_source="stub", state="memory", event_log=None)
+
+
+def callback_requests(app):
+    """
+    {callback name: (output, outputs, inputs, state)} from the app's
+    callback map, in the shape the renderer posts them.
+    """
+    found = {}
+    for output, spec in app.callback_map.items():
+        if "callback" not in spec:
+            continue   # clientside
+        function = spec["callback"]
+        name = getattr(function, "__wrapped__", function).__name__
+        outputs = []
+        for part in output.strip(".").split("..."):
+            component, prop = part.rsplit(".", 1)
+            outputs.append({"id": component, "property": prop})
+        found[name] = (output, outputs if output.startswith("..") else outputs[0], spec["inputs"], spec["state"])
+    return found
+
+
+class Client:
+    """
+    One phone: keeps its page's values (the card classes it was sent, the
+    tick count, the chart type) and posts the callbacks they trigger.
+    """
+
+    def __init__(self, app, callbacks, rng):
+        self.http = app.server.test_client()
+        self.callbacks = callbacks
+        self.rng = rng
+        self.values = {"main-interval.n_intervals": 0, "chart-type.value": "line", "light-range.value": 24,
+                       "live-version.data": None}
+        self.timings = {name: [] for name in callbacks}
+        self.errors = 0
+
+    def value(self, dependency):
+        return self.values.get(f"{dependency['id']}.{dependency['property']}")
+
+    def post(self, name, changed):
+        output, outputs, inputs, state = self.callbacks[name]
+        body = {
+            "output": output,
+            "outputs": outputs,
+            "inputs": [dict(i, value=self.value(i)) for i in inputs],
+            "state": [dict(s, value=self.value(s)) for s in state],
+            "changedPropIds": [changed],
+        }
+        start = time.perf_counter()
+        response = self.http.post("/_dash-update-component", json=body)
+        self.timings[name].append((time.perf_counter() - start) * 1000)
+        if response.status_code == 204:
+            return   # PreventUpdate / nothing changed
+        if response.status_code != 200:
+            self.errors += 1
+            return
+        for component, props in response.get_json()["response"].items():
+            if isinstance(props.get("className"), str):
+                self.values[f"{component}.className"] = props["className"]
+
+    def act(self, action):
+        if action == "tick":
+            self.values["main-interval.n_intervals"] += 1
+            for name, (_, _, inputs, _) in self.callbacks.items():
+                if any(i["id"] == "main-interval" for i in inputs):
+                    self.post(name, "main-interval.n_intervals")
+        elif action == "chart":
+            self.values["chart-type.value"] = self.rng.choice(CHART_TYPES)
+            self.post("update_smart_graph", "chart-type.value")
+        else:
+            button = "simulate-btn" if action == "simulate" else self.rng.choice(["gas-btn", "heating-btn", "water-btn"])
+            key = f"{button}.n_clicks"
+            self.values[key] = (self.values.get(key) or 0) + 1
+            self.post("update", key)
+
+
+def run(app, callbacks, clients, seconds, think, seed=1):
+    pool = [Client(app, callbacks, random.Random(seed + i)) for i in range(clients)]
+    for client in pool:
+        client.act("tick")   # first page load; also warms caches and weather
+    for client in pool:
+        for timings in client.timings.values():
+            timings.clear()
+
+    stop = threading.Event()
+    actions, weights = list(ACTIONS), list(ACTIONS.values())
+
+    def drive(client):
+        while not stop.is_set():
+            client.act(client.rng.choices(actions, weights)[0])
+            if think:
+                stop.wait(client.rng.uniform(0, 2 * think))
+
+    threads = [threading.Thread(target=drive, args=(client,), daemon=True) for client in pool]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    result = {"clients": clients, "seconds": duration, "errors": sum(c.errors for c in pool), "callbacks": {}}
+    total = 0
+    for name in callbacks:
+        timings = sorted(t for client in pool for t in client.timings[name])
+        total += len(timings)
+        result["callbacks"][name] = {
+            "calls": len(timings),
+            "per_second": len(timings) / duration,
+            "p50": percentile(timings, 50),
+            "p95": percentile(timings, 95),
+            "p99": percentile(timings, 99),
+        }
+    result["per_second"] = total / duration
+    return result
+
+
+# -----------------------------
+# Stored results
+# -----------------------------
+def revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_run(path, config):
+    """
+    The last stored run with the same settings, or None.
+    """
+    if not os.path.exists(path):
+        return None
+    last = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("config") == config:
+                last = record
+    return last
+
+
+def change(now, before):
+    if not before:
+        return ""
+    return f"{100 * (now - before) / before:+7.1f}%"
+
+
+def report(result, before):
+    was = f" (last run {before['per_second']:.0f})" if before else ""
+    print(f"\n{result['clients']} clients: {result['per_second']:.0f} requests/s{was}, {result['errors']} errors")
+    print(f"{'callback':<22} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'p95 vs last':>12}")
+    for name in sorted(result["callbacks"], key=lambda n: REPORTED.index(n) if n in REPORTED else len(REPORTED)):
+        stats = result["callbacks"][name]
+        old = (before or {}).get("callbacks", {}).get(name)
+        print(f"{name:<22} {stats['per_second']:8.0f} {stats['p50']:8.2f} {stats['p95']:8.2f} {stats['p99']:8.2f} "
+              f"{change(stats['p95'], old and old['p95']):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the dashboard callbacks with simulated phones")
+    parser.add_argument("--clients", default="1,8,32", help="comma-separated numbers of simultaneous clients")
+    parser.add_argument("--seconds", type=float, default=10, help="how long each client count runs")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between a client's actions (s)")
+    parser.add_argument("--db-ms", type=float, default=0.0, help="simulated database round trip (ms)")
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSON-lines file the runs are appended to")
+    parser.add_argument("--no-save", action="store_true", help="don't append this run")
+    args = parser.parse_args()
+
+    app = build_app(args.db_ms)
+    callbacks = callback_requests(app)
+    config = {"clients": args.clients, "seconds": args.seconds, "think": args.think, "db_ms": args.db_ms}
+    before = previous_run(args.results, config)
+    if before:
+        print(f"comparing with {before['revision']} from {before['at']}")
+
+    runs = []
+    for clients in [int(n) for n in args.clients.split(",")]:
+        result = run(app, callbacks, clients, args.seconds, args.think)
+        old = next((r for r in (before or {}).get("runs", []) if r["clients"] == clients), None)
+        report(result, old)
+        runs.append(result)
+
+    if not args.no_save:
+        record = {"at": datetime.datetime.now().isoformat(timespec="seconds"), "revision": revision(),
+                  "python": sys.version.split()[0], "config": config, "runs": runs}
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"\nsaved to {args.results}")
+
+if __name__ == "__main__":
+    main()
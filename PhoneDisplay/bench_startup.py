@@ -0,0 +1,63 @@
+"""
+Cold-start time of the dashboard.
+
+Every run is a fresh Python process (as a new gunicorn worker or a test
+run would be) that times, one after the other: importing dash, importing
+dashboard, create_app() and serving the first page (index plus layout)
+through Flask's test client. No database is needed: nothing on that path
+connects to it.
+
+    python bench_startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import dash
+t1 = time.perf_counter()
+import dashboard
+t2 = time.perf_counter()
+app = dashboard.create_app()
+t3 = time.perf_counter()
+client = app.server.test_client()
+assert client.get("/").status_code == 200
+assert client.get("/_dash-layout").status_code == 200
+t4 = time.perf_counter()
+print(json.dumps({"import dash": t1 - t0, "import dashboard": t2 - t1, "create_app()": t3 - t2,
+                  "first page": t4 - t3}))
+"""
+
+
+def run_once():
+    env = dict(os.environ, WEATHER_SOURCE="stub")
+    env.pop("DB_PORT", None)   # importing must not need the .env anymore
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=HERE, env=env, capture_output=True, text=True,
+                         check=True).stdout
+    total = time.perf_counter() - start
+    phases = json.loads(out.strip().splitlines()[-1])
+    phases["process total"] = total
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard cold start")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes to start")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(f"{'phase':<18} {'median ms':>10} {'max ms':>10}")
+    for phase in runs[0]:
+        values = sorted(r[phase] * 1000 for r in runs)
+        print(f"{phase:<18} {values[len(values) // 2]:10.1f} {values[-1]:10.1f}")
+
+if __name__ == "__main__":
+    main()
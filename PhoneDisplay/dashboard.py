@@ -1,9 +1,55 @@
 import dash
-from dash import html, Input, Output, dcc
-import datetime, random, requests
+from dash import html, Input, Output, State, Patch, dcc, no_update
+from dash.exceptions import MissingCallbackContextException
+import datetime, random
+import functools
+import logging
 import psycopg2
 from dotenv import load_dotenv
 import os
+import sys
+import threading
+from collections.abc import MutableMapping, Sequence
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from functions.cache import TTLCache
+from functions.connection import ConnectionPool, DatabaseUnavailable
+from functions.migrations import try_migrate
+from functions.notify import ChangeFeed, Listener, event_stream
+from functions.rollups import history
+from functions.state import VersionWatcher, make_state
+
+# Importing this module only defines things: settings, the DB pool, the
+# state store, weather and the example data are made on first use, and
+# the Dash app by create_app() (or on first access to `app`/`server`).
+
+def once(factory):
+    """
+    Decorator for a zero-argument factory: the first call creates the
+    object, later calls (from any thread) return the same one.
+    """
+    lock = threading.Lock()
+    made = []
+
+    @functools.wraps(factory)
+    def get():
+        if not made:
+            with lock:
+                if not made:
+                    made.append(factory())
+        return made[0]
+    return get
+
+
+# Callbacks are declared with @callback next to their functions and
+# attached to the app in create_app(); the functions stay plain functions.
+CALLBACKS = []
+
+def callback(*args, **kwargs):
+    def register(function):
+        CALLBACKS.append((args, kwargs, function))
+        return function
+    return register
 
 # -----------------------------
 # SMART APP: actuator logica
@@ -32,93 +78,157 @@ def bereken_actuatoren(input_data):
         result.append({"date": row['date'], "cv": cv, "ventilatie": ventilatie, "bewatering": bewatering})
     return result
 
-# Genereer de data eenmalig bij opstarten
-smart_app_input = generate_smart_app_data()
-actuator_data = bereken_actuatoren(smart_app_input)
+# Genereer de data eenmalig, bij het eerste gebruik
+@once
+def actuator_data():
+    return bereken_actuatoren(generate_smart_app_data())
 
 
 # -----------------------------
-# PostgreSQL Configuration
+# Configuration (.env)
 # -----------------------------
-load_dotenv()
-
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST"),
-    "port": int(os.getenv("DB_PORT")),
-    "database": os.getenv("DB_NAME"),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD")
-}
+@once
+def settings():
+    """
+    Read from the environment and .env on first use. create_app(**overrides)
+    can change them before anything that uses them is made.
+    """
+    load_dotenv()
+    return {
+        "db": {
+            "host": os.getenv("DB_HOST"),
+            "port": int(os.getenv("DB_PORT") or 5432),
+            "database": os.getenv("DB_NAME"),
+            "user": os.getenv("DB_USER"),
+            "password": os.getenv("DB_PASSWORD"),
+            "connect_timeout": 3
+        },
+        # The Pico's id; makes the sensor read a primary-key lookup
+        "sensor_device": os.getenv("SENSOR_DEVICE"),
+        # "memory" or sqlite:///path/state.db (shared by all workers)
+        "state": os.getenv("DASHBOARD_STATE", "memory"),
+        # Append-only change log file for the memory state
+        "event_log": os.getenv("DASHBOARD_EVENT_LOG"),
+        # "stub" for fixed weather (tests, no internet)
+        "weather_source": os.getenv("WEATHER_SOURCE"),
+    }
 
-def db_connect():
-    try:
-        return psycopg2.connect(**DB_CONFIG)
-    except Exception as e:
-        print("Database connection failed:", e)
-        return None
+# -----------------------------
+# PostgreSQL
+# -----------------------------
+def open_db():
+    conn = psycopg2.connect(**settings()["db"])
+    if get_db().connects == 0:
+        try_migrate(conn)
+    conn.autocommit = True  # read-only queries, don't sit idle in a transaction
+    return conn
+
+# A few connections shared by all callback threads: no handshake per
+# callback, and while the DB is down callbacks skip it right away instead
+# of each waiting for a connect timeout.
+DB_POOL_SIZE = 4
+
+@once
+def get_db():
+    return ConnectionPool(open_db, size=DB_POOL_SIZE, name="dashboard", max_delay=30,
+                          connection_errors=(psycopg2.OperationalError, psycopg2.InterfaceError))
+
+# Query results shared by every session; with 50 phones open the database
+# still sees one sensor query per SENSOR_CACHE_TTL seconds.
+SENSOR_CACHE_TTL = 2
+HISTORY_CACHE_TTL = 30
+sensor_cache = TTLCache(SENSOR_CACHE_TTL)
+history_cache = TTLCache(HISTORY_CACHE_TTL)
 
 # -----------------------------
 # SENSOR FUNCTIONS (LDR + RFID)
 # -----------------------------
-def get_light_state_from_ldr():
+# The bridge keeps one row per (device, sensor) in sensor_latest.
+# SENSOR_DEVICE (the Pico's id) makes the read a primary-key lookup;
+# without it the newest row of any device is used.
+# ldr_raw is the Pico's 16-bit ADC value; below 0.5 V the Pico calls it "Dark"
+LDR_THRESHOLD = int(0.5 / 3.3 * 65535)
+
+# The door card shows "open" this long after the last RFID check-in
+DOOR_OPEN_SECONDS = 10
+
+def query_sensors():
+    """
+    Newest LDR and RFID rows in one round trip:
+    {"ldr": (timestamp, value, label), "rfid": (...)}; None if the DB is unavailable.
+    """
+    device = settings()["sensor_device"]
     try:
-        conn = db_connect()
-        if conn is None:
-            return None
-
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT light_level
-            FROM ldr_readings
-            ORDER BY timestamp DESC
-            LIMIT 1;
-        """)
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
-
-        if row is None:
-            return None
-
-        LDR_THRESHOLD = 500
-        return row[0] > LDR_THRESHOLD
-
+        with get_db().connection() as conn:
+            with conn.cursor() as cur:
+                if device:
+                    cur.execute("""
+                        SELECT sensor, timestamp, value, label
+                        FROM sensor_latest
+                        WHERE device = %s AND sensor IN ('ldr', 'rfid');
+                    """, (device,))
+                else:
+                    cur.execute("""
+                        SELECT DISTINCT ON (sensor) sensor, timestamp, value, label
+                        FROM sensor_latest
+                        WHERE sensor IN ('ldr', 'rfid')
+                        ORDER BY sensor, timestamp DESC;
+                    """)
+                return {row[0]: row[1:] for row in cur.fetchall()}
+    except DatabaseUnavailable:
+        return None
     except Exception as e:
-        print("LDR read failed:", e)
+        print("Sensor read failed:", e)
         return None
 
 
-def get_door_state_from_rfid():
-    try:
-        conn = db_connect()
-        if conn is None:
-            return None
-
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT timestamp
-            FROM rfid_checkin
-            ORDER BY timestamp DESC
-            LIMIT 1;
-        """)
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
-
-        if row is None:
-            return None
-
-        now = datetime.datetime.now(datetime.timezone.utc)
-        return (now - row[0]).total_seconds() < 10
+def read_sensors():
+    return sensor_cache.get("sensors", query_sensors)
 
-    except Exception as e:
-        print("RFID read failed:", e)
+
+def get_light_state_from_ldr(sensors=None):
+    sensors = read_sensors() if sensors is None else sensors
+    row = (sensors or {}).get("ldr")
+    if row is None or row[1] is None:
+        return None
+    return row[1] > LDR_THRESHOLD
+
+
+def get_door_state_from_rfid(sensors=None):
+    sensors = read_sensors() if sensors is None else sensors
+    row = (sensors or {}).get("rfid")
+    if row is None:
         return None
 
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return (now - row[0]).total_seconds() < DOOR_OPEN_SECONDS
+
+
+def query_light_history(hours):
+    """
+    [(bucket, mean, min, max)] of ldr_raw over the last `hours`, from the
+    coarsest rollup table that still gives enough points.
+    """
+    try:
+        with get_db().connection() as conn:
+            end = datetime.datetime.now(datetime.timezone.utc)
+            with conn.cursor() as cur:
+                return history(cur, end - datetime.timedelta(hours=hours), end, settings()["sensor_device"])
+    except DatabaseUnavailable:
+        return []
+    except Exception as e:
+        print("Light history read failed:", e)
+        return []
+
+
+def read_light_history(hours):
+    return history_cache.get(("light", hours), lambda: query_light_history(hours))
+
 
 def refresh_status_from_sensors(status):
-    light = get_light_state_from_ldr()
-    door = get_door_state_from_rfid()
+    sensors = read_sensors()
+    light = get_light_state_from_ldr(sensors)
+    door = get_door_state_from_rfid(sensors)
 
     if light is not None:
         status["light"] = light
@@ -128,37 +238,48 @@ def refresh_status_from_sensors(status):
 
     return status
 
+# -----------------------------
+# Live updates (LISTEN/NOTIFY)
+# -----------------------------
+# The bridge notifies after every committed sensor write; one listening
+# connection turns that into a push to every open page (/events).
+changes = ChangeFeed()
+
+def on_sensor_change(changed):
+    device = settings()["sensor_device"]
+    if device and changed and not any(d == device for d, _ in changed):
+        return False
+    sensor_cache.invalidate()
+    if not changed or any(sensor == "rfid" for _, sensor in changed):
+        listener.later(DOOR_OPEN_SECONDS + 0.5)
+    return True
+
+listener = Listener(lambda: psycopg2.connect(**settings()["db"]), changes, on_notify=on_sensor_change)
+
 # -----------------------------
 # Weather API
 # -----------------------------
-def get_weather():
-    lat, lon = 52.09, 5.12
-    url = (
-        f"https://api.open-meteo.com/v1/forecast"
-        f"?latitude={lat}&longitude={lon}"
-        f"&current_weather=true&hourly=relativehumidity_2m"
-    )
-    response = requests.get(url)
-    data = response.json()
-
-    current = data["current_weather"]
-    temp = round(current["temperature"])
-    wind = current["windspeed"]
-    code = current["weathercode"]
-
-    humidity = data["hourly"]["relativehumidity_2m"][0]
-
-    weather_codes = {
-        0: "Clear sky", 1: "Mainly clear", 2: "Partly cloudy", 3: "Overcast",
-        45: "Fog", 48: "Depositing rime fog", 51: "Light drizzle",
-        53: "Moderate drizzle", 55: "Dense drizzle", 61: "Slight rain",
-        63: "Moderate rain", 65: "Heavy rain", 71: "Slight snow fall",
-        73: "Moderate snow fall", 75: "Heavy snow fall", 95: "Thunderstorm",
-        96: "Thunderstorm with slight hail", 99: "Thunderstorm with heavy hail"
-    }
-    description = weather_codes.get(code, f"Weather code {code}")
+# Refreshed in the background; callbacks only read the last result.
+# WEATHER_SOURCE=stub uses fixed values (tests, no internet).
+WEATHER_REFRESH = 300
+
+def make_weather_source():
+    # Imported here: requests is only needed once the weather card asks
+    from functions.weather import OpenMeteoSource, StubSource
+    if settings()["weather_source"] == "stub":
+        return StubSource()
+    return OpenMeteoSource(52.09, 5.12)
+
+@once
+def weather():
+    from functions.weather import WeatherProvider
+    return WeatherProvider(make_weather_source(), interval=WEATHER_REFRESH)
 
-    return temp, humidity, wind, description
+def get_weather():
+    reading = weather().get()
+    if reading is None or reading.weather is None:
+        raise RuntimeError(str(reading.error) if reading and reading.error else "Loading weather...")
+    return reading.weather
 
 # -----------------------------
 # WEEKLY ENERGY DATA (Example Lines)
@@ -183,54 +304,165 @@ def generate_weekly_energy_data():
 
     return days, used, saved, baseline
 
-weekly_days, weekly_used, weekly_saved, weekly_baseline = generate_weekly_energy_data()
+weekly_energy_data = once(generate_weekly_energy_data)
 
 # -----------------------------
-# App & State
+# State
 # -----------------------------
-app = dash.Dash(__name__)
-app.title = "Smart Home Dashboard"
-
-status = {
+# Device state and the change log live in a store shared by all worker
+# processes when DASHBOARD_STATE=sqlite:///path/state.db; the default
+# keeps them in this process (dev server, tests), with the full log in
+# the append-only DASHBOARD_EVENT_LOG file if set.
+DEFAULT_STATUS = {
     "light": True,
     "gas": False,
     "heating": True,
     "water": False,
     "door": False
 }
-recent_changes = []
+RECENT_MAX = 5
+
+@once
+def get_store():
+    return make_state(settings()["state"], DEFAULT_STATUS, RECENT_MAX, log_path=settings()["event_log"])
+
+# Changes made by another worker reach this process's pages through /events
+@once
+def state_watcher():
+    return VersionWatcher(get_store(), changes.publish)
+
+
+# Flask routes, added in create_app() (flask is imported there by Dash anyway)
+# Each open page keeps its /events stream for as long as it's open, which
+# would tie up a gunicorn sync worker until the timeout kills it: run with
+# -k gthread --threads N (see README).
+def events():
+    import flask
+    listener.start()
+    state_watcher().start()
+    return flask.Response(event_stream(changes), mimetype="text/event-stream",
+                          headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Audit trail: /api/changes?limit=50, then ?before=<next> for older pages
+def change_history():
+    import flask
+    before = flask.request.args.get("before", type=int)
+    limit = max(1, min(flask.request.args.get("limit", 50, type=int), 500))
+    entries = get_store().page(before, limit)
+    return flask.jsonify({
+        "changes": entries,
+        "next": entries[-1]["seq"] if len(entries) == limit else None
+    })
+
+# Cards in layout order; light and door follow the sensors, the rest is manual
+DEVICES = [("Light", "light", "💡"), ("Gas", "gas", "💨"), ("Heating", "heating", "🔥"),
+           ("Water", "water", "🚰"), ("Door", "door", "🚪")]
+AUTO = ("light", "door")
+MANUAL = ("gas", "heating", "water")
 
 # -----------------------------
 # Helpers
 # -----------------------------
+# Log entries are stored as compact records and only turned into
+# components here, when a callback returns them:
+#   {"at": iso time, "device": "Gas", "on": true}
+#   {"at": iso time, "simulated": ["gas", "water"]}
+def log_entry(**fields):
+    return dict(at=datetime.datetime.now().astimezone().isoformat(timespec="seconds"), **fields)
+
+
+def log_item(entry):
+    time = datetime.datetime.fromisoformat(entry["at"]).strftime("%I:%M:%S %p")
+    simulated = entry.get("simulated")
+
+    if simulated:
+        return html.Div(className="log-item", children=[
+            html.Div(className="log-title",
+                     children=f"Simulation toggled: {', '.join(c.capitalize() for c in simulated)}"),
+            html.Span("Mixed", className="badge simulate")
+        ])
+    if simulated is not None:
+        return html.Div(className="log-item", children=[
+            html.Div(className="log-title", children="Simulation made no changes"),
+            html.Div(className="log-time", children=time),
+            html.Span("None", className="badge simulate")
+        ])
+
+    on = entry["on"]
+    return html.Div(className="log-item", children=[
+        html.Div(className="log-title", children=f"{entry['device']} turned {'on' if on else 'off'}"),
+        html.Div(className="log-time", children=time),
+        html.Span("On" if on else "Off", className=f"badge {'on' if on else 'off'}")
+    ])
+
+
+class StatusView(MutableMapping):
+    """
+    The device states in the store, used like a dict.
+    """
+
+    def __init__(self, get_store):
+        self.get_store = get_store
+
+    def __getitem__(self, key):
+        return self.get_store().get(key)
+
+    def __setitem__(self, key, value):
+        self.get_store().set(key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("devices can't be removed")
+
+    def __iter__(self):
+        return iter(self.get_store().snapshot())
+
+    def __len__(self):
+        return len(self.get_store().snapshot())
+
+
+class RecentChanges(Sequence):
+    """
+    The newest log entries as components, newest first.
+    """
+
+    def __init__(self, get_store):
+        self.get_store = get_store
+
+    def __getitem__(self, index):
+        return [log_item(entry) for entry in self.get_store().recent()][index]
+
+    def __len__(self):
+        return len(self.get_store().recent())
+
+    def clear(self):
+        self.get_store().clear_log()
+
+
+status = StatusView(get_store)
+recent_changes = RecentChanges(get_store)
+
+
 def log_change(name, state):
-    time = datetime.datetime.now().strftime("%I:%M:%S %p")
-    recent_changes.insert(
-        0,
-        html.Div(
-            className="log-item",
-            children=[
-                html.Div(className="log-title", children=f"{name} turned {'on' if state else 'off'}"),
-                html.Div(className="log-time", children=time),
-                html.Span("On" if state else "Off", className=f"badge {'on' if state else 'off'}")
-            ]
-        )
-    )
-    if len(recent_changes) > 5:
-        recent_changes.pop()
+    return get_store().add_log(log_entry(device=name, on=bool(state)))
 
 
 def toggle(key, label):
-    status[key] = not status[key]
-    log_change(label, status[key])
+    # One atomic flip in the store, whichever worker handles the click
+    return log_change(label, get_store().toggle(key)[key])
 
 
-def card(name, key, icon, on):
-    auto = key in ("light", "door")
+def card_class(key, on):
+    return f"utility {'on '+key if on else 'off'}"
+
+
+def card(name, key, icon, on=None):
+    auto = key in AUTO
+    on = status[key] if on is None else on
 
     return html.Div(
         id=f"{key}-card",
-        className=f"utility {'on '+key if on else 'off'}",
+        className=card_class(key, on),
         children=[
             html.H3(f"{icon} {name}"),
             html.Small("Auto" if auto else ("On" if on else "Off")),
@@ -247,82 +479,122 @@ def card(name, key, icon, on):
         ]
     )
 
+
+def card_patch(key, on):
+    """
+    Partial update of card(...).children for a flipped card: only the texts
+    and button class that depend on the state, not the whole card.
+    """
+    patch = Patch()
+    patch[2]["props"]["children"][1]["props"]["children"] = "On" if on else "Off"
+    if key not in AUTO:
+        patch[1]["props"]["children"] = "On" if on else "Off"
+        patch[3]["props"]["children"] = "Turn Off" if on else "Turn On"
+        patch[3]["props"]["className"] = "btn-off" if on else "btn-on"
+    return patch
+
+
+def log_patch(entry):
+    """
+    Prepends one new entry to the page's log and drops the oldest.
+    """
+    patch = Patch()
+    patch.prepend(log_item(entry))
+    del patch[RECENT_MAX]
+    return patch
+
 # -----------------------------
 # Layout
 # -----------------------------
-app.layout = html.Div(className="page", children=[
+# A function, so every page load starts from the current state
+def serve_layout():
+    current = get_store().snapshot()
+    return html.Div(className="page", children=[
 
-    # Left column
-    html.Div(children=[
+        # Left column
+        html.Div(children=[
 
-        # Weather card
-        html.Div(id="weather-card", className="card weather"),
-        dcc.Interval(id="main-interval", interval=30000, n_intervals=0),
+            # Weather card
+            html.Div(id="weather-card", className="card weather"),
+            dcc.Interval(id="main-interval", interval=30000, n_intervals=0),
+            dcc.Store(id="live-version"),
 
-        html.Br(),
+            html.Br(),
 
-        # Utilities
-        html.Div(className="utilities", children=[
-            card("Light", "light", "💡", status["light"]),
-            card("Gas", "gas", "💨", status["gas"]),
-            card("Heating", "heating", "🔥", status["heating"]),
-            card("Water", "water", "🚰", status["water"]),
-            card("Door", "door", "🚪", status["door"]),
+            # Utilities
+            html.Div(className="utilities", children=[card(name, key, icon, current[key]) for name, key, icon in DEVICES]),
+
+            html.Br(),
+
+            html.Button("Simulate Random Change", id="simulate-btn", className="btn-simulate")
         ]),
 
-        html.Br(),
+        # Right column
+        html.Div(children=[
 
-        html.Button("Simulate Random Change", id="simulate-btn", className="btn-simulate")
-    ]),
+            html.Div(className="card recent", children=[
+                html.H3("🕒 Recent Changes"),
+                html.Div(id="recent-log", children=[log_item(entry) for entry in get_store().recent()])
+            ]),
 
-    # Right column
-    html.Div(children=[
+            html.Br(),
 
-        html.Div(className="card recent", children=[
-            html.H3("🕒 Recent Changes"),
-            html.Div(id="recent-log")
-        ]),
+            # Energy Graph
+            html.Div(className="card", children=[
+                html.H3("🔌 Weekly Energy Usage & Savings"),
+                dcc.Graph(id="energy-graph")
+            ]),
 
-        html.Br(),
+            html.Br(),
+
+            # Light history (rollups)
+            html.Div(className="card", children=[
+                html.H3("💡 Light Level"),
+                dcc.Dropdown(
+                    id="light-range",
+                    options=[
+                        {"label": "Laatste 24 uur", "value": 24},
+                        {"label": "Laatste 7 dagen", "value": 24 * 7},
+                        {"label": "Laatste 90 dagen", "value": 24 * 90}
+                    ],
+                    value=24
+                ),
+                dcc.Graph(id="light-graph")
+            ]),
 
-        # Energy Graph
-        html.Div(className="card", children=[
-            html.H3("🔌 Weekly Energy Usage & Savings"),
-            dcc.Graph(id="energy-graph")
-        ]),
+            html.Br(),
+
+            # Smart App grafiek
+            html.Div(className="card", children=[
+                html.H3("⚡ Smart App Actuatoren"),
+                html.Label("Kies grafiektype:"),
+                dcc.Dropdown(
+                    id="chart-type",
+                    options=[
+                        {"label": "Lijn grafiek", "value": "line"},
+                        {"label": "Scatter plot", "value": "scatter"},
+                        {"label": "Staafdiagram", "value": "bar"}
+                    ],
+                    value="line"
+                ),
+                dcc.Graph(id="smart-graph")
+            ])
 
-        html.Br(),
-
-        # Smart App grafiek
-        html.Div(className="card", children=[
-            html.H3("⚡ Smart App Actuatoren"),
-            html.Label("Kies grafiektype:"),
-            dcc.Dropdown(
-                id="chart-type",
-                options=[
-                    {"label": "Lijn grafiek", "value": "line"},
-                    {"label": "Scatter plot", "value": "scatter"},
-                    {"label": "Staafdiagram", "value": "bar"}
-                ],
-                value="line"
-            ),
-            dcc.Graph(id="smart-graph")
         ])
-
     ])
-])
+
 
     # -----------------------------
 # Weather Callback
 # -----------------------------
-@app.callback(
+@callback(
     Output("weather-card", "children"),
     Input("main-interval", "n_intervals")
 )
 def update_weather(_):
     try:
         temp, humidity, wind, description = get_weather()
-        return [
+        children = [
             html.Small("☀️ Utrecht"),
             html.H1(f"{temp}°C"),
             html.P(description),
@@ -331,17 +603,22 @@ def update_weather(_):
                 html.Div(f"🌬️ Wind {wind} m/s")
             ])
         ]
+        age = weather().age()
+        if age is not None and age > 2 * WEATHER_REFRESH:
+            children.append(html.Small(f"Updated {int(age // 60)} min ago"))
+        return children
     except Exception as e:
         return [html.Small("Weather unavailable"), html.P(str(e))]
 
 # -----------------------------
 # Energy Graph Callback
 # -----------------------------
-@app.callback(
+@callback(
     Output("energy-graph", "figure"),
     Input("main-interval", "n_intervals")
 )
 def update_energy_graph(_):
+    weekly_days, weekly_used, weekly_saved, weekly_baseline = weekly_energy_data()
     fig = {
         "data": [
             {
@@ -381,94 +658,168 @@ def update_energy_graph(_):
     return fig
 
 # -----------------------------
-# Utility Callback
+# Light History Callback
 # -----------------------------
-@app.callback(
-    Output("light-card", "children"),
-    Output("gas-card", "children"),
-    Output("heating-card", "children"),
-    Output("water-card", "children"),
-    Output("door-card", "children"),
+@callback(
+    Output("light-graph", "figure"),
+    Input("light-range", "value"),
+    Input("main-interval", "n_intervals")
+)
+def update_light_graph(hours, _):
+    rows = read_light_history(hours)
+    buckets = [row[0] for row in rows]
+    return {
+        "data": [
+            {
+                "x": buckets,
+                "y": [row[3] for row in rows],
+                "type": "scatter",
+                "mode": "lines",
+                "name": "Max",
+                "line": {"width": 0},
+                "showlegend": False
+            },
+            {
+                "x": buckets,
+                "y": [row[2] for row in rows],
+                "type": "scatter",
+                "mode": "lines",
+                "name": "Min / Max",
+                "fill": "tonexty",
+                "line": {"width": 0},
+                "fillcolor": "rgba(255,193,7,0.25)"
+            },
+            {
+                "x": buckets,
+                "y": [row[1] for row in rows],
+                "type": "scatter",
+                "mode": "lines",
+                "name": "Gemiddeld",
+                "line": {"color": "#ffc107", "width": 3}
+            }
+        ],
+        "layout": {
+            "xaxis": {"title": "Tijd"},
+            "yaxis": {"title": "ldr_raw"},
+            "paper_bgcolor": "rgba(0,0,0,0)",
+            "plot_bgcolor": "rgba(0,0,0,0)"
+        }
+    }
+
+# -----------------------------
+# Live updates: the page opens /events once and copies every pushed
+# version into the live-version store, which triggers refresh_cards.
+# -----------------------------
+LIVE_EVENTS_JS = """
+function(id) {
+    if (window.EventSource && !window.liveEvents) {
+        window.liveEvents = new EventSource("%s");
+        window.liveEvents.onmessage = function(e) {
+            window.dash_clientside.set_props("live-version", {data: e.data});
+        };
+    }
+    return window.dash_clientside.no_update;
+}
+"""
+
+# -----------------------------
+# Utility Callbacks
+# -----------------------------
+# Each card is updated on its own, with a Patch of just the parts that
+# changed; cards that didn't change are left out of the response.
+def card_outputs(keys, allow_duplicate=False):
+    outputs = []
+    for key in keys:
+        outputs.append(Output(f"{key}-card", "className", allow_duplicate=allow_duplicate))
+        outputs.append(Output(f"{key}-card", "children", allow_duplicate=allow_duplicate))
+    return outputs
+
+
+def card_updates(keys, before, now):
+    """
+    (className, children patch) per key, or no_update for cards whose state
+    in `now` equals `before[key]`.
+    """
+    result = []
+    for key in keys:
+        if now[key] == before.get(key):
+            result += [no_update, no_update]
+        else:
+            result += [card_class(key, now[key]), card_patch(key, now[key])]
+    return result
+
+
+def triggered_button(args, inputs):
+    # Outside a Dash request (tests) the clicked button is the one with clicks
+    try:
+        return dash.ctx.triggered_id
+    except MissingCallbackContextException:
+        clicked = [i for i, n in zip(inputs, args) if n]
+        return clicked[-1] if clicked else None
+
+
+# Manual buttons: state lives on the server, no sensor reads
+MANUAL_BUTTONS = [f"{key}-btn" for key in MANUAL] + ["simulate-btn"]
+
+@callback(
+    *card_outputs(MANUAL, allow_duplicate=True),
     Output("recent-log", "children"),
-    Input("light-btn", "n_clicks"),
-    Input("gas-btn", "n_clicks"),
-    Input("heating-btn", "n_clicks"),
-    Input("water-btn", "n_clicks"),
-    Input("door-btn", "n_clicks"),
-    Input("simulate-btn", "n_clicks"),
+    *[Input(button, "n_clicks") for button in MANUAL_BUTTONS],
+    prevent_initial_call=True
 )
 def update(*args):
-    global status
-
-    # AUTO SENSOR UPDATE
-    status = refresh_status_from_sensors(status)
-
-    ctx = dash.callback_context
-    if ctx.triggered:
-        btn = ctx.triggered[0]["prop_id"].split(".")[0]
-
-        # Manual toggles (only for non-sensor devices)
-        if btn == "gas-btn": toggle("gas", "Gas")
-        if btn == "heating-btn": toggle("heating", "Heating")
-        if btn == "water-btn": toggle("water", "Water")
-
-        # SIMULATION — ONLY gas/heating/water
-        if btn == "simulate-btn":
-            sim_keys = ["gas", "heating", "water"]
-            num_to_toggle = random.randint(0, len(sim_keys))
-            choices = random.sample(sim_keys, num_to_toggle)
-
-            for choice in choices:
-                status[choice] = not status[choice]
-
-            time = datetime.datetime.now().strftime("%I:%M:%S %p")
-            if choices:
-                recent_changes.insert(
-                    0,
-                    html.Div(
-                        className="log-item",
-                        children=[
-                            html.Div(className="log-title",
-                                     children=f"Simulation toggled: {', '.join(c.capitalize() for c in choices)}"),
-                            html.Span("Mixed", className="badge simulate")
-                        ]
-                    )
-                )
-            else:
-                recent_changes.insert(
-                    0,
-                    html.Div(
-                        className="log-item",
-                        children=[
-                            html.Div(className="log-title", children="Simulation made no changes"),
-                            html.Div(className="log-time", children=time),
-                            html.Span("None", className="badge simulate")
-                        ]
-                    )
-                )
-
-            if len(recent_changes) > 5:
-                recent_changes.pop()
-
-    return (
-        card("Light", "light", "💡", status["light"]).children,
-        card("Gas", "gas", "💨", status["gas"]).children,
-        card("Heating", "heating", "🔥", status["heating"]).children,
-        card("Water", "water", "🚰", status["water"]).children,
-        card("Door", "door", "🚪", status["door"]).children,
-        recent_changes
-    )
+    before = get_store().snapshot()
+    btn = triggered_button(args, MANUAL_BUTTONS)
+    entry = None
+
+    if btn == "gas-btn": entry = toggle("gas", "Gas")
+    if btn == "heating-btn": entry = toggle("heating", "Heating")
+    if btn == "water-btn": entry = toggle("water", "Water")
+
+    # SIMULATION — ONLY gas/heating/water
+    if btn == "simulate-btn":
+        sim_keys = list(MANUAL)
+        num_to_toggle = random.randint(0, len(sim_keys))
+        choices = random.sample(sim_keys, num_to_toggle)
+
+        get_store().toggle(*choices)
+        entry = get_store().add_log(log_entry(simulated=choices))
+
+    now = get_store().snapshot()
+    if now != before:
+        changes.publish()   # other open pages pick it up through /events
+
+    return tuple(card_updates(MANUAL, before, now) + [log_patch(entry) if entry else no_update])
+
+
+# Sensor cards, plus bringing every card in line with the shared state
+# after a push (a change from another page or a new reading) or on the
+# fallback interval. The page's current classes tell what to send.
+@callback(
+    *card_outputs(key for _, key, _ in DEVICES),
+    Input("live-version", "data"),
+    Input("main-interval", "n_intervals"),
+    *[State(f"{key}-card", "className") for _, key, _ in DEVICES]
+)
+def refresh_cards(_version, _n, *classes):
+    refresh_status_from_sensors(status)
+
+    shown = {}
+    for (_, key, _), className in zip(DEVICES, classes):
+        shown[key] = None if className is None else className == card_class(key, True)
+    return tuple(card_updates([key for _, key, _ in DEVICES], shown, get_store().snapshot()))
 
-@app.callback(
+@callback(
     Output("smart-graph","figure"),
     Input("chart-type","value"),
     Input("main-interval","n_intervals")  # zodat de grafiek periodiek kan verversen
 )
 def update_smart_graph(chart_type, _):
-    x = [d["date"] for d in actuator_data]
-    cv = [d["cv"] for d in actuator_data]
-    vent = [d["ventilatie"] for d in actuator_data]
-    water = [1 if d["bewatering"] else 0 for d in actuator_data]  # bool -> 0/1
+    data = actuator_data()
+    x = [d["date"] for d in data]
+    cv = [d["cv"] for d in data]
+    vent = [d["ventilatie"] for d in data]
+    water = [1 if d["bewatering"] else 0 for d in data]  # bool -> 0/1
 
     fig = {
         "data": [
@@ -487,8 +838,48 @@ def update_smart_graph(chart_type, _):
     return fig
 
 
+# -----------------------------
+# App
+# -----------------------------
+def create_app(**overrides):
+    """
+    Builds the Dash app. `overrides` replace settings() entries (e.g.
+    state="sqlite:///..."); they only affect what hasn't been made yet.
+    """
+    settings().update(overrides)
+
+    app = dash.Dash(__name__)
+    app.title = "Smart Home Dashboard"
+    app.layout = serve_layout
+
+    prefix = app.config.routes_pathname_prefix
+    app.server.add_url_rule(prefix + "events", "events", events)
+    app.server.add_url_rule(prefix + "api/changes", "change_history", change_history)
+
+    for args, kwargs, function in CALLBACKS:
+        app.callback(*args, **kwargs)(function)
+    app.clientside_callback(
+        LIVE_EVENTS_JS % app.get_relative_path("/events"),
+        Output("live-version", "data"),
+        Input("live-version", "id")
+    )
+    return app
+
+
+default_app = once(create_app)
+
+def __getattr__(name):
+    # `app` and `server` (gunicorn: PhoneDisplay.dashboard:server) are
+    # built on first access instead of on import
+    if name == "app":
+        return default_app()
+    if name == "server":
+        return default_app().server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # -----------------------------
 # Main
 # -----------------------------
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from functions.cache import TTLCache
+
+
+def test_expires_after_ttl():
+    now = [0.0]
+    cache = TTLCache(2, clock=lambda: now[0])
+    values = iter([1, 2])
+    assert cache.get("k", lambda: next(values)) == 1
+    now[0] = 1.9
+    assert cache.get("k", lambda: next(values)) == 1
+    now[0] = 2.0
+    assert cache.get("k", lambda: next(values)) == 2
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(60)
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.1)
+        return {"ldr": (None, 20000.0, "Bright")}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("sensors", load))) for _ in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert len(results) == 50 and all(r is results[0] for r in results)
+
+
+def test_failed_load_is_retried_by_the_next_caller():
+    cache = TTLCache(60)
+
+    def broken():
+        raise RuntimeError("boom")
+
+    try:
+        cache.get("k", broken)
+    except RuntimeError:
+        pass
+    assert cache.get("k", lambda: 5) == 5
@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from functions.CodeTests.fakes import FakeConn
+from functions.connection import Backoff, ConnectionManager, ConnectionPool, DatabaseUnavailable, DOWN, UP
+
+
+class PingedConn(FakeConn):
+    dead = False
+
+    def answer(self, sql, params):
+        if self.dead:
+            raise OSError("server closed the connection")
+        return [(1,)]
+
+
+class FlakyConnect:
+    def __init__(self, fail_times):
+        self.fail_times = fail_times
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise OSError("connection refused")
+        return PingedConn()
+
+
+def test_backoff_grows_and_is_capped():
+    backoff = Backoff(base=1, max_delay=8)
+    delays = [backoff.next_delay() for _ in range(6)]
+    assert 0.5 <= delays[0] <= 1
+    assert 4 <= delays[3] <= 8
+    assert all(d <= 8 for d in delays)
+    backoff.reset()
+    assert backoff.next_delay() <= 1
+
+
+def test_fails_fast_while_down():
+    connect = FlakyConnect(fail_times=1)
+    db = ConnectionManager(connect, base_delay=60)
+
+    assert db.try_get() is None
+    assert db.state == DOWN
+    # Circuit open: no new connect attempt until the backoff expires
+    assert db.try_get() is None
+    assert connect.calls == 1
+    assert not db.available()
+
+    db.next_attempt = 0
+    assert db.try_get() is not None
+    assert db.state == UP
+    assert connect.calls == 2
+
+
+def test_ping_detects_dead_connection():
+    db = ConnectionManager(FlakyConnect(0), ping_interval=0)
+    conn = db.get()
+    assert db.ping()
+
+    conn.dead = True
+    assert not db.ping()
+    assert conn.closed
+    assert db.conn is None
+    assert db.state == DOWN
+
+
+def test_pool_reuses_connections_across_threads():
+    connect = FlakyConnect(0)
+    pool = ConnectionPool(connect, size=2)
+    barrier = threading.Barrier(2)
+
+    def borrow():
+        with pool.connection():
+            barrier.wait(timeout=5)   # both borrowed at once
+        for _ in range(10):
+            with pool.connection():
+                pass
+
+    threads = [threading.Thread(target=borrow) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert connect.calls == 2
+    assert pool.status()["idle"] == 2 and pool.status()["borrows"] == 22
+
+
+def test_pool_discards_broken_connection_and_fails_fast():
+    connect = FlakyConnect(0)
+    pool = ConnectionPool(connect, size=2, base_delay=60, connection_errors=(OSError,))
+
+    with pytest.raises(OSError):
+        with pool.connection() as conn:
+            conn.dead = True
+            conn.cursor().execute("SELECT 1")
+    assert conn.closed and pool.state == DOWN
+
+    with pytest.raises(DatabaseUnavailable):
+        with pool.connection():
+            pass
+    assert connect.calls == 1
+
+    pool.next_attempt = 0
+    with pool.connection() as conn:
+        assert not conn.dead
+    assert pool.state == UP
+
+
+def test_pool_waits_for_a_free_connection():
+    pool = ConnectionPool(FlakyConnect(0), size=1, wait=0.05)
+    with pool.connection():
+        with pytest.raises(DatabaseUnavailable):
+            with pool.connection():
+                pass
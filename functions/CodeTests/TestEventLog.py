@@ -0,0 +1,34 @@
+from functions.eventlog import EventLog, read_backwards
+
+
+def test_ring_holds_newest_and_file_holds_everything(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    log = EventLog(path, size=3)
+    for i in range(10):
+        log.append({"n": i})
+    assert [r["n"] for r in log.recent()] == [9, 8, 7]
+
+    log.clear()
+    assert log.recent() == []
+    assert [r["seq"] for r in log.page(limit=4)] == [10, 9, 8, 7]
+    assert [r["n"] for r in log.page(before=3)] == [1, 0]
+
+
+def test_reopen_restores_ring_and_sequence(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    log = EventLog(path, size=2)
+    for i in range(5):
+        log.append({"n": i})
+    log.close()
+    with open(path, "a") as f:
+        f.write('{"n": 5, "se')              # torn write from a crash
+
+    log = EventLog(path, size=2)
+    assert [r["n"] for r in log.recent()] == [4, 3]
+    assert log.append({"n": 6})["seq"] == 6
+
+
+def test_read_backwards_across_blocks(tmp_path):
+    path = tmp_path / "lines.txt"
+    path.write_text("".join(f"line {i}\n" for i in range(100)))
+    assert list(read_backwards(str(path), block=7)) == [f"line {i}" for i in reversed(range(100))]
@@ -0,0 +1,44 @@
+from functions.CodeTests.fakes import FakeConn
+from functions.migrations import check_plans, migrate
+
+
+class MigrationsConn(FakeConn):
+    def __init__(self, applied=(), plans=None):
+        super().__init__()
+        self.applied = set(applied)
+        self.plans = plans or {}
+
+    def answer(self, sql, params):
+        if sql.startswith("SELECT version"):
+            return [(v,) for v in self.applied]
+        if sql.startswith("SELECT 1 FROM public.schema_migrations"):
+            return [(1,)] if params[0] in self.applied else []
+        if sql.startswith("EXPLAIN"):
+            return [(self.plans[sql[len("EXPLAIN (FORMAT JSON) "):]],)]
+        if sql.startswith("INSERT INTO public.schema_migrations"):
+            self.applied.add(params[0])
+        return None
+
+
+MIGRATIONS = [(1, "one", "CREATE TABLE a ()"), (2, "two", "CREATE TABLE b ()"), (3, "three", "CREATE TABLE c ()")]
+
+
+def test_only_pending_migrations_run_in_order():
+    conn = MigrationsConn(applied={1})
+    assert migrate(conn, MIGRATIONS) == [2, 3]
+    assert [sql for sql, _ in conn.executed if sql.startswith("CREATE TABLE ")] == ["CREATE TABLE b ()", "CREATE TABLE c ()"]
+
+    # Second startup: nothing left to do
+    assert migrate(conn, MIGRATIONS) == []
+
+
+def test_check_plans_flags_seq_scans():
+    index = [{"Plan": {"Node Type": "Limit", "Plans": [{"Node Type": "Index Scan", "Relation Name": "ldr_readings"}]}}]
+    seq = [{"Plan": {"Node Type": "Limit", "Plans": [{"Node Type": "Sort", "Plans": [
+        {"Node Type": "Seq Scan", "Relation Name": "rfid_checkin"}]}]}}]
+    conn = MigrationsConn(plans={"q1": index, "q2": seq})
+
+    results = check_plans(conn, {"latest": "q1", "history": "q2"})
+
+    assert results["latest"] == (True, ["Limit", "Index Scan"])
+    assert results["history"][0] is False
@@ -0,0 +1,35 @@
+import threading
+
+from functions.notify import ChangeFeed, Listener, event_stream
+
+
+def test_wait_returns_on_publish_or_timeout():
+    feed = ChangeFeed()
+    assert feed.wait(0, 0.01) == 0
+
+    threading.Timer(0.05, feed.publish).start()
+    assert feed.wait(0, 5) == 1
+
+
+def test_handle_decodes_payloads_and_lets_on_notify_filter():
+    seen = []
+    feed = ChangeFeed()
+    listener = Listener(None, feed, on_notify=lambda changes: seen.append(changes) or changes[0][0] == "E661")
+
+    listener.handle(['[["E661", "ldr"]]', '[["E661", "rfid"]]'])
+    assert seen[0] == [["E661", "ldr"], ["E661", "rfid"]]
+    assert feed.version == 1
+
+    listener.handle(['[["OTHER", "ldr"]]'])
+    assert feed.version == 1 and listener.notifications == 3
+
+
+def test_event_stream_sends_current_version_then_changes():
+    feed = ChangeFeed()
+    stream = event_stream(feed, heartbeat=0.01, min_interval=0)
+    assert next(stream).endswith("data: 0\n\n")
+    assert next(stream) == ": ping\n\n"
+
+    feed.publish()
+    feed.publish()
+    assert next(stream) == "data: 2\n\n"
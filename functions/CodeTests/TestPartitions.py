@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+
+from functions.CodeTests.fakes import FakeConn
+from functions.partitions import add_intervals, interval_start, maintain, parse_bound, partition_name
+
+NOW = datetime(2026, 10, 18, 12, 30, tzinfo=timezone.utc)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class FakeCatalog(FakeConn):
+    """
+    Answers the catalog queries maintain() runs with a fixed partition list;
+    everything else it runs is DDL.
+    """
+
+    def __init__(self, bounds):
+        super().__init__()
+        self.bounds = bounds
+
+    @property
+    def ddl(self):
+        return [" ".join(sql.split()) for sql, _ in self.executed
+                if not sql.startswith(("SELECT relkind", "SET")) and "pg_inherits" not in sql]
+
+    def answer(self, sql, params):
+        if sql.startswith("SELECT relkind"):
+            return [("p",)]
+        if "pg_inherits" in sql:
+            table = params[0].split(".")[1]
+            return [(f"{table}_{name}", bound) for name, bound in self.bounds]
+        return None
+
+
+def test_interval_arithmetic():
+    assert interval_start(NOW, "month") == utc(2026, 10, 1)
+    assert interval_start(NOW, "week") == utc(2026, 10, 12)
+    assert add_intervals(utc(2026, 11, 1), "month", 3) == utc(2027, 2, 1)
+    assert add_intervals(utc(2026, 1, 1), "month", -2) == utc(2025, 11, 1)
+    assert partition_name("ldr_readings", utc(2026, 11, 1), "month") == "ldr_readings_p2026_11"
+
+
+def test_parse_bound():
+    assert parse_bound("MINVALUE") is None
+    assert parse_bound("'2026-11-01 00:00:00+00'") == utc(2026, 11, 1)
+
+
+def test_creates_ahead_and_detaches_expired():
+    catalog = FakeCatalog([
+        ("legacy", "FOR VALUES FROM (MINVALUE) TO ('2026-09-01 00:00:00+00')"),
+        ("p2026_09", "FOR VALUES FROM ('2026-09-01 00:00:00+00') TO ('2026-10-01 00:00:00+00')"),
+        ("p2026_10", "FOR VALUES FROM ('2026-10-01 00:00:00+00') TO ('2026-11-01 00:00:00+00')"),
+        ("default", "DEFAULT"),
+    ])
+
+    result = maintain(catalog, interval="month", ahead=2, retention=1, now=NOW)
+
+    assert result["created"] == ["rfid_checkin_p2026_11", "rfid_checkin_p2026_12",
+                                 "ldr_readings_p2026_11", "ldr_readings_p2026_12"]
+    # Only partitions that ended before September (one month back) go
+    assert result["detached"] == ["rfid_checkin_legacy", "ldr_readings_legacy"]
+    assert any("DELETE FROM public.ldr_readings_default" in sql for sql in catalog.ddl)
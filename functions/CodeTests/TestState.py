@@ -0,0 +1,74 @@
+import multiprocessing
+
+import pytest
+
+from functions.state import MemoryState, SqliteState, VersionWatcher, make_state
+
+INITIAL = {"gas": False, "water": True}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryState(INITIAL, log_size=3, log_path=str(tmp_path / "events.jsonl"))
+    return SqliteState(str(tmp_path / "state.db"), INITIAL, log_size=3)
+
+
+def test_toggle_set_and_version(store):
+    version = store.version()
+    assert store.toggle("gas", "water") == {"gas": True, "water": False}
+    assert store.snapshot() == {"gas": True, "water": False}
+
+    assert not store.set("gas", True)          # no change, no new version
+    assert store.version() == version + 1
+    assert store.set("gas", False) and store.get("gas") is False
+    assert store.version() == version + 2
+
+
+def test_log_keeps_newest_entries(store):
+    for i in range(5):
+        store.add_log({"title": str(i)})
+    assert [entry["title"] for entry in store.recent()] == ["4", "3", "2"]
+    store.clear_log()
+    assert store.recent() == []
+
+
+def test_log_pages_back_through_history(store):
+    for i in range(5):
+        store.add_log({"title": str(i)})
+    store.clear_log()
+    newest = store.page(limit=2)
+    assert [entry["title"] for entry in newest] == ["4", "3"]
+    assert [entry["title"] for entry in store.page(before=newest[-1]["seq"])] == ["2", "1", "0"]
+
+
+def _toggle_many(path, times):
+    store = SqliteState(path, INITIAL)
+    for _ in range(times):
+        store.toggle("gas")
+
+
+def test_toggles_from_several_processes_are_not_lost(tmp_path):
+    path = str(tmp_path / "state.db")
+    store = make_state("sqlite:///" + path, INITIAL)
+    workers = [multiprocessing.Process(target=_toggle_many, args=(path, 51)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert store.version() == 4 * 51
+    assert store.get("gas") is False           # 204 flips
+
+
+def test_watcher_only_reports_other_processes(tmp_path):
+    path = str(tmp_path / "state.db")
+    here, other = SqliteState(path, INITIAL), SqliteState(path, INITIAL)
+    seen = []
+    watcher = VersionWatcher(here, lambda: seen.append(here.version()))
+    watcher.seen = here.version()
+
+    here.toggle("gas")
+    assert not watcher.check()
+    other.toggle("water")
+    assert watcher.check() and seen == [2]
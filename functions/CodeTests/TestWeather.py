@@ -0,0 +1,66 @@
+import threading
+import time
+
+from functions.weather import OpenMeteoSource, StubSource, Weather, WeatherProvider
+
+API_RESPONSE = {
+    "current_weather": {"time": "2026-10-18T12:15", "temperature": 11.6, "windspeed": 4.2, "weathercode": 61},
+    "hourly": {"time": ["2026-10-18T00:00", "2026-10-18T12:00"], "relativehumidity_2m": [95, 70]},
+}
+
+
+class SlowSource:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def fetch(self):
+        self.release.wait(5)
+        return Weather(9, 60, 2.0, "Overcast")
+
+
+def test_parse_uses_current_hour():
+    assert OpenMeteoSource.parse(API_RESPONSE) == Weather(12, 70, 4.2, "Slight rain")
+
+
+def test_fetch_goes_through_session_with_timeout():
+    class FakeSession:
+        def get(self, url, params, timeout):
+            self.timeout = timeout
+            return self
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return API_RESPONSE
+
+    session = FakeSession()
+    OpenMeteoSource(session=session, timeout=(1, 2)).fetch()
+    assert session.timeout == (1, 2)
+
+
+def test_get_never_waits_for_a_refresh():
+    source = SlowSource()
+    provider = WeatherProvider(source)
+    start = time.monotonic()
+    assert provider.get() is None
+    assert time.monotonic() - start < 0.5
+    source.release.set()
+    for _ in range(50):
+        if provider.get() is not None:
+            break
+        time.sleep(0.02)
+    assert provider.get().weather.description == "Overcast"
+
+
+def test_stale_reading_served_after_failed_refresh():
+    stub = StubSource()
+    provider = WeatherProvider(stub)
+    assert provider.refresh()
+    stub.error = OSError("network down")
+    assert not provider.refresh()
+
+    reading = provider.reading
+    assert reading.weather == stub.weather
+    assert isinstance(reading.error, OSError)
+    assert provider.age() is not None
@@ -0,0 +1,7 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# The shared code is imported as functions.* from the repo root
+sys.path.insert(0, os.path.join(HERE, "..", ".."))
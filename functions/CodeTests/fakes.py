@@ -0,0 +1,64 @@
+"""
+Stand-in for a psycopg2 connection, shared by the functions/ and hardware/
+tests.
+
+FakeConn records every statement in `executed` as (sql, params). A test
+makes it answer queries (or fail) by overriding answer(), which gets the
+statement and returns the rows it produces (None: no result).
+"""
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.execute(sql, params)
+
+    def fetchone(self):
+        return self.conn.result[0] if self.conn.result else None
+
+    def fetchall(self):
+        return self.conn.result
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    autocommit = True
+
+    def __init__(self):
+        self.executed = []
+        self.result = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def answer(self, sql, params):
+        return None
+
+    def execute(self, sql, params=None):
+        result = self.answer(sql, params)
+        if result is not None:
+            self.result = list(result)
+        self.executed.append((sql, params))
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
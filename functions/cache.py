@@ -0,0 +1,63 @@
+"""
+Small in-process caches for the dashboard.
+
+TTLCache holds values for `ttl` seconds, shared by every thread and so by
+every browser session. When an entry expires only the first caller
+reloads it; callers arriving meanwhile wait for that result instead of
+running the same query themselves, so 50 open phones cost the database
+as much as one.
+"""
+import threading
+import time
+
+
+class TTLCache:
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = {}     # key -> (expires_at, value)
+        self.loading = {}     # key -> threading.Event while one caller loads it
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, key, load):
+        """
+        Cached value for key, calling load() (with no arguments) when it
+        is missing or expired. None is cached like any other value.
+        """
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] > self.clock():
+                    self.hits += 1
+                    return entry[1]
+                waiting = self.loading.get(key)
+                if waiting is None:
+                    done = self.loading[key] = threading.Event()
+                    self.loads += 1
+                    break
+            # Someone else is loading it; use their result (or try ourselves if it failed)
+            waiting.wait()
+
+        try:
+            value = load()
+            with self.lock:
+                self.entries[key] = (self.clock() + self.ttl, value)
+            return value
+        finally:
+            with self.lock:
+                del self.loading[key]
+            done.set()
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "loads": self.loads}
@@ -0,0 +1,365 @@
+"""
+Shared database connection handling for the bridge and the dashboard.
+
+ConnectionManager keeps one connection alive: reconnects use jittered
+exponential backoff, a circuit breaker makes callers fail fast while the
+database is known to be down, and a cheap periodic ping notices a dead
+connection before the next real query does.
+
+ConnectionPool is the same idea for several threads at once (the
+dashboard's callbacks): up to `size` connections, borrowed with
+`with pool.connection() as conn:`.
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Circuit breaker states
+UP = "up"              # connected (or never tried yet)
+DOWN = "down"          # failing; callers fail fast until the next retry
+PROBING = "probing"    # one caller is trying to reconnect right now
+
+
+class DatabaseUnavailable(Exception):
+    pass
+
+
+class Backoff:
+    """
+    Jittered exponential backoff: base * 2^attempt, capped at max_delay,
+    scaled by a random factor in [0.5, 1] so many clients don't retry in
+    lockstep.
+    """
+
+    def __init__(self, base=0.5, max_delay=60.0):
+        self.base = base
+        self.max_delay = max_delay
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.max_delay, self.base * (2 ** self.attempt))
+        self.attempt += 1
+        return delay * random.uniform(0.5, 1.0)
+
+    def reset(self):
+        self.attempt = 0
+
+
+class ConnectionManager:
+    """
+    connect: callable returning a new DB-API connection (or raising).
+    Use get() / try_get() to borrow the connection and failed() when a
+    query on it raised a connection error.
+    """
+
+    def __init__(self, connect, name="db", base_delay=0.5, max_delay=60.0, failure_threshold=1,
+                 ping_interval=30.0, ping_sql="SELECT 1"):
+        self.connect = connect
+        self.name = name
+        self.backoff = Backoff(base_delay, max_delay)
+        self.failure_threshold = failure_threshold
+        self.ping_interval = ping_interval
+        self.ping_sql = ping_sql
+
+        self.lock = threading.Lock()
+        self.conn = None
+        self.state = UP
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.last_ok = 0.0
+        self.last_error = None
+        self.connects = 0
+
+    # ----------------------------
+    # Borrowing
+    # ----------------------------
+    def available(self):
+        """
+        False while the circuit is open: the DB is known to be down and the
+        next retry isn't due yet.
+        """
+        return self.state != DOWN or time.monotonic() >= self.next_attempt
+
+    def get(self):
+        """
+        Returns a live connection, or raises DatabaseUnavailable without
+        waiting if the DB is down and not due for a retry.
+        """
+        with self.lock:
+            if self.conn is not None:
+                return self.conn
+            if self.state == DOWN and time.monotonic() < self.next_attempt:
+                raise DatabaseUnavailable(f"{self.name} down, retry in {self.next_attempt - time.monotonic():.1f} s")
+            if self.state == PROBING:
+                raise DatabaseUnavailable(f"{self.name} reconnect in progress")
+            self.state = PROBING
+
+        # Connect outside the lock so other callers fail fast meanwhile
+        try:
+            conn = self.connect()
+        except Exception as e:
+            self._record_failure(e)
+            raise DatabaseUnavailable(f"{self.name} connect failed: {e}") from e
+        if conn is None:
+            self._record_failure(None)
+            raise DatabaseUnavailable(f"{self.name} connect failed")
+
+        with self.lock:
+            self.conn = conn
+            self.state = UP
+            self.failures = 0
+            self.backoff.reset()
+            self.last_ok = time.monotonic()
+            self.connects += 1
+        log.info("%s: connected", self.name)
+        return conn
+
+    def try_get(self):
+        try:
+            return self.get()
+        except DatabaseUnavailable:
+            return None
+
+    def failed(self, error=None):
+        """
+        Report that the current connection broke; it is closed and the next
+        get() waits for the backoff.
+        """
+        with self.lock:
+            conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._record_failure(error)
+
+    def ok(self):
+        """
+        Report a successful query, so the next ping can wait a full interval.
+        """
+        self.last_ok = time.monotonic()
+
+    def _record_failure(self, error):
+        with self.lock:
+            self.failures += 1
+            self.last_error = error
+            if self.failures >= self.failure_threshold:
+                delay = self.backoff.next_delay()
+                self.state = DOWN
+                self.next_attempt = time.monotonic() + delay
+                log.warning("%s: unavailable (%s), retry in %.1f s", self.name, error, delay)
+            else:
+                self.state = UP
+
+    # ----------------------------
+    # Health
+    # ----------------------------
+    def ping_due(self):
+        return self.conn is not None and time.monotonic() - self.last_ok >= self.ping_interval
+
+    def ping(self, force=False):
+        """
+        Runs ping_sql if nothing succeeded for ping_interval seconds.
+        Returns False (and marks the connection failed) if the DB is gone.
+        """
+        conn = self.conn
+        if conn is None:
+            return False
+        if not force and not self.ping_due():
+            return True
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(self.ping_sql)
+                cur.fetchone()
+            finally:
+                cur.close()
+            if not getattr(conn, "autocommit", True):
+                conn.rollback()
+            self.ok()
+            return True
+        except Exception as e:
+            self.failed(e)
+            return False
+
+    def close(self):
+        with self.lock:
+            conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def status(self):
+        with self.lock:
+            retry_in = max(0.0, self.next_attempt - time.monotonic()) if self.state == DOWN else 0.0
+            return {
+                "name": self.name,
+                "state": self.state,
+                "connected": self.conn is not None,
+                "failures": self.failures,
+                "retry_in": round(retry_in, 1),
+                "connects": self.connects,
+                "last_error": str(self.last_error) if self.last_error else None,
+            }
+
+
+class ConnectionPool:
+    """
+    connect: callable returning a new DB-API connection (or raising).
+    connection_errors: exception types meaning the connection is broken;
+    a borrowed connection that raises one is closed instead of returned,
+    and the pool backs off like ConnectionManager does.
+    """
+
+    def __init__(self, connect, size=4, name="pool", base_delay=0.5, max_delay=60.0, connection_errors=(),
+                 wait=5.0):
+        self.connect = connect
+        self.size = size
+        self.name = name
+        self.backoff = Backoff(base_delay, max_delay)
+        self.connection_errors = tuple(connection_errors)
+        self.wait = wait
+
+        self.cond = threading.Condition()
+        self.idle = []
+        self.in_use = 0
+        self.state = UP
+        self.next_attempt = 0.0
+        self.failures = 0
+        self.last_error = None
+        self.connects = 0
+        self.borrows = 0
+
+    def available(self):
+        return self.state != DOWN or time.monotonic() >= self.next_attempt
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection for the with-block. Raises DatabaseUnavailable
+        right away while the DB is down, or after `wait` seconds if all
+        connections stay busy.
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        except self.connection_errors as e:
+            self._discard(conn, e)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._release(conn)
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.wait
+        with self.cond:
+            while True:
+                if self.state == DOWN and time.monotonic() < self.next_attempt:
+                    raise DatabaseUnavailable(f"{self.name} down, retry in {self.next_attempt - time.monotonic():.1f} s")
+                while self.idle:
+                    conn = self.idle.pop()
+                    if getattr(conn, "closed", False):
+                        continue   # closed underneath us, drop it
+                    self.in_use += 1
+                    self.borrows += 1
+                    return conn
+                if self.in_use < self.size and self.state != PROBING:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DatabaseUnavailable(f"{self.name}: all {self.size} connections busy")
+                self.cond.wait(remaining)
+            # Reserve the slot; after a failure only one caller probes
+            self.in_use += 1
+            probing = self.state == DOWN
+            if probing:
+                self.state = PROBING
+
+        try:
+            conn = self.connect()
+            if conn is None:
+                raise DatabaseUnavailable(f"{self.name} connect failed")
+        except Exception as e:
+            with self.cond:
+                self.in_use -= 1
+                self.cond.notify()
+            self._record_failure(e)
+            if isinstance(e, DatabaseUnavailable):
+                raise
+            raise DatabaseUnavailable(f"{self.name} connect failed: {e}") from e
+
+        with self.cond:
+            self.state = UP
+            self.failures = 0
+            self.backoff.reset()
+            self.connects += 1
+            self.borrows += 1
+        if probing or self.connects == 1:
+            log.info("%s: connected", self.name)
+        return conn
+
+    def _release(self, conn):
+        with self.cond:
+            self.in_use -= 1
+            self.idle.append(conn)
+            self.cond.notify()
+
+    def _discard(self, conn, error):
+        with self.cond:
+            self.in_use -= 1
+            self.cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._record_failure(error)
+
+    def _record_failure(self, error):
+        # The other idle connections most likely died the same way
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.failures += 1
+            self.last_error = error
+            delay = self.backoff.next_delay()
+            self.state = DOWN
+            self.next_attempt = time.monotonic() + delay
+            self.cond.notify_all()
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        log.warning("%s: unavailable (%s), retry in %.1f s", self.name, error, delay)
+
+    def close(self):
+        with self.cond:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def status(self):
+        with self.cond:
+            retry_in = max(0.0, self.next_attempt - time.monotonic()) if self.state == DOWN else 0.0
+            return {
+                "name": self.name,
+                "state": self.state,
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.in_use,
+                "failures": self.failures,
+                "retry_in": round(retry_in, 1),
+                "connects": self.connects,
+                "borrows": self.borrows,
+                "last_error": str(self.last_error) if self.last_error else None,
+            }
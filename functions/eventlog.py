@@ -0,0 +1,111 @@
+"""
+Append-only change log with only the newest entries in memory.
+
+Records are small dicts (the dashboard's recent changes). append() gives
+each one a sequence number, writes it as one JSON line to the file and
+keeps it in a ring buffer of `size` entries, so memory stays the same
+however long the log gets. page() reads older records back from the end
+of the file for the audit trail. After a restart the ring is filled from
+the file again.
+"""
+import json
+import os
+import threading
+from collections import deque
+
+BLOCK = 8192
+
+
+def read_backwards(path, block=BLOCK):
+    """
+    Lines of a file from last to first, reading `block` bytes at a time.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        rest = b""
+        while position > 0:
+            step = min(block, position)
+            position -= step
+            f.seek(position)
+            lines = (f.read(step) + rest).split(b"\n")
+            rest = lines.pop(0)   # may continue in the previous block
+            for line in reversed(lines):
+                if line:
+                    yield line.decode("utf-8")
+        if rest:
+            yield rest.decode("utf-8")
+
+
+class EventLog:
+    """
+    path=None keeps only the ring buffer (tests).
+    """
+
+    def __init__(self, path=None, size=5):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ring = deque(maxlen=size)
+        self.seq = 0
+        self.file = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(path):
+                newest = list(self._older(None, size))
+                self.ring.extend(reversed(newest))
+                self.seq = newest[0]["seq"] if newest else 0
+            self.file = open(path, "a", encoding="utf-8")
+
+    def append(self, record):
+        with self.lock:
+            self.seq += 1
+            record = dict(record, seq=self.seq)
+            if self.file is not None:
+                self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+                self.file.flush()
+            self.ring.append(record)
+        return record
+
+    def recent(self):
+        """
+        The ring buffer, newest first.
+        """
+        with self.lock:
+            return list(reversed(self.ring))
+
+    def clear(self):
+        # Only what the page shows; the file keeps the history
+        with self.lock:
+            self.ring.clear()
+
+    def page(self, before=None, limit=50):
+        """
+        Up to `limit` records with seq < before (or the newest ones),
+        newest first.
+        """
+        if self.file is None:
+            return [r for r in self.recent() if before is None or r["seq"] < before][:limit]
+        return list(self._older(before, limit))
+
+    def _older(self, before, limit):
+        if limit <= 0:
+            return
+        count = 0
+        for line in read_backwards(self.path):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue   # torn last line after a crash
+            if before is not None and record["seq"] >= before:
+                continue
+            yield record
+            count += 1
+            if count >= limit:
+                return
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,305 @@
+"""
+Versioned schema for the smarthome database.
+
+Each migration runs once, in order, and is recorded in schema_migrations.
+All statements are idempotent (IF NOT EXISTS), so a database that was set
+up by hand is brought in line without errors. The bridge and the
+dashboard call migrate() when they connect; check_plans() runs EXPLAIN on
+the hot queries and reports any that would not use an index.
+
+    python functions/migrations.py            # apply, then check plans
+    python functions/migrations.py --status
+"""
+import argparse
+import json
+import logging
+
+import psycopg2
+
+log = logging.getLogger(__name__)
+
+BASE_SQL = """
+CREATE TABLE IF NOT EXISTS public.rfid_checkin (
+    id serial PRIMARY KEY,
+    timestamp timestamptz NOT NULL,
+    tag_id text,
+    user_name text,
+    access_granted boolean
+);
+
+CREATE TABLE IF NOT EXISTS public.ldr_readings (
+    id serial PRIMARY KEY,
+    timestamp timestamptz NOT NULL,
+    card_id text,
+    ldr_raw integer,
+    ldr_voltage double precision,
+    light_level text
+);
+
+CREATE TABLE IF NOT EXISTS public.users (
+    tag_id text NOT NULL,
+    user_name text
+);
+-- The bridge upserts users ON CONFLICT (tag_id); keep the newest row of
+-- any duplicates made before the key existed.
+DELETE FROM public.users a USING public.users b WHERE a.tag_id = b.tag_id AND a.ctid < b.ctid;
+CREATE UNIQUE INDEX IF NOT EXISTS users_tag_id_key ON public.users (tag_id);
+"""
+
+# (device, boot_id, seq) identifies an event; replays hit ON CONFLICT
+EVENT_ID_SQL = """
+ALTER TABLE public.rfid_checkin ADD COLUMN IF NOT EXISTS device text;
+ALTER TABLE public.rfid_checkin ADD COLUMN IF NOT EXISTS boot_id bigint;
+ALTER TABLE public.rfid_checkin ADD COLUMN IF NOT EXISTS seq bigint;
+CREATE UNIQUE INDEX IF NOT EXISTS rfid_checkin_event_key ON public.rfid_checkin (device, boot_id, seq);
+
+ALTER TABLE public.ldr_readings ADD COLUMN IF NOT EXISTS device text;
+ALTER TABLE public.ldr_readings ADD COLUMN IF NOT EXISTS boot_id bigint;
+ALTER TABLE public.ldr_readings ADD COLUMN IF NOT EXISTS seq bigint;
+CREATE UNIQUE INDEX IF NOT EXISTS ldr_readings_event_key ON public.ldr_readings (device, boot_id, seq);
+"""
+
+# sensor: "ldr" (value = ldr_raw, label = light_level) or
+#         "rfid" (value = 1/0 access granted, label = tag_id)
+SENSOR_LATEST_SQL = """
+CREATE TABLE IF NOT EXISTS public.sensor_latest (
+    device text NOT NULL,
+    sensor text NOT NULL,
+    timestamp timestamptz NOT NULL,
+    value double precision,
+    label text,
+    PRIMARY KEY (device, sensor)
+);
+"""
+
+INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS rfid_checkin_timestamp_idx ON public.rfid_checkin (timestamp DESC);
+CREATE INDEX IF NOT EXISTS ldr_readings_timestamp_idx ON public.ldr_readings (timestamp DESC);
+CREATE INDEX IF NOT EXISTS rfid_checkin_tag_timestamp_idx ON public.rfid_checkin (tag_id, timestamp);
+"""
+
+# History tables become range-partitioned on timestamp. The existing table
+# is kept as one partition (everything up to next month) and new rows go to
+# the partitions functions/partitions.py creates ahead of time; the default
+# partition catches anything outside them (and rows without a timestamp).
+# Unique keys on a partitioned table must contain the partition key, so
+# timestamp is added to the event key (an event's timestamp never changes,
+# so dedupe works the same). id stays unique through its sequence.
+PARTITION_SQL = """
+DO $$
+DECLARE
+    t text;
+    legacy text;
+    bound timestamptz;
+    pkey text;
+    idx record;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['rfid_checkin', 'ldr_readings'] LOOP
+        IF (SELECT relkind FROM pg_class WHERE oid = ('public.' || t)::regclass) = 'p' THEN
+            CONTINUE;
+        END IF;
+        legacy := t || '_legacy';
+
+        EXECUTE format('SELECT date_trunc(''month'', greatest(max(timestamp), now())) + interval ''1 month'' FROM public.%I', t)
+            INTO bound;
+        EXECUTE format('ALTER TABLE public.%I RENAME TO %I', t, legacy);
+
+        -- Free the index names for the new parent; a primary key on id
+        -- alone can't exist on a partition
+        SELECT conname INTO pkey FROM pg_constraint WHERE conrelid = ('public.' || legacy)::regclass AND contype = 'p';
+        IF pkey IS NOT NULL THEN
+            EXECUTE format('ALTER TABLE public.%I DROP CONSTRAINT %I', legacy, pkey);
+        END IF;
+        FOR idx IN SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                   WHERE i.indrelid = ('public.' || legacy)::regclass LOOP
+            EXECUTE format('ALTER INDEX public.%I RENAME TO %I', idx.relname, left(idx.relname, 55) || '_legacy');
+        END LOOP;
+
+        EXECUTE format('CREATE TABLE public.%I (LIKE public.%I INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)', t, legacy);
+        EXECUTE format('ALTER SEQUENCE IF EXISTS public.%I OWNED BY public.%I.id', t || '_id_seq', t);
+        EXECUTE format('CREATE UNIQUE INDEX %I ON public.%I (device, boot_id, seq, timestamp)', t || '_event_key', t);
+        EXECUTE format('CREATE INDEX %I ON public.%I (timestamp DESC)', t || '_timestamp_idx', t);
+        EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I DEFAULT', t || '_default', t);
+        EXECUTE format('WITH moved AS (DELETE FROM public.%I WHERE timestamp IS NULL RETURNING *) '
+                       'INSERT INTO public.%I SELECT * FROM moved', legacy, t || '_default');
+        EXECUTE format('ALTER TABLE public.%I ATTACH PARTITION public.%I FOR VALUES FROM (MINVALUE) TO (%L)',
+                       t, legacy, bound);
+    END LOOP;
+END
+$$;
+CREATE INDEX IF NOT EXISTS rfid_checkin_tag_timestamp_idx ON public.rfid_checkin (tag_id, timestamp);
+"""
+
+# Per-bucket aggregates of ldr_raw, see functions/rollups.py. sum_raw
+# rather than the mean so partial buckets can be added together.
+ROLLUP_SQL = "".join(f"""
+CREATE TABLE IF NOT EXISTS public.ldr_rollup_{name} (
+    device text NOT NULL,
+    bucket timestamptz NOT NULL,
+    count bigint NOT NULL,
+    sum_raw double precision NOT NULL,
+    min_raw integer NOT NULL,
+    max_raw integer NOT NULL,
+    PRIMARY KEY (device, bucket)
+);
+CREATE INDEX IF NOT EXISTS ldr_rollup_{name}_bucket_idx ON public.ldr_rollup_{name} (bucket);
+""" for name in ("minute", "hour", "day"))
+
+# Written by the bridge's streaming detectors (hardware/detectors.py)
+ALERTS_SQL = """
+CREATE TABLE IF NOT EXISTS public.alerts (
+    id bigserial PRIMARY KEY,
+    timestamp timestamptz NOT NULL,
+    device text,
+    detector text NOT NULL,
+    key text,
+    value double precision,
+    score double precision,
+    message text
+);
+CREATE INDEX IF NOT EXISTS alerts_timestamp_idx ON public.alerts (timestamp DESC);
+"""
+
+MIGRATIONS = [
+    (1, "base tables, unique users.tag_id", BASE_SQL),
+    (2, "event ids for dedupe", EVENT_ID_SQL),
+    (3, "sensor_latest", SENSOR_LATEST_SQL),
+    (4, "indexes for latest-row and per-user queries", INDEX_SQL),
+    (5, "partition history tables by timestamp", PARTITION_SQL),
+    (6, "ldr rollups per minute, hour and day", ROLLUP_SQL),
+    (7, "alerts from the streaming detectors", ALERTS_SQL),
+]
+
+MIGRATIONS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS public.schema_migrations (
+    version integer PRIMARY KEY,
+    name text NOT NULL,
+    applied_at timestamptz NOT NULL DEFAULT now()
+);
+"""
+
+# Bridge and dashboard may start at the same time
+LOCK_ID = 0x534d48   # "SMH"
+
+# The queries the dashboard and bridge run all the time
+HOT_QUERIES = {
+    "latest ldr": "SELECT light_level FROM ldr_readings ORDER BY timestamp DESC LIMIT 1",
+    "latest rfid": "SELECT timestamp FROM rfid_checkin ORDER BY timestamp DESC LIMIT 1",
+    "sensor_latest": "SELECT timestamp, value, label FROM sensor_latest WHERE device = 'x' AND sensor = 'ldr'",
+    "user history": "SELECT timestamp FROM rfid_checkin WHERE tag_id = 'x' ORDER BY timestamp DESC LIMIT 20",
+    "user lookup": "SELECT user_name FROM users WHERE tag_id = 'x'",
+    "light history": "SELECT bucket, count FROM ldr_rollup_hour WHERE bucket >= now() - interval '7 days'",
+}
+
+
+def applied_versions(conn):
+    with conn.cursor() as cur:
+        cur.execute(MIGRATIONS_TABLE_SQL)
+        cur.execute("SELECT version FROM public.schema_migrations")
+        return set(row[0] for row in cur.fetchall())
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """
+    Applies pending migrations, each in its own transaction. Returns the
+    versions applied now. Safe to call on every startup: with nothing
+    pending it costs one SELECT.
+    """
+    applied = []
+    with conn:
+        done = applied_versions(conn)
+    for version, name, sql in migrations:
+        if version in done:
+            continue
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (LOCK_ID,))
+                # Someone else may have applied it while we waited
+                cur.execute("SELECT 1 FROM public.schema_migrations WHERE version = %s", (version,))
+                if cur.fetchone():
+                    continue
+                cur.execute(sql)
+                cur.execute("INSERT INTO public.schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        log.info("Migration %s applied: %s", version, name)
+        applied.append(version)
+    return applied
+
+
+def try_migrate(conn):
+    """
+    migrate() for startup: a role without DDL rights (e.g. a read-only
+    dashboard user) only gets a warning.
+    """
+    try:
+        return migrate(conn)
+    except psycopg2.Error as e:
+        conn.rollback()
+        log.warning("Schema migration skipped: %s", e)
+        log.warning("Tip: run `python functions/migrations.py` once as the table owner.")
+        return []
+
+
+def plan_nodes(plan):
+    """
+    All node types in an EXPLAIN (FORMAT JSON) plan tree, with their relation.
+    """
+    nodes = [(plan.get("Node Type"), plan.get("Relation Name"))]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def check_plans(conn, queries=HOT_QUERIES):
+    """
+    EXPLAINs each hot query with sequential scans discouraged, so the answer
+    doesn't depend on how much data there is yet. Returns
+    {name: (uses_index, [node types])}; a Seq Scan means an index is missing.
+    """
+    results = {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            for name, sql in queries.items():
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = plan_nodes(plan[0]["Plan"])
+                seq = any(node == "Seq Scan" for node, _ in nodes)
+                results[name] = (not seq, [node for node, _ in nodes])
+    finally:
+        conn.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply smarthome schema migrations")
+    parser.add_argument("--dsn", default="", help="libpq connection string (default: PG* environment variables)")
+    parser.add_argument("--status", action="store_true", help="only list applied migrations")
+    parser.add_argument("--no-check", action="store_true", help="skip the EXPLAIN check")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.status:
+            with conn:
+                done = applied_versions(conn)
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:3d} {'applied' if version in done else 'pending':8s} {name}")
+            return
+
+        if not migrate(conn):
+            print("Schema up to date")
+        if not args.no_check:
+            failed = 0
+            for name, (ok, nodes) in check_plans(conn).items():
+                print(f"{'ok  ' if ok else 'SEQ '} {name}: {' -> '.join(nodes)}")
+                failed += not ok
+            if failed:
+                raise SystemExit(f"{failed} hot queries would scan a whole table")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Live sensor changes for the dashboard, pushed instead of polled.
+
+The bridge sends pg_notify('sensor_changes', '[[device, sensor], ...]')
+in the transaction that updates sensor_latest (hardware/batching.py), so
+a notification means the new rows are committed. Listener holds the one
+LISTEN connection of the dashboard process and bumps a ChangeFeed version
+per notification; every browser keeps an event stream (event_stream(),
+Server-Sent Events) open that waits on that version and tells the page
+to refresh. Nothing queries the database while nothing changes.
+"""
+import json
+import logging
+import select
+import threading
+import time
+
+from functions.connection import Backoff
+
+log = logging.getLogger(__name__)
+
+CHANNEL = "sensor_changes"   # NOTIFY_CHANNEL in hardware/batching.py
+
+
+class ChangeFeed:
+    """
+    A version number that waiters can block on.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version = 0
+
+    def publish(self):
+        with self.cond:
+            self.version += 1
+            self.cond.notify_all()
+
+    def wait(self, version, timeout):
+        """
+        Blocks until the version differs from `version` or timeout seconds
+        passed; returns the current version either way.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+class Listener:
+    """
+    connect: callable returning a new psycopg2 connection (used in
+    autocommit mode, only for LISTEN).
+    on_notify(changes): called with the decoded payloads of each round of
+    notifications; browsers are only told when it returns True.
+    The thread starts on the first start() and reconnects with backoff.
+    """
+
+    def __init__(self, connect, feed, channel=CHANNEL, on_notify=None, ping_interval=30.0,
+                 base_delay=1.0, max_delay=30.0):
+        self.connect = connect
+        self.feed = feed
+        self.channel = channel
+        self.on_notify = on_notify
+        self.ping_interval = ping_interval
+        self.backoff = Backoff(base_delay, max_delay)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.connected = False
+        self.deadline = None
+        self.notifications = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="listen", daemon=True)
+                self.thread.start()
+
+    def later(self, seconds):
+        """
+        Publish once more after `seconds` (e.g. when the door card should
+        flip back to closed); a later call replaces an earlier one.
+        """
+        self.deadline = time.monotonic() + seconds
+
+    def _run(self):
+        while True:
+            try:
+                conn = self.connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+            except Exception as e:
+                delay = self.backoff.next_delay()
+                log.warning("listen: unavailable (%s), retry in %.1f s", e, delay)
+                time.sleep(delay)
+                continue
+
+            log.info("listen: waiting for %s", self.channel)
+            self.backoff.reset()
+            self.connected = True
+            self.feed.publish()   # whatever changed while we weren't listening
+            try:
+                self._listen(conn)
+            except Exception as e:
+                log.warning("listen: connection lost (%s)", e)
+            finally:
+                self.connected = False
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            time.sleep(self.backoff.next_delay())
+
+    def _listen(self, conn):
+        while True:
+            timeout = self.ping_interval
+            if self.deadline is not None:
+                timeout = max(0.0, min(timeout, self.deadline - time.monotonic()))
+
+            if select.select([conn], [], [], timeout) == ([], [], []):
+                if self.deadline is not None and time.monotonic() >= self.deadline:
+                    self.deadline = None
+                    self.feed.publish()
+                else:
+                    # Quiet for a while: make sure the connection is still there
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                continue
+
+            conn.poll()
+            self.handle([n.payload for n in conn.notifies])
+            conn.notifies.clear()
+
+    def handle(self, payloads):
+        if not payloads:
+            return
+        changes = []
+        for payload in payloads:
+            try:
+                changes.extend(json.loads(payload))
+            except ValueError:
+                pass   # not ours to parse; still a change
+        self.notifications += len(payloads)
+        if self.on_notify is None or self.on_notify(changes):
+            self.feed.publish()
+
+
+def event_stream(feed, heartbeat=15.0, min_interval=0.5):
+    """
+    Server-Sent Events for one browser: the current version right away,
+    then a new one whenever the feed moves, at most once per min_interval
+    so a burst of notifications becomes one refresh. The heartbeat
+    comment lets the server notice a closed tab.
+    """
+    version = feed.version
+    sent = time.monotonic()
+    yield f"retry: 3000\ndata: {version}\n\n"
+    while True:
+        current = feed.wait(version, heartbeat)
+        if current == version:
+            yield ": ping\n\n"
+            continue
+        wait = sent + min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        version = feed.version
+        sent = time.monotonic()
+        yield f"data: {version}\n\n"
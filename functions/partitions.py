@@ -0,0 +1,240 @@
+"""
+Keeps the time partitions of rfid_checkin / ldr_readings in shape
+(see migration 5 in functions/migrations.py).
+
+maintain() creates the partitions for the next few intervals before rows
+arrive for them, and detaches (or drops) partitions that fall entirely
+outside the retention window. A detached partition is an ordinary table
+again, so it can be dumped and archived with pg_dump -t and then dropped.
+
+    python functions/partitions.py --interval month --ahead 3 --retention 24
+"""
+import argparse
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+
+log = logging.getLogger(__name__)
+
+TABLES = ("rfid_checkin", "ldr_readings")
+INTERVALS = ("day", "week", "month", "year")
+
+BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+# ----------------------------
+# Interval arithmetic (all in UTC)
+# ----------------------------
+def interval_start(ts, interval):
+    ts = ts.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "day":
+        return ts
+    if interval == "week":
+        return ts - timedelta(days=ts.weekday())
+    if interval == "month":
+        return ts.replace(day=1)
+    if interval == "year":
+        return ts.replace(month=1, day=1)
+    raise ValueError(f"unknown partition interval: {interval}")
+
+
+def add_intervals(start, interval, n):
+    if interval == "day":
+        return start + timedelta(days=n)
+    if interval == "week":
+        return start + timedelta(weeks=n)
+    if interval == "year":
+        return start.replace(year=start.year + n)
+    if interval == "month":
+        months = start.year * 12 + start.month - 1 + n
+        return start.replace(year=months // 12, month=months % 12 + 1)
+    raise ValueError(f"unknown partition interval: {interval}")
+
+
+def partition_name(table, start, interval):
+    if interval == "day":
+        return f"{table}_p{start:%Y%m%d}"
+    if interval == "week":
+        return f"{table}_p{start:%G}w{start:%V}"
+    if interval == "year":
+        return f"{table}_p{start:%Y}"
+    return f"{table}_p{start:%Y_%m}"
+
+
+def parse_bound(text):
+    """
+    One side of a partition bound as pg_get_expr prints it in UTC:
+    'MINVALUE' -> None, "'2026-11-01 00:00:00+00'" -> datetime.
+    """
+    text = text.strip()
+    if text.upper() in ("MINVALUE", "MAXVALUE"):
+        return None
+    value = text.strip("'")
+    if re.search(r"[+-]\d\d$", value):
+        value += ":00"
+    return datetime.fromisoformat(value)
+
+
+# ----------------------------
+# Catalog
+# ----------------------------
+def is_partitioned(cur, table):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", ("public." + table,))
+    row = cur.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def list_partitions(cur, table):
+    """
+    [(name, lower, upper)] for the range partitions of table, oldest first;
+    lower is None for the legacy (MINVALUE) partition. The default
+    partition is left out.
+    """
+    cur.execute("SET LOCAL TimeZone = 'UTC'")
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, ("public." + table,))
+    parts = []
+    for name, bound in cur.fetchall():
+        match = BOUND_RE.search(bound or "")
+        if match:
+            parts.append((name, parse_bound(match.group(1)), parse_bound(match.group(2))))
+    parts.sort(key=lambda p: p[2] or datetime.max.replace(tzinfo=timezone.utc))
+    return parts
+
+
+# ----------------------------
+# Maintenance
+# ----------------------------
+def create_partition(cur, table, name, lower, upper):
+    """
+    Creates and attaches [lower, upper). Rows that already landed in the
+    default partition for that range are moved over first, otherwise the
+    attach would fail.
+    """
+    default = table + "_default"
+    cur.execute(f"CREATE TABLE public.{name} (LIKE public.{table} INCLUDING DEFAULTS)")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM public.{default} WHERE timestamp >= %s AND timestamp < %s RETURNING *
+        )
+        INSERT INTO public.{name} SELECT * FROM moved
+    """, (lower, upper))
+    cur.execute(f"ALTER TABLE public.{table} ATTACH PARTITION public.{name} FOR VALUES FROM (%s) TO (%s)",
+                (lower, upper))
+
+
+def maintain(conn, interval="month", ahead=3, retention=None, drop=False, now=None):
+    """
+    Makes sure partitions exist up to `ahead` intervals past the current
+    one and detaches those that ended more than `retention` intervals ago
+    (None keeps everything; drop=True drops them instead). Returns
+    {"created": [...], "detached": [...], "dropped": [...]}.
+    """
+    now = now or datetime.now(timezone.utc)
+    current = interval_start(now, interval)
+    until = add_intervals(current, interval, ahead + 1)
+    cutoff = add_intervals(current, interval, -retention) if retention is not None else None
+    result = {"created": [], "detached": [], "dropped": []}
+
+    for table in TABLES:
+        with conn:
+            with conn.cursor() as cur:
+                if not is_partitioned(cur, table):
+                    continue
+                parts = list_partitions(cur, table)
+
+                # Continue after the newest partition (which may be the
+                # legacy one, or old if the bridge was off for a while)
+                start = max((p[2] for p in parts if p[2] is not None), default=current)
+                while start < until:
+                    # An unaligned start (e.g. after changing the interval)
+                    # gets a short partition up to the next boundary
+                    end = add_intervals(interval_start(start, interval), interval, 1)
+                    name = partition_name(table, interval_start(start, interval), interval)
+                    create_partition(cur, table, name, start, end)
+                    result["created"].append(name)
+                    start = end
+
+                if cutoff is None:
+                    continue
+                for name, lower, upper in parts:
+                    if upper is not None and upper <= cutoff:
+                        cur.execute(f"ALTER TABLE public.{table} DETACH PARTITION public.{name}")
+                        if drop:
+                            cur.execute(f"DROP TABLE public.{name}")
+                            result["dropped"].append(name)
+                        else:
+                            result["detached"].append(name)
+    return result
+
+
+def try_maintain(conn, **kwargs):
+    """
+    maintain() for startup and the periodic check; failures only warn.
+    """
+    try:
+        result = maintain(conn, **kwargs)
+    except psycopg2.Error as e:
+        conn.rollback()
+        log.warning("Partition maintenance failed: %s", e)
+        return None
+    for action in ("created", "detached", "dropped"):
+        if result[action]:
+            log.info("Partitions %s: %s", action, ", ".join(result[action]))
+    return result
+
+
+def scanned_partitions(conn, table, lower, upper):
+    """
+    Partitions a [lower, upper) range query on table actually reads, from
+    its EXPLAIN plan; with pruning that's only the ones overlapping the range.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"EXPLAIN (FORMAT JSON) SELECT count(*) FROM public.{table} "
+                    "WHERE timestamp >= %s AND timestamp < %s", (lower, upper))
+        plan = cur.fetchone()[0]
+    conn.rollback()
+
+    names = set()
+    todo = [plan[0]["Plan"]]
+    while todo:
+        node = todo.pop()
+        if node.get("Relation Name"):
+            names.add(node["Relation Name"])
+        todo.extend(node.get("Plans", []))
+    return sorted(names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and retire time partitions")
+    parser.add_argument("--dsn", default="", help="libpq connection string (default: PG* environment variables)")
+    parser.add_argument("--interval", choices=INTERVALS, default="month")
+    parser.add_argument("--ahead", type=int, default=3, help="intervals to create in advance")
+    parser.add_argument("--retention", type=int, default=None, help="intervals to keep attached")
+    parser.add_argument("--drop", action="store_true", help="drop expired partitions instead of detaching")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        try_maintain(conn, interval=args.interval, ahead=args.ahead, retention=args.retention, drop=args.drop)
+        current = interval_start(datetime.now(timezone.utc), args.interval)
+        following = add_intervals(current, args.interval, 1)
+        with conn.cursor() as cur:
+            for table in TABLES:
+                if not is_partitioned(cur, table):
+                    print(f"{table}: not partitioned (run functions/migrations.py)")
+                    continue
+                names = [p[0] for p in list_partitions(cur, table)]
+                scanned = scanned_partitions(conn, table, current, following)
+                print(f"{table}: {len(names)} partitions, current-{args.interval} query reads {', '.join(scanned)}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Minute / hour / day rollups of ldr_readings.
+
+The bridge feeds every LDR row it inserts (once committed) into a Rollup,
+which keeps count, sum, min and max per (device, bucket) in memory and
+hands out the buckets that have closed (or have been open longer than
+max_age) to be upserted. Upserts add to what is already stored, so a
+bucket written in several pieces (late rows, several writers, a restart)
+still ends up exact.
+
+Graphs read with history(), which picks the coarsest rollup that still
+gives enough points. backfill() recomputes rollups for rows that were
+loaded before this existed, in one streaming pass over ldr_readings.
+
+    python functions/rollups.py --dsn "..." --since 2025-01-01
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# (name, bucket width in seconds), finest first
+RESOLUTIONS = (("minute", 60), ("hour", 3600), ("day", 86400))
+MIN_POINTS = 24      # history() wants at least this many buckets
+GRACE = 2.0          # seconds after a bucket ends before it counts as closed
+MAX_AGE = 60.0       # flush open buckets at least this often (bounds loss on a crash)
+CHECK_INTERVAL = 1.0 # how often the writer looks for closed buckets
+
+UPSERT_SQL = """
+INSERT INTO public.ldr_rollup_{name} AS r (device, bucket, count, sum_raw, min_raw, max_raw)
+VALUES %s
+ON CONFLICT (device, bucket) DO UPDATE
+SET count = r.count + EXCLUDED.count,
+    sum_raw = r.sum_raw + EXCLUDED.sum_raw,
+    min_raw = least(r.min_raw, EXCLUDED.min_raw),
+    max_raw = greatest(r.max_raw, EXCLUDED.max_raw)
+"""
+
+HISTORY_SQL = """
+SELECT bucket, sum(sum_raw) / sum(count), min(min_raw), max(max_raw)
+FROM public.ldr_rollup_{name}
+WHERE bucket >= %s AND bucket < %s AND (%s::text IS NULL OR device = %s)
+GROUP BY bucket
+ORDER BY bucket
+"""
+
+
+def bucket_start(ts, width):
+    seconds = ts.timestamp()
+    return datetime.fromtimestamp(seconds - seconds % width, timezone.utc)
+
+
+class Rollup:
+    """
+    Not thread-safe: each bridge writer owns one.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS, grace=GRACE, max_age=MAX_AGE, check_interval=CHECK_INTERVAL):
+        self.resolutions = resolutions
+        self.grace = grace
+        self.max_age = max_age
+        self.check_interval = check_interval
+        # name -> {(device, bucket): [count, sum, min, max]}
+        self.buckets = {name: {} for name, _ in resolutions}
+        self.oldest = None
+        self.checked = time.monotonic()
+
+    def add(self, device, ts, raw):
+        device = device or ""
+        for name, width in self.resolutions:
+            key = (device, bucket_start(ts, width))
+            agg = self.buckets[name].get(key)
+            if agg is None:
+                self.buckets[name][key] = [1, raw, raw, raw]
+            else:
+                agg[0] += 1
+                agg[1] += raw
+                if raw < agg[2]:
+                    agg[2] = raw
+                if raw > agg[3]:
+                    agg[3] = raw
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+
+    def __len__(self):
+        return sum(len(b) for b in self.buckets.values())
+
+    def due(self):
+        return self.oldest is not None and time.monotonic() - self.checked >= self.check_interval
+
+    def drain(self, now=None, everything=False):
+        """
+        Removes and returns {name: [(device, bucket, count, sum, min, max)]}
+        for buckets that closed before `now` (UTC datetime). Everything goes
+        when everything=True or when the oldest data is older than max_age.
+        """
+        self.checked = time.monotonic()
+        if self.oldest is None:
+            return {}
+        now = now or datetime.now(timezone.utc)
+        if time.monotonic() - self.oldest >= self.max_age:
+            everything = True
+
+        out = {}
+        kept = False
+        for name, width in self.resolutions:
+            closed_before = now - timedelta(seconds=width + self.grace)
+            rows = []
+            for key in list(self.buckets[name]):
+                if everything or key[1] <= closed_before:
+                    rows.append(key + tuple(self.buckets[name].pop(key)))
+            if rows:
+                out[name] = rows
+            kept = kept or bool(self.buckets[name])
+        self.oldest = time.monotonic() if kept else None
+        return out
+
+    def restore(self, drained):
+        """
+        Puts drained rows back after a failed write.
+        """
+        for name, rows in drained.items():
+            for device, bucket, count, total, low, high in rows:
+                agg = self.buckets[name].get((device, bucket))
+                if agg is None:
+                    self.buckets[name][(device, bucket)] = [count, total, low, high]
+                else:
+                    agg[0] += count
+                    agg[1] += total
+                    agg[2] = min(agg[2], low)
+                    agg[3] = max(agg[3], high)
+        if drained and self.oldest is None:
+            self.oldest = time.monotonic()
+
+    def write(self, cur, drained):
+        for name, rows in drained.items():
+            execute_values(cur, UPSERT_SQL.format(name=name), rows, page_size=len(rows))
+
+
+# ----------------------------
+# Reading
+# ----------------------------
+def choose_resolution(start, end, min_points=MIN_POINTS):
+    """
+    Coarsest rollup with at least min_points buckets in [start, end).
+    """
+    span = (end - start).total_seconds()
+    for name, width in reversed(RESOLUTIONS):
+        if span / width >= min_points:
+            return name
+    return RESOLUTIONS[0][0]
+
+
+def history(cur, start, end, device=None, min_points=MIN_POINTS):
+    """
+    [(bucket, mean, min, max)] of ldr_raw for [start, end), all devices
+    combined unless device is given.
+    """
+    name = choose_resolution(start, end, min_points)
+    cur.execute(HISTORY_SQL.format(name=name), (start, end, device, device))
+    return cur.fetchall()
+
+
+# ----------------------------
+# Backfill from raw rows
+# ----------------------------
+def backfill(conn, since=None, until=None, batch=10000):
+    """
+    Recomputes all rollups for whole days in [since, until) from
+    ldr_readings: existing rollup rows there are replaced. Rows are streamed
+    in timestamp order through a server-side cursor, and buckets are
+    written as soon as the stream has passed them, so memory stays small.
+    Defaults to everything before today (UTC); today is left to the bridge.
+    """
+    day = RESOLUTIONS[-1][1]
+    until = bucket_start(until or datetime.now(timezone.utc), day)
+    since = bucket_start(since, day) if since else datetime(1970, 1, 1, tzinfo=timezone.utc)
+    rollup = Rollup(grace=0, max_age=float("inf"))
+    rows = 0
+
+    with conn:
+        with conn.cursor() as cur:
+            for name, _ in RESOLUTIONS:
+                cur.execute(f"DELETE FROM public.ldr_rollup_{name} WHERE bucket >= %s AND bucket < %s", (since, until))
+
+        stream = conn.cursor(name="ldr_rollup_backfill")
+        stream.itersize = batch
+        stream.execute("""
+            SELECT device, timestamp, ldr_raw FROM public.ldr_readings
+            WHERE timestamp >= %s AND timestamp < %s AND ldr_raw IS NOT NULL
+            ORDER BY timestamp
+        """, (since, until))
+
+        with conn.cursor() as cur:
+            for device, ts, raw in stream:
+                rollup.add(device, ts, raw)
+                rows += 1
+                if rows % batch == 0:
+                    rollup.write(cur, rollup.drain(now=ts))
+            rollup.write(cur, rollup.drain(everything=True))
+        stream.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute LDR rollups from ldr_readings")
+    parser.add_argument("--dsn", default="", help="libpq connection string (default: PG* environment variables)")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="first day (default: all history)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="day to stop before (default: today)")
+    args = parser.parse_args()
+
+    utc = lambda d: d.replace(tzinfo=d.tzinfo or timezone.utc) if d else None
+    conn = psycopg2.connect(args.dsn)
+    try:
+        start = time.monotonic()
+        rows = backfill(conn, utc(args.since), utc(args.until))
+        seconds = time.monotonic() - start
+        print(f"Rolled up {rows} readings in {seconds:.1f} s ({rows / seconds if seconds else 0:.0f} rows/s)")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
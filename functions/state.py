@@ -0,0 +1,269 @@
+"""
+Device state and the recent-changes log of the dashboard, shared by all
+processes that serve it.
+
+Two backends with the same methods:
+- MemoryState: a dict in this process (tests, the single dev server);
+  the log is an EventLog (ring buffer plus optional JSON-lines file).
+- SqliteState: a SQLite file in WAL mode, so several gunicorn workers on
+  the Pi see the same state. Writes are short IMMEDIATE transactions;
+  readers never wait for them. The log is an append-only table.
+
+Log entries are compact dicts; recent() gives the newest `log_size`,
+page(before, limit) goes further back by sequence number. clear_log()
+only empties recent(), the history stays.
+
+Every change bumps a version counter. VersionWatcher polls it to find
+out about changes made by another process.
+make_state("memory") or make_state("sqlite:///path/to/state.db").
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from functions.eventlog import EventLog
+
+log = logging.getLogger(__name__)
+
+LOG_SIZE = 5
+
+
+class MemoryState:
+
+    def __init__(self, initial, log_size=LOG_SIZE, log_path=None):
+        self.lock = threading.Lock()
+        self.values = dict(initial)
+        self.log = EventLog(log_path, log_size)
+        self._version = 0
+        self.last_written = 0
+
+    def _bump(self):
+        self._version += 1
+        self.last_written = self._version
+
+    def version(self):
+        return self._version
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def get(self, key):
+        return self.values[key]
+
+    def set(self, key, value):
+        """
+        Returns True if the value changed (only then the version moves).
+        """
+        with self.lock:
+            if self.values.get(key) == value:
+                return False
+            self.values[key] = value
+            self._bump()
+            return True
+
+    def toggle(self, *keys):
+        """
+        Flips the keys in one step; returns their new values.
+        """
+        with self.lock:
+            for key in keys:
+                self.values[key] = not self.values[key]
+            if keys:
+                self._bump()
+            return {key: self.values[key] for key in keys}
+
+    def add_log(self, entry):
+        """
+        Returns the entry with its sequence number.
+        """
+        entry = self.log.append(entry)
+        with self.lock:
+            self._bump()
+        return entry
+
+    def recent(self):
+        """
+        Log entries, newest first.
+        """
+        return self.log.recent()
+
+    def page(self, before=None, limit=50):
+        return self.log.page(before, limit)
+
+    def clear_log(self):
+        self.log.clear()
+        with self.lock:
+            self._bump()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS device_state (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS change_log (id INTEGER PRIMARY KEY AUTOINCREMENT, entry TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS state_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL);
+INSERT OR IGNORE INTO state_version VALUES (0, 0);
+CREATE TABLE IF NOT EXISTS log_cleared (id INTEGER PRIMARY KEY CHECK (id = 0), upto INTEGER NOT NULL);
+INSERT OR IGNORE INTO log_cleared VALUES (0, 0);
+"""
+
+
+class SqliteState:
+    """
+    One connection per thread (sqlite3 connections can't be shared).
+    `initial` only fills keys the file doesn't have yet, so state survives
+    a restart.
+    """
+
+    def __init__(self, path, initial, log_size=LOG_SIZE, busy_timeout=5.0):
+        self.path = path
+        self.log_size = log_size
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.last_written = None
+        with self._write() as db:
+            db.executemany("INSERT OR IGNORE INTO device_state VALUES (?, ?)",
+                           [(key, int(value)) for key, value in initial.items()])
+
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            self.local.db = db
+        return db
+
+    @contextmanager
+    def _write(self):
+        # IMMEDIATE takes the write lock up front, so read-modify-write
+        # (toggle) can't interleave with another process
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _bump(self, db):
+        db.execute("UPDATE state_version SET version = version + 1")
+        self.last_written = db.execute("SELECT version FROM state_version").fetchone()[0]
+
+    def version(self):
+        return self._db().execute("SELECT version FROM state_version").fetchone()[0]
+
+    def snapshot(self):
+        return {key: bool(value) for key, value in self._db().execute("SELECT key, value FROM device_state")}
+
+    def get(self, key):
+        row = self._db().execute("SELECT value FROM device_state WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return bool(row[0])
+
+    def set(self, key, value):
+        with self._write() as db:
+            changed = db.execute("INSERT INTO device_state VALUES (?, ?) "
+                                 "ON CONFLICT (key) DO UPDATE SET value = excluded.value "
+                                 "WHERE value != excluded.value", (key, int(value))).rowcount
+            if changed:
+                self._bump(db)
+        return bool(changed)
+
+    def toggle(self, *keys):
+        if not keys:
+            return {}
+        with self._write() as db:
+            db.executemany("UPDATE device_state SET value = 1 - value WHERE key = ?", [(key,) for key in keys])
+            self._bump(db)
+            marks = ", ".join("?" * len(keys))
+            rows = db.execute(f"SELECT key, value FROM device_state WHERE key IN ({marks})", keys).fetchall()
+        return {key: bool(value) for key, value in rows}
+
+    def add_log(self, entry):
+        with self._write() as db:
+            seq = db.execute("INSERT INTO change_log (entry) VALUES (?)",
+                             (json.dumps(entry, separators=(",", ":")),)).lastrowid
+            self._bump(db)
+        return dict(entry, seq=seq)
+
+    @staticmethod
+    def _entries(rows):
+        return [dict(json.loads(entry), seq=seq) for seq, entry in rows]
+
+    def recent(self):
+        return self._entries(self._db().execute(
+            "SELECT id, entry FROM change_log WHERE id > (SELECT upto FROM log_cleared) "
+            "ORDER BY id DESC LIMIT ?", (self.log_size,)))
+
+    def page(self, before=None, limit=50):
+        if before is None:
+            before = 2 ** 63 - 1
+        return self._entries(self._db().execute(
+            "SELECT id, entry FROM change_log WHERE id < ? ORDER BY id DESC LIMIT ?", (before, limit)))
+
+    def clear_log(self):
+        with self._write() as db:
+            db.execute("UPDATE log_cleared SET upto = (SELECT coalesce(max(id), 0) FROM change_log)")
+            self._bump(db)
+
+
+def make_state(url, initial, log_size=LOG_SIZE, log_path=None):
+    """
+    log_path: JSON-lines file for the memory backend's log (SQLite keeps
+    its log in the database file).
+    """
+    if url in (None, "", "memory"):
+        return MemoryState(initial, log_size, log_path)
+    if url.startswith("sqlite:///"):
+        return SqliteState(url[len("sqlite:///"):], initial, log_size)
+    raise ValueError(f"Unknown state backend: {url}")
+
+
+class VersionWatcher:
+    """
+    Calls on_change() when the version moved because of another process
+    (this process's own writes are announced by the caller right away).
+    """
+
+    def __init__(self, store, on_change, interval=0.25):
+        self.store = store
+        self.on_change = on_change
+        self.interval = interval
+        self.seen = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.seen = self.store.version()
+                self.thread = threading.Thread(target=self._run, name="state-watch", daemon=True)
+                self.thread.start()
+
+    def check(self):
+        version = self.store.version()
+        if version == self.seen:
+            return False
+        self.seen = version
+        if version == self.store.last_written:
+            return False
+        self.on_change()
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except sqlite3.Error as e:
+                log.warning("State watch failed: %s", e)
@@ -0,0 +1,140 @@
+"""
+Weather for the dashboard, fetched in the background.
+
+WeatherProvider refreshes from a source every `interval` seconds on its
+own thread; callbacks only read the last result, so a slow or unreachable
+API never holds up a page. While a refresh is running, or after one
+failed, the previous reading keeps being served (with its age).
+
+Sources have one method, fetch() -> Weather. OpenMeteoSource talks to
+Open-Meteo through a pooled requests.Session with timeouts; StubSource
+returns fixed values for tests and offline demos (WEATHER_SOURCE=stub).
+"""
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+Weather = namedtuple("Weather", ["temp", "humidity", "wind", "description"])
+
+# A reading plus when it was fetched (time.time()) and the last refresh
+# error, if the most recent attempt failed.
+Reading = namedtuple("Reading", ["weather", "fetched_at", "error"])
+
+WEATHER_CODES = {
+    0: "Clear sky", 1: "Mainly clear", 2: "Partly cloudy", 3: "Overcast",
+    45: "Fog", 48: "Depositing rime fog", 51: "Light drizzle",
+    53: "Moderate drizzle", 55: "Dense drizzle", 61: "Slight rain",
+    63: "Moderate rain", 65: "Heavy rain", 71: "Slight snow fall",
+    73: "Moderate snow fall", 75: "Heavy snow fall", 95: "Thunderstorm",
+    96: "Thunderstorm with slight hail", 99: "Thunderstorm with heavy hail"
+}
+
+
+class OpenMeteoSource:
+    URL = "https://api.open-meteo.com/v1/forecast"
+
+    def __init__(self, lat=52.09, lon=5.12, timeout=(3.05, 5), session=None):
+        self.params = {"latitude": lat, "longitude": lon, "current_weather": "true",
+                       "hourly": "relativehumidity_2m"}
+        self.timeout = timeout   # (connect, read) seconds
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session = session
+
+    def fetch(self):
+        response = self.session.get(self.URL, params=self.params, timeout=self.timeout)
+        response.raise_for_status()
+        return self.parse(response.json())
+
+    @staticmethod
+    def parse(data):
+        current = data["current_weather"]
+        code = current["weathercode"]
+
+        # Humidity of the current hour rather than the first hour of the day
+        hourly = data["hourly"]
+        hour = current.get("time", "")[:13] + ":00"
+        times = hourly.get("time", [])
+        humidity = hourly["relativehumidity_2m"][times.index(hour) if hour in times else 0]
+
+        return Weather(round(current["temperature"]), humidity, current["windspeed"],
+                       WEATHER_CODES.get(code, f"Weather code {code}"))
+
+
+class StubSource:
+    """
+    Fixed weather; set `error` to make fetch() fail.
+    """
+
+    def __init__(self, weather=Weather(12, 80, 3.5, "Partly cloudy"), error=None):
+        self.weather = weather
+        self.error = error
+        self.calls = 0
+
+    def fetch(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.weather
+
+
+class WeatherProvider:
+    """
+    interval: seconds between refreshes; retry: seconds until the next try
+    after a failed one. The thread starts on the first get().
+    """
+
+    def __init__(self, source, interval=300, retry=30):
+        self.source = source
+        self.interval = interval
+        self.retry = retry
+        self.lock = threading.Lock()
+        self.reading = None
+        self.refreshing = False
+        self.wake = threading.Event()
+        self.thread = None
+
+    def get(self):
+        """
+        The latest Reading (never blocks), or None before the first fetch finished.
+        """
+        self.start()
+        return self.reading
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="weather", daemon=True)
+                self.thread.start()
+
+    def refresh(self):
+        """
+        One fetch; on failure the previous weather is kept. Returns True on success.
+        """
+        self.refreshing = True
+        try:
+            weather = self.source.fetch()
+        except Exception as e:
+            old = self.reading
+            self.reading = Reading(old.weather if old else None, old.fetched_at if old else None, e)
+            return False
+        finally:
+            self.refreshing = False
+        self.reading = Reading(weather, time.time(), None)
+        return True
+
+    def _run(self):
+        while True:
+            delay = self.interval if self.refresh() else self.retry
+            self.wake.wait(delay)
+            self.wake.clear()
+
+    def age(self):
+        reading = self.reading
+        if reading is None or reading.fetched_at is None:
+            return None
+        return time.time() - reading.fetched_at
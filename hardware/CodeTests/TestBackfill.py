@@ -0,0 +1,121 @@
+import json
+import mmap
+
+import pytest
+
+from backfill import Backfill, copy_value, iter_json_array, iter_lines
+
+
+def ldr_entry(n):
+    return {"timestamp": "2025-10-27 10:30:45", "card_id": "0C9B5023", "ldr_raw": n,
+            "ldr_voltage": 1.2, "light_level": "Dim"}
+
+
+def access_entry(n):
+    # Non-ASCII names make byte and character offsets differ
+    return {"timestamp": "2025-10-27 10:30:45", "tag_id": "0C9B5023", "access_granted": True,
+            "user_name": f"Jöhn Døe {n}"}
+
+
+def mapped(path):
+    f = open(path, "rb")
+    return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def test_json_array_small_window_and_resume(tmp_path):
+    path = tmp_path / "access_log.json"
+    entries = [access_entry(n) for n in range(50)]
+    path.write_text(json.dumps(entries), encoding="utf-8")
+
+    f, mm = mapped(path)
+    with f, mm:
+        read = list(iter_json_array(mm, window=64))
+        assert [e for e, _ in read] == entries
+
+        # Resuming at any end offset continues with the next element
+        resumed = [e for e, _ in iter_json_array(mm, read[19][1], window=64)]
+        assert resumed == entries[20:]
+
+
+def test_json_array_skips_corrupt_element(tmp_path):
+    path = tmp_path / "access_log.json"
+    entries = [access_entry(n) for n in range(50)]
+    text = json.dumps(entries)
+    # Break element 10 in the middle; a literal cut at a window edge must
+    # still be read as an element that continues in the next window
+    broken = json.dumps(entries[10])
+    text = text.replace(broken, broken.replace("true", "tru", 1), 1)
+    path.write_text(text, encoding="utf-8")
+
+    f, mm = mapped(path)
+    with f, mm:
+        for window in (64, 97, 4096):
+            read = [e for e, _ in iter_json_array(mm, window=window)]
+            assert read == entries[:10] + [None] + entries[11:]
+
+
+def test_json_array_truncated_at_the_end(tmp_path):
+    path = tmp_path / "ldr_log.json"
+    entries = [ldr_entry(n) for n in range(5)]
+    path.write_text(json.dumps(entries)[:-20], encoding="utf-8")
+
+    f, mm = mapped(path)
+    with f, mm:
+        assert [e for e, _ in iter_json_array(mm, window=64)] == entries[:4]
+
+
+def test_serial_capture_lines(tmp_path):
+    path = tmp_path / "capture.log"
+    path.write_bytes(
+        b"Card scanned: 0C9B5023\r\n"
+        b"LDR_LOG: " + json.dumps(ldr_entry(1)).encode() + b"\r\n"
+        b"LDR_LOG: {broken\r\n"
+        b"ACCESS_LOG: " + json.dumps(access_entry(2)).encode() + b"\r\n"
+    )
+    f, mm = mapped(path)
+    with f, mm:
+        kinds = [kind for kind, _, _ in iter_lines(mm)]
+    assert kinds == ["ldr", "bad", "access"]
+
+
+def test_copy_value_escapes():
+    assert copy_value(None) == "\\N"
+    assert copy_value(True) == "t"
+    assert copy_value("a\tb\\c\n") == "a\\tb\\\\c\\n"
+
+
+class FlakyLoader:
+    def __init__(self, fail_at=None):
+        self.rows = []
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def __call__(self, conn, chunk):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise RuntimeError("connection dropped")
+        rows = chunk["access"] + chunk["ldr"]
+        self.rows.extend(rows)
+        return len(rows)
+
+
+def test_resume_from_checkpoint(tmp_path):
+    path = tmp_path / "ldr_log.json"
+    path.write_text(json.dumps([ldr_entry(n) for n in range(100)]))
+
+    first = FlakyLoader(fail_at=3)
+    with pytest.raises(RuntimeError):
+        Backfill(connect=object, workers=1, chunk_rows=10, load=first).run(str(path))
+    # Chunks read ahead may have committed too, but the checkpoint stops at the failed one
+    assert len(first.rows) >= 20
+
+    second = FlakyLoader()
+    stats = Backfill(connect=object, workers=1, chunk_rows=10, load=second).run(str(path))
+    assert stats["read"] == 80
+
+    assert sorted(set(row[-1] for row in first.rows + second.rows)) == list(range(1, 101))
+    # Records without ids get a stable one, so a re-run is deduplicated by the DB
+    assert second.rows[0][-3:] == ("backfill:ldr_log.json", 0, 21)
+
+    # Fully loaded: nothing left to do
+    assert Backfill(connect=object, workers=1, load=FlakyLoader()).run(str(path))["read"] == 0
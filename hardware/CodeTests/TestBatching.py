@@ -0,0 +1,172 @@
+import datetime
+import os
+import re
+
+import psycopg2
+import pytest
+
+import batching
+from batching import BatchWriter
+from functions.CodeTests.fakes import FakeConn
+
+ACCESS = {"timestamp": "2025-10-27 10:30:45", "tag_id": "0C9B5023", "user_name": "John Doe", "access_granted": True,
+          "device": "E661", "boot": 1, "seq": 0}
+
+# Old firmware: no boot/seq
+OLD_ACCESS = {k: v for k, v in ACCESS.items() if k not in ("boot", "seq")}
+OLD_LDR = {"timestamp": "2025-10-27 10:30:46", "ldr_raw": 1200, "ldr_voltage": 0.06, "light_level": "Dark",
+           "device": "E661"}
+
+
+def test_add_skips_bad_ldr_payload():
+    writer = BatchWriter(FakeConn(), on_flush=None)
+    assert writer.add("ldr", {"timestamp": "2025-10-27 10:30:45", "ldr_raw": None}) is False
+    assert writer.add("ldr", {"timestamp": "not a time", "ldr_raw": 5, "ldr_voltage": 0.1}) is False
+    assert writer.count == 0
+
+
+def test_rows_are_typed_client_side():
+    row = batching.access_row(dict(ACCESS, timestamp="2025-10-27T10:30:45Z", seq="7"))
+    assert row[0] == datetime.datetime(2025, 10, 27, 10, 30, 45, tzinfo=datetime.timezone.utc)
+    assert row[-1] == 7
+
+
+def test_flush_when_max_rows_reached(monkeypatch):
+    calls = []
+    monkeypatch.setattr(batching, "execute_values", lambda cur, sql, rows, **kw: calls.append((sql, list(rows))))
+
+    flushed = []
+    writer = BatchWriter(FakeConn(), max_rows=3, on_flush=flushed.append, prepared=False)
+    for _ in range(3):
+        writer.add("access", ACCESS)
+
+    assert len(calls) == 2             # history + sensor_latest, same transaction
+    assert len(calls[0][1]) == 3
+    assert calls[1][0] == batching.LATEST_SQL and len(calls[1][1]) == 1
+    assert flushed[0].total == 3 and flushed[0].rows["access"] == 3
+    assert writer.count == 0 and not writer.due()
+
+
+def test_user_updates_keep_last_per_tag(monkeypatch):
+    calls = []
+    monkeypatch.setattr(batching, "execute_values", lambda cur, sql, rows, **kw: calls.append(list(rows)))
+
+    writer = BatchWriter(FakeConn(), on_flush=None, prepared=False)
+    writer.add("user", {"action": "register", "card_id": "A1", "user_name": "Old"})
+    writer.add("user", {"action": "register", "card_id": "A1", "user_name": "New"})
+    writer.flush()
+
+    assert calls == [[("A1", "New")]]
+
+
+def test_deregister_deletes_user(monkeypatch):
+    calls = []
+    monkeypatch.setattr(batching, "execute_values", lambda cur, sql, rows, **kw: calls.append(list(rows)))
+
+    conn = FakeConn()
+    writer = BatchWriter(conn, on_flush=None, prepared=False)
+    writer.add("user", {"action": "register", "card_id": "A1", "user_name": "Ann"})
+    writer.add("user", {"action": "register", "card_id": "B2", "user_name": "Bob"})
+    writer.add("user", {"action": "deregister", "card_id": "A1"})
+    writer.flush()
+
+    assert conn.executed == [(batching.USER_DELETE_SQL, (["A1"],))]
+    assert calls == [[("B2", "Bob")]]
+
+
+def test_prepared_once_per_connection_and_columnar():
+    conn = FakeConn()
+    writer = BatchWriter(conn, on_flush=None)
+    writer.add("access", ACCESS)
+    writer.add("access", dict(ACCESS, seq=1))
+    writer.flush()
+    writer.add("access", dict(ACCESS, seq=2))
+    writer.flush()
+
+    prepares = [sql for sql, _ in conn.executed if "PREPARE" in sql]
+    executes = [params for sql, params in conn.executed if sql.startswith("EXECUTE bridge_access")]
+    assert len(prepares) == 2          # history + user statements, once
+    assert executes[0][1] == ["0C9B5023", "0C9B5023"]
+    assert executes[1][-1] == [2]
+
+    # New connection after a reconnect: prepared again
+    writer.conn = FakeConn()
+    writer.add("access", dict(ACCESS, seq=3))
+    writer.flush()
+    assert any("PREPARE" in sql for sql, _ in writer.conn.executed)
+
+
+def test_flush_notifies_changed_sensors_after_latest():
+    conn = FakeConn()
+    writer = BatchWriter(conn, on_flush=None)
+    writer.add("access", ACCESS)
+    writer.flush()
+
+    sqls = [sql for sql, _ in conn.executed]
+    assert sqls[-2] == batching.EXECUTE_LATEST
+    assert conn.executed[-1] == (batching.NOTIFY_SQL, (batching.NOTIFY_CHANNEL, '[["E661", "rfid"]]'))
+
+
+def test_latest_keeps_newest_reading_per_device_and_sensor():
+    ldr = {"timestamp": "2025-10-27 10:30:45", "card_id": "0C9B5023", "ldr_raw": 100, "ldr_voltage": 0.1,
+           "light_level": "Dark", "device": "E661", "boot": 1, "seq": 1}
+    rows = [batching.ldr_row(ldr),
+            batching.ldr_row(dict(ldr, timestamp="2025-10-27 10:30:50", ldr_raw=40000, light_level="Bright", seq=2)),
+            batching.ldr_row(dict(ldr, timestamp="2025-10-27 10:30:40", ldr_raw=5, seq=3)),
+            batching.ldr_row(dict(ldr, device="F00D", seq=4))]
+
+    latest = {(r[0], r[1]): r for r in batching.latest_rows([batching.access_row(ACCESS)], rows)}
+
+    assert latest[("E661", "ldr")][3:] == (40000.0, "Bright")
+    assert latest[("F00D", "ldr")][3] == 100.0
+    assert latest[("E661", "rfid")][3:] == (1.0, "0C9B5023")
+
+
+def prepared_types(name):
+    sql = batching.PREPARE_HISTORY_SQL + batching.PREPARE_USER_SQL
+    signature = sql.split(f"PREPARE {name} (", 1)[1].split(") AS", 1)[0]
+    return [t.strip()[:-2] for t in signature.split(",")]
+
+
+def test_prepared_arrays_are_cast_for_rows_without_seq():
+    conn = FakeConn()
+    writer = BatchWriter(conn, on_flush=None)
+    writer.add("access", OLD_ACCESS)
+    writer.add("access", dict(OLD_ACCESS, tag_id="B2"))
+    writer.add("ldr", OLD_LDR)
+    writer.add("user", {"action": "register", "card_id": "A1", "user_name": "Ann"})
+    writer.flush()
+
+    executes = [(sql, params) for sql, params in conn.executed if sql.startswith("EXECUTE")]
+    assert len(executes) == 4
+    for sql, _ in executes:
+        assert re.findall(r"%s::([a-z ]+)\[\]", sql) == prepared_types(sql.split()[1])
+    assert executes[0][1][-2:] == [[None, None], [None, None]]
+
+
+@pytest.mark.skipif(not os.getenv("BRIDGE_TEST_DSN"), reason="set BRIDGE_TEST_DSN to a throwaway database")
+def test_rows_without_seq_through_postgres():
+    from functions.migrations import migrate
+    from functions.partitions import maintain
+
+    conn = psycopg2.connect(os.environ["BRIDGE_TEST_DSN"])
+    try:
+        migrate(conn)
+        maintain(conn, now=datetime.datetime(2025, 10, 27, tzinfo=datetime.timezone.utc))
+        with conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM public.rfid_checkin WHERE device = 'E661'")
+            cur.execute("DELETE FROM public.ldr_readings WHERE device = 'E661'")
+
+        writer = BatchWriter(conn, on_flush=None)
+        writer.add("access", OLD_ACCESS)
+        writer.add("access", dict(OLD_ACCESS, tag_id="B2"))
+        writer.add("ldr", OLD_LDR)
+        writer.flush()
+
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM public.rfid_checkin WHERE device = 'E661' AND seq IS NULL")
+            assert cur.fetchone()[0] == 2
+            cur.execute("SELECT count(*) FROM public.ldr_readings WHERE device = 'E661' AND boot_id IS NULL")
+            assert cur.fetchone()[0] == 1
+    finally:
+        conn.close()
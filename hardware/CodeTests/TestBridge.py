@@ -0,0 +1,190 @@
+import os
+import termios
+import threading
+import time
+
+import psycopg2
+import pytest
+
+import bridge
+from batching import BatchWriter
+from functions.CodeTests.fakes import FakeConn
+from pipeline import Event, EventQueue
+from spool import Spool
+
+ACCESS = {"timestamp": "2025-10-27 10:30:45", "tag_id": "A1", "access_granted": True, "device": "E661"}
+
+
+def test_parse_line_rejects_payloads_that_are_not_objects():
+    assert bridge.parse_line('LDR_LOG: {"ldr_raw": 5}') == ("ldr", {"ldr_raw": 5})
+    assert bridge.parse_line("BOOT: hello") == (None, None)
+    with pytest.raises(ValueError):
+        bridge.parse_line("LDR_LOG: 5")
+    with pytest.raises(ValueError):
+        bridge.parse_line('USER_UPDATE: ["A1"]')
+
+
+def test_reader_skips_bad_events_and_keeps_reading():
+    master, slave = os.openpty()
+    queue = EventQueue(100)
+    stop = threading.Event()
+    reader = threading.Thread(target=bridge.read_serial, args=(queue, stop, os.ttyname(slave)), daemon=True)
+    reader.start()
+    time.sleep(0.5)   # open_serial() discards what arrived before it
+    try:
+        os.write(master, b"LDR_LOG: 5\r\n")
+        os.write(master, b'ACCESS_LOG: {"tag_id": "A1", "boot": 1, "seq": "seven"}\r\n')
+        os.write(master, b'ACCESS_LOG: {"tag_id": "B2", "boot": 1, "seq": 8}\r\n')
+        event = queue.get(timeout=3)
+        assert event is not None and event.data["tag_id"] == "B2"
+        assert reader.is_alive()
+    finally:
+        stop.set()
+        reader.join(timeout=3)
+        os.close(master)
+        os.close(slave)
+
+
+class FlakyPort:
+    """
+    serial.Serial stand-in that plays `script` for its reads: bytes are
+    returned, exceptions raised. broken=True fails like a port that is
+    still re-enumerating.
+    """
+
+    def __init__(self, script=(), broken=False):
+        self.script = list(script)
+        self.broken = broken
+        self.closed = False
+        self.in_waiting = 0
+
+    def reset_input_buffer(self):
+        if self.broken:
+            raise termios.error(5, "Input/output error")
+
+    def read(self, size):
+        if not self.script:
+            time.sleep(0.01)
+            return b""
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+    def close(self):
+        self.closed = True
+
+
+def fake_ports(monkeypatch, *ports):
+    opened = []
+
+    def open_port(*args, **kwargs):
+        opened.append(ports[len(opened)])
+        return opened[-1]
+
+    monkeypatch.setattr(bridge.serial, "Serial", open_port)
+    return opened
+
+
+def test_open_serial_closes_half_opened_port_and_retries(monkeypatch):
+    opened = fake_ports(monkeypatch, FlakyPort(broken=True), FlakyPort())
+    ser = bridge.open_serial("/dev/ttyPICO")
+    assert ser is opened[1] and opened[0].closed
+
+
+def test_reader_survives_any_port_error(monkeypatch):
+    line = b'ACCESS_LOG: {"tag_id": "A1", "boot": 1, "seq": 1}\r\n'
+    opened = fake_ports(monkeypatch, FlakyPort([OSError(5, "Input/output error")]),
+                        FlakyPort([RuntimeError("driver bug"), line]))
+    queue = EventQueue(100)
+    stop = threading.Event()
+    reader = threading.Thread(target=bridge.read_serial, args=(queue, stop, "/dev/ttyPICO"), daemon=True)
+    reader.start()
+    try:
+        event = queue.get(timeout=5)
+        assert event is not None and event.data["tag_id"] == "A1"
+        assert reader.is_alive() and len(opened) == 2 and opened[0].closed
+    finally:
+        stop.set()
+        reader.join(timeout=3)
+    assert not reader.is_alive() and opened[1].closed
+
+
+class RefusingConn(FakeConn):
+    """
+    Accepts every statement except access rows for tag BAD. The first
+    `drop` inserts fail as if the connection were lost.
+    """
+
+    def __init__(self, drop=0):
+        super().__init__()
+        self.drop = drop
+
+    def answer(self, sql, params):
+        if sql.startswith("EXECUTE bridge_") and self.drop:
+            self.drop -= 1
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        if sql.startswith("EXECUTE bridge_access") and "BAD" in params[1]:
+            raise psycopg2.ProgrammingError("refused")
+        return None
+
+
+def test_writer_sets_refused_batch_aside_and_keeps_connection(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conns = []
+
+    def connect():
+        conns.append(RefusingConn())
+        return conns[-1]
+
+    queue = EventQueue(100)
+    spool = Spool(str(tmp_path / "spool"))
+    stop = threading.Event()
+    writer = threading.Thread(target=bridge.write_db,
+                              args=(queue, spool, stop, connect, lambda conn: BatchWriter(conn, on_flush=None)))
+    writer.start()
+    queue.put(Event("access", dict(ACCESS, tag_id="BAD"), "test", 0.0))
+    time.sleep(0.5)
+    queue.put(Event("access", ACCESS, "test", 0.0))
+    stop.set()
+    writer.join(timeout=5)
+
+    assert not writer.is_alive()
+    assert len(conns) == 1 and spool.empty()
+    written = [params for sql, params in conns[0].executed if sql.startswith("EXECUTE bridge_access")]
+    assert len(written) == 1 and written[0][1] == ["A1"]
+    with open(bridge.DEAD_LETTER_PATH) as f:
+        lines = f.readlines()
+    assert len(lines) == 1 and '"BAD"' in lines[0]
+
+
+def test_event_in_hand_is_spooled_when_replay_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(bridge, "DB_BACKOFF_BASE", 0.05)
+    conns = []
+
+    def connect():
+        # The first connection dies on the replay's first insert
+        conns.append(RefusingConn(drop=0 if conns else 1))
+        return conns[-1]
+
+    queue = EventQueue(100)
+    spool = Spool(str(tmp_path / "spool"))
+    spool.append(Event("access", dict(ACCESS, tag_id="S1"), "test", 0.0))
+    stop = threading.Event()
+    writer = threading.Thread(target=bridge.write_db,
+                              args=(queue, spool, stop, connect, lambda conn: BatchWriter(conn, on_flush=None)))
+    writer.start()
+    queue.put(Event("access", dict(ACCESS, tag_id="Q1"), "test", 0.0))
+
+    written = []
+    deadline = time.monotonic() + 5
+    while len(written) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+        written = [tag for conn in conns for sql, params in conn.executed
+                   if sql.startswith("EXECUTE bridge_access") for tag in params[1]]
+    stop.set()
+    writer.join(timeout=5)
+
+    assert not writer.is_alive()
+    assert len(conns) == 2
+    assert written == ["S1", "Q1"] and spool.empty()
@@ -0,0 +1,34 @@
+from dedupe import DedupeFilter, SeqWindow
+
+
+def test_window_drops_repeats_and_accepts_late_arrivals():
+    window = SeqWindow(size=8)
+    assert [window.check(s) for s in (0, 1, 3, 1, 2, 3)] == [True, True, True, False, True, False]
+
+
+def test_window_lets_through_seqs_older_than_window():
+    window = SeqWindow(size=4)
+    for s in range(10):
+        window.check(s)
+    # 2 fell out of the window; the DB unique index decides
+    assert window.check(2) is True
+    assert window.check(9) is False
+
+
+def test_filter_keys_by_device_and_boot():
+    dedupe = DedupeFilter()
+    event = {"device": "E661", "boot": 1, "seq": 5}
+    assert dedupe.accept(event)
+    assert not dedupe.accept(dict(event))
+    # Same seq after a reboot is a new event
+    assert dedupe.accept(dict(event, boot=2))
+    # No seq (old firmware) always passes
+    assert dedupe.accept({"tag_id": "A1"}) and dedupe.accept({"tag_id": "A1"})
+    assert dedupe.duplicates == 1
+
+
+def test_filter_forgets_least_recent_stream():
+    dedupe = DedupeFilter(max_streams=2)
+    for boot in (1, 2, 3):
+        dedupe.accept({"device": "E661", "boot": boot, "seq": 0})
+    assert list(dedupe.streams) == [("E661", 2), ("E661", 3)]
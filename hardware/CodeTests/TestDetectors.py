@@ -0,0 +1,82 @@
+import random
+
+import batching
+from batching import BatchWriter
+from detectors import DeniedBurstDetector, DetectorStage, LightJumpDetector
+from functions.CodeTests.fakes import FakeConn
+from metrics import ALERTS
+
+
+def ldr(second, raw, device="E661"):
+    return {"timestamp": f"2026-10-18 12:{second // 60:02d}:{second % 60:02d}", "ldr_raw": raw, "device": device}
+
+
+def denied(second, tag="DEADBEEF", granted=False):
+    return {"timestamp": f"2026-10-18 12:{second // 60:02d}:{second % 60:02d}", "tag_id": tag,
+            "access_granted": granted, "device": "E661"}
+
+
+def test_light_jump_alerts_once_after_warmup():
+    detector = LightJumpDetector(warmup=30, cooldown=60)
+    rng = random.Random(1)
+    for s in range(100):
+        assert detector.observe("ldr", ldr(s, int(rng.gauss(20000, 100)))) == []
+
+    alerts = detector.observe("ldr", ldr(100, 2000))      # lamp went out
+    assert len(alerts) == 1
+    assert alerts[0]["detector"] == "ldr_zscore" and alerts[0]["score"] < -4
+    # Still dark a few seconds later: within the cooldown
+    assert detector.observe("ldr", ldr(101, 2000)) == []
+
+
+def test_light_jump_state_is_per_device():
+    detector = LightJumpDetector(warmup=5)
+    for s in range(10):
+        detector.observe("ldr", ldr(s, 20000, "a"))
+    # A new device starts its own baseline instead of alerting against "a"
+    assert detector.observe("ldr", ldr(10, 1000, "b")) == []
+    assert len(detector.state) == 2
+
+
+def test_denied_burst_counts_sliding_window():
+    detector = DeniedBurstDetector(window=60, limit=5)
+    for s in range(4):
+        assert detector.observe("access", denied(s)) == []
+    assert detector.observe("access", denied(4, granted=True)) == []
+    assert detector.observe("access", denied(5, tag="OTHER")) == []
+
+    alerts = detector.observe("access", denied(6))
+    assert len(alerts) == 1 and alerts[0]["key"] == "DEADBEEF"
+    assert detector.observe("access", denied(7)) == []   # cooldown
+
+
+def test_denied_burst_spanning_two_windows():
+    detector = DeniedBurstDetector(window=60, limit=5)
+    for s in (50, 53, 56, 59):
+        detector.observe("access", denied(s))
+    # 12:01:00 starts the next fixed window, but the last 60 s hold 5 scans
+    assert len(detector.observe("access", denied(60))) == 1
+
+
+def test_stage_counts_alerts_and_skips_bad_payloads():
+    class Always:
+        def observe(self, kind, data):
+            return [{"detector": "always", "key": "k", "message": "m"}]
+
+    before = ALERTS.get("always")
+    stage = DetectorStage([LightJumpDetector(), Always()])
+    alerts = stage.observe("ldr", {"timestamp": "2026-10-18 12:00:00", "ldr_raw": None})
+    assert [a["detector"] for a in alerts] == ["always"]
+    assert ALERTS.get("always") == before + 1
+
+
+def test_alerts_are_written_as_their_own_kind(monkeypatch):
+    calls = []
+    monkeypatch.setattr(batching, "execute_values", lambda cur, sql, rows, **kw: calls.append((sql, list(rows))))
+
+    writer = BatchWriter(FakeConn(), on_flush=None, prepared=False)
+    alert = DeniedBurstDetector(limit=1).observe("access", denied(0))[0]
+    assert writer.add("alert", alert)
+    writer.flush()
+    assert calls[0][0] == batching.ALERT_SQL
+    assert calls[0][1][0][2:4] == ("denied_burst", "DEADBEEF")
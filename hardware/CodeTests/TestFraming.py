@@ -0,0 +1,42 @@
+from framing import StreamDecoder, encode_frame
+
+LDR = {"timestamp": "2025-10-27 10:30:45", "card_id": "0C9B5023", "ldr_raw": 1200, "ldr_voltage": 0.06, "light_level": "Dark"}
+ACCESS = {"timestamp": "2025-10-27 10:30:45", "tag_id": "0C9B5023", "access_granted": True, "user_name": "John Doe"}
+
+
+def test_roundtrip_mixed_with_text_lines():
+    stream = b"BOOT: Smart Home\r\n" + encode_frame("ldr", LDR, 1) + b'ACCESS_LOG: {"tag_id": "A1"}\r\n' + encode_frame("access", ACCESS, 2)
+    decoder = StreamDecoder()
+    out = decoder.feed(stream)
+
+    assert out[0] == (None, "BOOT: Smart Home")
+    assert out[1] == ("ldr", dict(LDR, device="", boot=0, seq=1))
+    assert out[2] == (None, 'ACCESS_LOG: {"tag_id": "A1"}')
+    assert out[3] == ("access", dict(ACCESS, device="", boot=0, seq=2))
+
+
+def test_frame_split_across_reads():
+    frame = encode_frame("user", {"action": "register", "card_id": "A1B2C3D4", "user_name": "Jane"}, 9, boot=77, device="E6614103E7")
+    decoder = StreamDecoder()
+    assert decoder.feed(frame[:4]) == []
+    assert decoder.feed(frame[4:]) == [("user", {
+        "action": "register", "card_id": "A1B2C3D4", "user_name": "Jane", "device": "E6614103E7", "boot": 77, "seq": 9,
+    })]
+
+
+def test_corrupt_frame_is_skipped_and_stream_recovers():
+    bad = bytearray(encode_frame("ldr", LDR, 1))
+    bad[12] ^= 0xFF
+    decoder = StreamDecoder()
+    out = decoder.feed(bytes(bad) + encode_frame("ldr", LDR, 2))
+
+    frames = [data for kind, data in out if kind]
+    assert frames == [dict(LDR, device="", boot=0, seq=2)]
+    assert decoder.corrupt >= 1
+
+
+def test_binary_frame_is_much_smaller_than_text():
+    import json
+    ids = {"device": "E661410403A7582F", "boot": 3735928559, "seq": 12345}
+    text = ("LDR_LOG: " + json.dumps(dict(LDR, **ids)) + "\n").encode()
+    assert len(encode_frame("ldr", LDR, ids["seq"], ids["boot"], ids["device"])) * 4 < len(text)
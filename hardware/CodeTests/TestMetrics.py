@@ -0,0 +1,62 @@
+import logging
+import urllib.request
+
+from logsetup import RateLimitFilter
+from metrics import Counter, Histogram, LastSeen, Registry, serve, write_textfile
+
+
+def test_render_counter_and_histogram():
+    registry = Registry()
+    failures = Counter("parse_failures_total", "Bad input", ["kind"], registry=registry)
+    latency = Histogram("insert_seconds", "Insert latency", [0.01, 0.1], registry=registry)
+
+    failures.inc("ldr")
+    failures.inc("ldr", amount=2)
+    latency.observe(0.005)
+    latency.observe(0.05)
+    latency.observe(3)
+
+    text = registry.render()
+    assert "# TYPE parse_failures_total counter" in text
+    assert 'parse_failures_total{kind="ldr"} 3' in text
+    assert 'insert_seconds_bucket{le="0.01"} 1' in text
+    assert 'insert_seconds_bucket{le="0.1"} 2' in text
+    assert 'insert_seconds_bucket{le="+Inf"} 3' in text
+    assert "insert_seconds_count 3" in text
+
+
+def test_http_endpoint_and_textfile(tmp_path):
+    registry = Registry()
+    seen = LastSeen("last_event_age_seconds", "Age", ["device"], registry=registry)
+    seen.touch("E661")
+
+    server = serve(0, "127.0.0.1", registry=registry)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+    assert 'last_event_age_seconds{device="E661"}' in body
+
+    path = str(tmp_path / "bridge.prom")
+    write_textfile(path, registry=registry)
+    with open(path) as f:
+        assert "last_event_age_seconds" in f.read()
+
+
+def test_rate_limit_filter_suppresses_repeats():
+    limiter = RateLimitFilter(interval=60, burst=2)
+
+    def record(msg):
+        return logging.LogRecord("bridge", logging.WARNING, __file__, 1, msg, ("x",), None)
+
+    passed = [limiter.filter(record("Bad serial line: %s")) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    # A different message has its own budget
+    assert limiter.filter(record("DB connection lost: %s"))
+
+    # Next window reports what was dropped
+    limiter.windows[("bridge", "Bad serial line: %s")][0] -= 60
+    first = record("Bad serial line: %s")
+    assert limiter.filter(first)
+    assert first.getMessage() == "Bad serial line: x (3 similar messages suppressed)"
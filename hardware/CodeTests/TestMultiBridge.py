@@ -0,0 +1,154 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bridge
+import multibridge
+from dedupe import DedupeFilter
+from multibridge import PortWatcher, read_port, write_events
+from pipeline import Event
+from spool import Spool
+from TestBridge import ACCESS, RefusingConn
+
+
+async def collect(queue, count, timeout=2):
+    events = []
+    for _ in range(count):
+        events.append(await asyncio.wait_for(queue.get(), timeout))
+    return events
+
+
+def test_read_port_tags_events_with_source():
+    async def scenario():
+        master, slave = os.openpty()
+        path = os.ttyname(slave)
+        queue = asyncio.Queue()
+        task = asyncio.create_task(read_port(path, queue, dedupe=DedupeFilter()))
+        await asyncio.sleep(0.05)
+
+        os.write(master, b'LDR_LOG: {"ldr_raw": 1200, "ldr_voltage": 0.06}\r\n')
+        os.write(master, b"BOOT: noise\r\nACCESS_LOG: {broken\r\n")
+        os.write(master, b'LDR_LOG: 5\r\nLDR_LOG: {"ldr_raw": 1, "boot": 1, "seq": "x"}\r\n')
+        os.write(master, b'ACCESS_LOG: {"tag_id": "0C9B5023", "access_granted": true}\r\n')
+        events = await collect(queue, 2)
+
+        task.cancel()
+        os.close(master)
+        os.close(slave)
+        return path, events
+
+    path, events = asyncio.run(scenario())
+    assert [e.kind for e in events] == ["ldr", "access"]
+    assert all(e.source == path for e in events)
+
+
+def test_watcher_handles_hot_plug(tmp_path):
+    async def scenario():
+        queue = asyncio.Queue()
+        watcher = PortWatcher([str(tmp_path / "ttyACM*")], queue, rescan=0.05)
+        run = asyncio.create_task(watcher.run())
+
+        master, slave = os.openpty()
+        link = tmp_path / "ttyACM0"
+        os.symlink(os.ttyname(slave), link)
+        os.close(slave)
+        await asyncio.sleep(0.2)
+        plugged = sorted(watcher.readers)
+
+        os.write(master, b'USER_UPDATE: {"action": "register", "card_id": "A1"}\n')
+        event = (await collect(queue, 1))[0]
+
+        # Unplug: hang up the pty and remove the device node
+        os.close(master)
+        os.remove(link)
+        await asyncio.sleep(0.3)
+        unplugged = sorted(watcher.readers)
+
+        run.cancel()
+        return plugged, event, unplugged
+
+    plugged, event, unplugged = asyncio.run(scenario())
+    assert plugged == [str(tmp_path / "ttyACM0")]
+    assert event.kind == "user" and event.source == plugged[0]
+    assert unplugged == []
+
+
+def test_refused_batch_does_not_stop_the_writer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = RefusingConn()
+    monkeypatch.setattr(multibridge, "connect_manager", lambda: bridge.connect_manager(lambda: conn))
+
+    async def scenario():
+        queue = asyncio.Queue()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            task = asyncio.create_task(write_events(queue, Spool(str(tmp_path / "spool")), executor))
+            await queue.put(Event("access", dict(ACCESS, tag_id="BAD"), "test", 0.0))
+            await asyncio.sleep(0.5)
+            await queue.put(Event("access", ACCESS, "test", 0.0))
+            await asyncio.sleep(0.5)
+            alive = not task.done()
+            task.cancel()
+        return alive
+
+    assert asyncio.run(scenario())
+    written = [params for sql, params in conn.executed if sql.startswith("EXECUTE bridge_access")]
+    assert len(written) == 1 and written[0][1] == ["A1"]
+    with open(bridge.DEAD_LETTER_PATH) as f:
+        assert '"BAD"' in f.read()
+
+
+def access_tags(conns):
+    return [tag for conn in conns for sql, params in conn.executed
+            if sql.startswith("EXECUTE bridge_access") for tag in params[1]]
+
+
+def test_spooled_events_are_written_before_newer_ones_after_reconnect(tmp_path, monkeypatch):
+    monkeypatch.setattr(bridge, "DB_BACKOFF_BASE", 1.0)
+    conns = []
+    newer = []   # queued the moment the writer reconnects
+
+    def connect():
+        # The first connection dies on its first insert
+        conns.append(RefusingConn(drop=0 if conns else 1))
+        if len(conns) == 2:
+            loop, queue = newer
+            loop.call_soon_threadsafe(queue.put_nowait, Event("access", dict(ACCESS, tag_id="Q3"), "test", 0.0))
+        return conns[-1]
+
+    monkeypatch.setattr(multibridge, "connect_manager", lambda: bridge.connect_manager(connect))
+
+    async def scenario():
+        queue = asyncio.Queue()
+        newer[:] = [asyncio.get_running_loop(), queue]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            task = asyncio.create_task(write_events(queue, Spool(str(tmp_path / "spool")), executor))
+            await queue.put(Event("access", dict(ACCESS, tag_id="Q1"), "test", 0.0))
+            await asyncio.sleep(0.5)    # its flush has failed; Q1 stays pending
+            await queue.put(Event("access", dict(ACCESS, tag_id="Q2"), "test", 0.0))   # spooled
+            await asyncio.sleep(2.0)    # reconnected, Q3 queued
+            task.cancel()
+
+    asyncio.run(scenario())
+    assert access_tags(conns) == ["Q1", "Q2", "Q3"]
+
+
+def test_live_writers_wait_for_the_spool(tmp_path, monkeypatch):
+    conn = RefusingConn()
+    monkeypatch.setattr(multibridge, "connect_manager", lambda: bridge.connect_manager(lambda: conn))
+    spool = Spool(str(tmp_path / "spool"))
+    for tag in ("S1", "S2"):
+        spool.append(Event("access", dict(ACCESS, tag_id=tag), "test", 0.0))
+
+    async def scenario():
+        queue = asyncio.Queue()
+        for tag in ("Q1", "Q2"):
+            await queue.put(Event("access", dict(ACCESS, tag_id=tag), "test", 0.0))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            tasks = [asyncio.create_task(write_events(queue, spool, executor)) for _ in range(2)]
+            await asyncio.sleep(1.0)
+            for task in tasks:
+                task.cancel()
+
+    asyncio.run(scenario())
+    tags = access_tags([conn])
+    assert sorted(tags[:2]) == ["S1", "S2"] and sorted(tags[2:]) == ["Q1", "Q2"]
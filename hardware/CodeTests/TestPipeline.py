@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from pipeline import Event, EventQueue
+
+
+def make_event(i):
+    return Event("ldr", {"ldr_raw": i}, "/dev/ttyACM0", 0.0)
+
+
+def test_drop_oldest_keeps_newest_and_counts_drops():
+    queue = EventQueue(maxsize=2, policy="drop_oldest")
+    for i in range(5):
+        queue.put(make_event(i))
+
+    assert queue.stats()["dropped"] == 3
+    assert [queue.get(timeout=0).data["ldr_raw"] for _ in range(2)] == [3, 4]
+    assert queue.get(timeout=0) is None
+
+
+def test_spill_preserves_order(tmp_path):
+    path = str(tmp_path / "spill.jsonl")
+    queue = EventQueue(maxsize=2, policy="spill", spill_path=path)
+    for i in range(6):
+        queue.put(make_event(i))
+
+    assert queue.stats()["spilled"] == 4
+    assert queue.depth() == 6
+    assert [queue.get(timeout=0).data["ldr_raw"] for _ in range(6)] == list(range(6))
+    assert not os.path.exists(path)
+
+
+def test_torn_spill_line_is_skipped(tmp_path):
+    path = str(tmp_path / "spill.jsonl")
+    queue = EventQueue(maxsize=2, policy="spill", spill_path=path)
+    for i in range(4):
+        queue.put(make_event(i))
+    # Crash while spilling: the last line is cut off
+    with open(path, "a") as f:
+        f.write('{"kind": "ldr", "da')
+
+    restarted = EventQueue(maxsize=2, policy="spill", spill_path=path)
+    restarted.put(make_event(9))
+    # 0 and 1 were in memory; 2 and 3 on disk, followed by the torn line
+    assert [restarted.get(timeout=0).data["ldr_raw"] for _ in range(3)] == [2, 3, 9]
+    assert restarted.get(timeout=0) is None
+    assert restarted.stats()["corrupt"] == 1
+    assert not os.path.exists(path)
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        EventQueue(policy="ignore")
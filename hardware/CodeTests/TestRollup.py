@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+from batching import BatchWriter
+from functions import rollups
+from functions.CodeTests.fakes import FakeConn
+from functions.rollups import Rollup, choose_resolution
+
+LDR = {"timestamp": "2026-10-18 12:00:10", "ldr_raw": 100, "ldr_voltage": 0.005, "light_level": "Dark",
+       "device": "E661", "boot": 1, "seq": 0}
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class LdrConn(FakeConn):
+    """
+    inserted: what the LDR insert returns, i.e. the rows that weren't
+    conflicts. fail: the connection is gone.
+    """
+
+    def __init__(self, fail=False, inserted=()):
+        super().__init__()
+        self.fail = fail
+        self.inserted = list(inserted)
+
+    def cursor(self):
+        if self.fail:
+            raise OSError("connection lost")
+        return super().cursor()
+
+    def answer(self, sql, params):
+        return self.inserted if sql.startswith("EXECUTE bridge_ldr") else None
+
+
+def test_running_aggregates_per_bucket():
+    rollup = Rollup()
+    rollup.add("E661", utc(2026, 10, 18, 12, 0, 10), 100)
+    rollup.add("E661", utc(2026, 10, 18, 12, 0, 50), 300)
+    rollup.add("E661", utc(2026, 10, 18, 12, 1, 5), 200)
+
+    drained = rollup.drain(now=utc(2026, 10, 18, 12, 1, 30))
+    # Only the 12:00 minute has closed; the hour and day are still open
+    assert drained == {"minute": [("E661", utc(2026, 10, 18, 12, 0), 2, 400, 100, 300)]}
+
+    drained = rollup.drain(everything=True)
+    assert drained["minute"] == [("E661", utc(2026, 10, 18, 12, 1), 1, 200, 200, 200)]
+    assert drained["hour"] == [("E661", utc(2026, 10, 18, 12), 3, 600, 100, 300)]
+    assert drained["day"] == [("E661", utc(2026, 10, 18), 3, 600, 100, 300)]
+    assert len(rollup) == 0
+
+
+def test_restore_merges_back():
+    rollup = Rollup()
+    rollup.add("E661", utc(2026, 10, 18, 12, 0, 10), 100)
+    drained = rollup.drain(everything=True)
+    rollup.add("E661", utc(2026, 10, 18, 12, 0, 20), 50)
+    rollup.restore(drained)
+    assert rollup.buckets["minute"][("E661", utc(2026, 10, 18, 12, 0))] == [2, 150, 50, 100]
+
+
+def test_choose_coarsest_adequate_resolution():
+    end = utc(2026, 10, 18)
+    assert choose_resolution(end - timedelta(hours=2), end) == "minute"
+    assert choose_resolution(end - timedelta(days=1), end) == "hour"
+    assert choose_resolution(end - timedelta(days=7), end) == "hour"
+    assert choose_resolution(end - timedelta(days=90), end) == "day"
+
+
+def test_writer_feeds_rollup_only_committed_rows():
+    rollup = Rollup()
+    # Second row was already stored (spool replay): ON CONFLICT skips it
+    conn = LdrConn(inserted=[("E661", utc(2026, 10, 18, 12, 0, 10), 100)])
+    writer = BatchWriter(conn, on_flush=None, rollup=rollup)
+    writer.add("ldr", LDR)
+    writer.add("ldr", dict(LDR, ldr_raw=300, seq=1))
+    assert len(rollup) == 0    # queued isn't committed
+
+    writer.conn = LdrConn(fail=True)
+    try:
+        writer.flush()
+    except OSError:
+        pass
+    assert len(rollup) == 0 and writer.count == 2
+
+    writer.conn = conn
+    writer.flush()
+    assert rollup.buckets["hour"][("E661", utc(2026, 10, 18, 12))] == [1, 100, 100, 100]
+
+
+def test_writer_keeps_buckets_when_rollup_write_fails(monkeypatch):
+    written = []
+    monkeypatch.setattr(rollups, "execute_values", lambda cur, sql, rows, **kw: written.append((sql, list(rows))))
+    monkeypatch.setattr(Rollup, "due", lambda self: self.oldest is not None)
+
+    rollup = Rollup()
+    rollup.add("E661", utc(2026, 10, 18, 12, 0, 10), 100)
+    writer = BatchWriter(LdrConn(fail=True), on_flush=None, rollup=rollup)
+    try:
+        writer.flush(final=True)
+    except OSError:
+        pass
+    assert len(rollup) == 3 and not written
+
+    writer.conn = FakeConn()
+    writer.flush(final=True)
+    assert len(rollup) == 0
+    assert [sql.split()[2] for sql, _ in written] == ["public.ldr_rollup_minute", "public.ldr_rollup_hour",
+                                                      "public.ldr_rollup_day"]
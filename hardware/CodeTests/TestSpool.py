@@ -0,0 +1,112 @@
+import os
+import threading
+
+import pytest
+
+from pipeline import Event
+from spool import Spool
+
+
+class RecordingWriter:
+    def __init__(self, fail_on_flush=False, max_rows=None):
+        self.rows = []
+        self.committed = []
+        self.fail_on_flush = fail_on_flush
+        self.max_rows = max_rows
+        self.during_flush = None
+
+    def add(self, kind, data, autoflush=True):
+        self.rows.append(data["n"])
+        if autoflush and self.max_rows and len(self.rows) >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        if self.during_flush and self.rows:
+            self.during_flush()
+        if self.fail_on_flush and self.rows:
+            raise self.fail_on_flush
+        self.committed.extend(self.rows)
+        self.rows = []
+
+    def discard(self):
+        self.rows = []
+
+
+def fill(spool, count, start=0):
+    for n in range(start, start + count):
+        spool.append(Event("ldr", {"n": n}, "/dev/ttyACM0", 0.0))
+
+
+def test_replay_in_order_across_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=200, fsync_every=10)
+    fill(spool, 20)
+    assert len(spool.segments()) > 1
+
+    writer = RecordingWriter()
+    rows, _ = spool.replay(writer)
+
+    assert rows == 20
+    assert writer.committed == list(range(20))
+    assert spool.empty()
+
+
+def test_segment_kept_when_commit_fails(tmp_path):
+    spool = Spool(str(tmp_path))
+    fill(spool, 5)
+
+    with pytest.raises(ConnectionError):
+        spool.replay(RecordingWriter(fail_on_flush=ConnectionError("db down")), retryable=ConnectionError)
+    assert not spool.empty()
+
+    # A new Spool on the same directory (bridge restart) still replays it
+    writer = RecordingWriter()
+    Spool(str(tmp_path)).replay(writer)
+    assert writer.committed == list(range(5))
+
+
+def test_failed_segment_is_not_half_written_twice(tmp_path):
+    spool = Spool(str(tmp_path))
+    fill(spool, 5)
+
+    # Would auto-flush after 2 rows; a replayed segment must go in one flush
+    writer = RecordingWriter(fail_on_flush=ConnectionError("db down"), max_rows=2)
+    with pytest.raises(ConnectionError):
+        spool.replay(writer, retryable=ConnectionError)
+    assert writer.committed == [] and writer.rows == []
+
+    writer.fail_on_flush = False
+    spool.replay(writer)
+    assert writer.committed == list(range(5))
+
+
+def test_refused_segment_is_set_aside(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    fill(spool, 10)
+    segments = spool.segments()
+
+    writer = RecordingWriter(fail_on_flush=ValueError("bad row"))
+    spool.replay(writer, retryable=ConnectionError)
+
+    assert spool.empty() and spool.segments() == []
+    assert sorted(os.listdir(tmp_path)) == ["bad-" + os.path.basename(p)[4:] for p in segments]
+
+
+def test_appends_do_not_wait_for_replay(tmp_path):
+    spool = Spool(str(tmp_path))
+    fill(spool, 3)
+
+    def append_from_reader():
+        reader = threading.Thread(target=fill, args=(spool, 2, 100))
+        reader.start()
+        reader.join(timeout=2)
+        assert not reader.is_alive()
+
+    writer = RecordingWriter()
+    writer.during_flush = append_from_reader
+    spool.replay(writer)
+
+    assert writer.committed == [0, 1, 2]
+    assert not spool.empty()
+    writer.during_flush = None
+    spool.replay(writer)
+    assert writer.committed == [0, 1, 2, 100, 101]
@@ -0,0 +1,72 @@
+from functions.CodeTests.fakes import FakeConn
+from metrics import USER_MISMATCHES
+from users import UserDirectory, entry_hash
+
+
+class FakeUsersTable(FakeConn):
+    """
+    Answers the checksum and full-load queries from a dict.
+    """
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = dict(rows)
+
+    @property
+    def loads(self):
+        return sum("md5" not in sql for sql, _ in self.executed)
+
+    def answer(self, sql, params):
+        if "md5" in sql:
+            return [(len(self.rows), sum(entry_hash(t, n) for t, n in self.rows.items()))]
+        return list(self.rows.items())
+
+
+def test_updates_apply_in_memory():
+    users = UserDirectory()
+    users.apply({"action": "register", "card_id": "A1", "user_name": "Ann"})
+    users.apply({"action": "register", "card_id": "B2", "user_name": "Bob"})
+    users.apply({"action": "deregister", "card_id": "A1"})
+    assert users.resolve("A1") is None and users.resolve("B2") == "Bob"
+    assert users.checksum == entry_hash("B2", "Bob")
+
+
+def test_reconcile_loads_once_then_only_on_checksum_difference():
+    table = FakeUsersTable({"A1": "Ann"})
+    users = UserDirectory(interval=0, settle=0)
+    assert users.reconcile(table) and users.resolve("A1") == "Ann"
+
+    # The table got the same update through the writer: checksums match
+    users.apply({"action": "register", "card_id": "B2", "user_name": "Bob"})
+    table.rows["B2"] = "Bob"
+    assert not users.reconcile(table)
+    assert table.loads == 1
+
+    # Someone edited the table directly
+    table.rows["A1"] = "Annie"
+    assert users.reconcile(table)
+    assert users.resolve("A1") == "Annie" and table.loads == 2
+
+
+def test_reconcile_waits_for_recent_updates_to_settle():
+    table = FakeUsersTable({})
+    users = UserDirectory(interval=0, settle=60)
+    users.reconcile(table)
+    users.apply({"action": "register", "card_id": "A1", "user_name": "Ann"})
+    # Not in the table yet, but it may still be on its way there
+    assert not users.reconcile(table)
+    assert users.resolve("A1") == "Ann"
+
+
+def test_enrich_fixes_name_and_reports_unregistered_grants():
+    users = UserDirectory(interval=0)
+    users.reconcile(FakeUsersTable({"A1": "Ann"}))
+
+    event = {"tag_id": "A1", "user_name": "Old name", "access_granted": True}
+    users.enrich(event)
+    assert event["user_name"] == "Ann"
+
+    before = USER_MISMATCHES.get("unregistered")
+    users.enrich({"tag_id": "ZZ", "user_name": "Unknown", "access_granted": True})
+    users.enrich({"tag_id": "ZZ", "user_name": "Unknown", "access_granted": False})
+    assert USER_MISMATCHES.get("unregistered") == before + 1
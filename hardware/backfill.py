@@ -0,0 +1,381 @@
+"""
+Backfill rfid_checkin / ldr_readings from files instead of the serial port.
+
+Accepts the JSON logs a Pico keeps on flash (access_log.json, ldr_log.json:
+one big JSON array) and raw serial captures (ACCESS_LOG:/LDR_LOG: lines,
+parsed with bridge.parse_line). Files are memory-mapped and parsed one
+record at a time, so multi-GB inputs never sit in memory as a whole.
+
+Rows are loaded in chunks by a pool of connections: each chunk is COPY'd
+into a temp table and moved over with INSERT ... ON CONFLICT DO NOTHING,
+so re-running a file (or a chunk after a crash) adds no duplicates. The
+byte offset up to which every chunk has committed is saved in
+<file>.backfill, and the next run continues from there.
+
+    python backfill.py access_log.json ldr_log.json capture.log --workers 4
+"""
+import argparse
+import io
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import access_row, ldr_row
+from bridge import parse_line, try_connect_db
+from logsetup import setup_logging
+
+log = logging.getLogger("backfill")
+
+CHUNK_ROWS = 5000
+WORKERS = 4
+WINDOW = 1024 * 1024   # bytes of JSON decoded at a time
+# Where the element after a corrupt one can start: the next object for a
+# broken object (its own commas are inside it), else the next separator
+RESYNC_OBJECT_RE = re.compile(r"\{")
+RESYNC_VALUE_RE = re.compile(r",")
+# What is left of a number or literal cut off by the end of a window
+PARTIAL_TOKEN_RE = re.compile(r"\s*(?:[-+0-9.eE]*|t(?:r(?:ue?)?)?|f(?:a(?:l(?:se?)?)?)?|n(?:u(?:ll?)?)?)")
+
+TABLES = {
+    "access": ("public.rfid_checkin", "timestamp, tag_id, user_name, access_granted, device, boot_id, seq",
+               "timestamp timestamptz, tag_id text, user_name text, access_granted boolean, "
+               "device text, boot_id bigint, seq bigint"),
+    "ldr": ("public.ldr_readings", "timestamp, card_id, ldr_raw, ldr_voltage, light_level, device, boot_id, seq",
+            "timestamp timestamptz, card_id text, ldr_raw integer, ldr_voltage double precision, "
+            "light_level text, device text, boot_id bigint, seq bigint"),
+}
+ROW_BUILDERS = {"access": access_row, "ldr": ldr_row}
+
+
+# ----------------------------
+# Reading
+# ----------------------------
+def detect_format(mm):
+    """
+    "json" for a JSON array (the on-device logs), else "lines".
+    """
+    for b in mm[:4096]:
+        if b in b" \t\r\n":
+            continue
+        return "json" if b == ord("[") else "lines"
+    return "lines"
+
+
+def guess_kind(data):
+    if "ldr_raw" in data:
+        return "ldr"
+    if "access_granted" in data:
+        return "access"
+    return None
+
+
+def iter_json_array(mm, offset=0, window=WINDOW):
+    """
+    Yields (element, end_offset) for each element of a top-level JSON array,
+    decoding `window` bytes at a time. offset must be 0 or an end_offset
+    from an earlier call. A corrupt element is yielded as None; reading
+    picks up again at the next `{` (or `,` if it wasn't an object).
+    """
+    decoder = json.JSONDecoder()
+    size = len(mm)
+    pos = offset
+    opened = offset > 0
+    resync = None   # inside a corrupt element: pattern for where the next one starts
+
+    while pos < size:
+        last = pos + window >= size
+        raw = mm[pos:pos + window]
+        # Don't cut a multi-byte character in half
+        text = raw.decode("utf-8", errors="replace") if last else _decode_prefix(raw)
+        i = 0
+        done = 0     # bytes of this window fully consumed
+        grow = False
+
+        while True:
+            if resync:
+                match = resync.search(text, i)
+                stop = match.start() if match else len(text)
+                done += len(text[i:stop].encode("utf-8"))
+                i = stop
+                if not match:
+                    break
+                resync = None
+            # Separators are ASCII, so chars and bytes advance together
+            while i < len(text) and (text[i] in " \t\r\n," or (text[i] == "[" and not opened)):
+                opened = opened or text[i] == "["
+                i += 1
+                done += 1
+            if i >= len(text):
+                break
+            if text[i] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(text, i)
+            except json.JSONDecodeError as e:
+                if _runs_off(text, e):
+                    if last:
+                        log.warning("Truncated JSON at byte %d, stopping there", pos + done)
+                        return
+                    grow = done == 0   # a single element bigger than the window
+                    break   # next window starts at this element
+                log.warning("Corrupt JSON at byte %d (%s), skipping to the next element", pos + done, e.msg)
+                resync = RESYNC_OBJECT_RE if text[i] == "{" else RESYNC_VALUE_RE
+                stop = max(e.pos, i + 1)
+                done += len(text[i:stop].encode("utf-8"))
+                i = stop
+                yield None, pos + done
+                continue
+            done += len(text[i:end].encode("utf-8"))
+            i = end
+            yield element, pos + done
+
+        if grow:
+            window *= 2
+        pos += done
+
+
+def _runs_off(text, error):
+    """
+    True if raw_decode failed because the element continues past the end of
+    text (an unfinished string, number or literal), not because it's broken.
+    """
+    if error.msg.startswith("Unterminated string"):
+        return True
+    if error.msg.startswith("Invalid \\uXXXX escape"):
+        return error.pos + 6 > len(text)
+    return PARTIAL_TOKEN_RE.fullmatch(text, error.pos) is not None
+
+
+def _decode_prefix(raw):
+    for cut in range(4):
+        try:
+            return raw[:len(raw) - cut].decode("utf-8")
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8", errors="ignore")
+
+
+def iter_lines(mm, offset=0):
+    """
+    Yields (kind, data, end_offset) for every ACCESS_LOG/LDR_LOG/USER_UPDATE
+    line of a serial capture.
+    """
+    mm.seek(offset)
+    for raw in iter(mm.readline, b""):
+        end = mm.tell()
+        line = raw.decode("utf-8", errors="replace").strip()
+        if not line:
+            continue
+        try:
+            kind, data = parse_line(line)
+        except ValueError:
+            yield "bad", None, end
+            continue
+        if kind:
+            yield kind, data, end
+
+
+def read_records(mm, fmt, offset=0):
+    """
+    Yields (kind, data, end_offset) in file order, whatever the format.
+    """
+    if fmt == "lines":
+        yield from iter_lines(mm, offset)
+        return
+    for element, end in iter_json_array(mm, offset):
+        kind = guess_kind(element) if isinstance(element, dict) else None
+        yield kind or "bad", element, end
+
+
+# ----------------------------
+# Loading
+# ----------------------------
+def copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_text(rows):
+    return io.StringIO("".join("\t".join(copy_value(v) for v in row) + "\n" for row in rows))
+
+
+def load_chunk(conn, chunk):
+    """
+    COPY each kind into its temp table and move the rows over in one
+    transaction. Returns the number of rows actually inserted.
+    """
+    inserted = 0
+    with conn:
+        with conn.cursor() as cur:
+            for kind, rows in chunk.items():
+                if not rows:
+                    continue
+                table, cols, types = TABLES[kind]
+                cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS backfill_{kind} ({types}) ON COMMIT DELETE ROWS")
+                cur.copy_expert(f"COPY backfill_{kind} ({cols}) FROM STDIN", copy_text(rows))
+                cur.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM backfill_{kind} ON CONFLICT DO NOTHING")
+                inserted += cur.rowcount
+    return inserted
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+class Backfill:
+    """
+    connect: callable returning a new psycopg2 connection; each worker
+    thread opens its own.
+    """
+
+    def __init__(self, connect=try_connect_db, workers=WORKERS, chunk_rows=CHUNK_ROWS, load=load_chunk):
+        self.connect = connect
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.load = load
+        self.local = threading.local()
+        self.conns = []
+
+    def _load(self, chunk):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+            if conn is None:
+                raise RuntimeError("no database connection")
+            self.conns.append(conn)
+        return self.load(conn, chunk)
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self.conns = []
+
+    def run(self, path, fmt="auto", device=None, restart=False):
+        """
+        Loads one file, resuming from its checkpoint unless restart is set.
+        Returns a dict with read/inserted/skipped counts and rows/sec.
+        """
+        checkpoint = path + ".backfill"
+        size = os.path.getsize(path)
+        state = None if restart else read_checkpoint(checkpoint)
+        if state and state.get("size", 0) > size:
+            log.warning("%s shrank since the last run, starting over", path)
+            state = None
+        offset = state["offset"] if state else 0
+        index = state["index"] if state else 0
+        if offset:
+            log.info("Resuming %s at byte %d", path, offset)
+
+        stats = {"read": 0, "inserted": 0, "skipped": 0, "users": 0, "seconds": 0.0, "rate": 0.0}
+        if size == 0 or offset >= size:
+            return stats
+        # Records from before events had ids get a stable one from their place in the file
+        device = device or "backfill:" + os.path.basename(path)
+
+        start = time.monotonic()
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                ThreadPoolExecutor(self.workers, thread_name_prefix="backfill") as pool:
+            fmt = detect_format(mm) if fmt == "auto" else fmt
+            inflight = deque()
+            chunk = {"access": [], "ldr": []}
+            count = 0
+
+            def submit(end):
+                inflight.append((pool.submit(self._load, chunk), count, end, index))
+                # Bounded read-ahead: wait for the oldest chunk before reading more
+                while inflight and (inflight[0][0].done() or len(inflight) > self.workers * 2):
+                    self._commit(inflight.popleft(), stats, checkpoint, size)
+
+            for kind, data, end in read_records(mm, fmt, offset):
+                index += 1
+                if kind == "user":
+                    stats["users"] += 1
+                    continue
+                try:
+                    if kind == "bad":
+                        raise ValueError("not an access or ldr record")
+                    if data.get("seq") is None:
+                        data = dict(data, device=data.get("device") or device, boot=0, seq=index)
+                    chunk[kind].append(ROW_BUILDERS[kind](data))
+                except (KeyError, TypeError, ValueError, AttributeError) as e:
+                    stats["skipped"] += 1
+                    log.warning("Skipping record %d: %s", index, e)
+                    continue
+
+                count += 1
+                if count >= self.chunk_rows:
+                    submit(end)
+                    chunk = {"access": [], "ldr": []}
+                    count = 0
+
+            if count:
+                submit(size)
+            while inflight:
+                self._commit(inflight.popleft(), stats, checkpoint, size)
+            write_checkpoint(checkpoint, {"size": size, "offset": size, "index": index})
+
+        seconds = time.monotonic() - start
+        stats["seconds"] = round(seconds, 3)
+        stats["rate"] = stats["read"] / seconds if seconds > 0 else 0.0
+        log.info("%s: %d rows read, %d inserted, %d skipped in %.1f s (%.0f rows/s)",
+                 path, stats["read"], stats["inserted"], stats["skipped"], seconds, stats["rate"])
+        return stats
+
+    def _commit(self, item, stats, checkpoint, size):
+        """
+        Waits for the oldest in-flight chunk. Chunks finish in any order but
+        are checkpointed in file order, so the offset never passes a chunk
+        that hasn't committed.
+        """
+        future, rows, end, index = item
+        stats["inserted"] += future.result()
+        stats["read"] += rows
+        write_checkpoint(checkpoint, {"size": size, "offset": end, "index": index})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load Pico JSON logs or serial captures into PostgreSQL")
+    parser.add_argument("files", nargs="+", help="access_log.json, ldr_log.json or serial capture files")
+    parser.add_argument("--format", choices=["auto", "json", "lines"], default="auto")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="parallel DB connections")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows per COPY")
+    parser.add_argument("--device", help="device name for records without one (default: file name)")
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints and start from the beginning")
+    args = parser.parse_args()
+
+    listener = setup_logging()
+    backfill = Backfill(workers=args.workers, chunk_rows=args.chunk_rows)
+    try:
+        for path in args.files:
+            backfill.run(path, args.format, args.device, args.restart)
+    finally:
+        backfill.close()
+        listener.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+import json
+import logging
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from metrics import BATCH_ROWS, INSERT_LATENCY, PARSE_FAILURES
+
+log = logging.getLogger("batching")
+
+# ----------------------------
+# SQL (multi-row, filled in by execute_values)
+# Parameters arrive already typed (see the row builders), so no casts.
+# ----------------------------
+# (device, boot_id, seq) is unique per event; replays hit ON CONFLICT
+ACCESS_SQL = """
+INSERT INTO public.rfid_checkin (timestamp, tag_id, user_name, access_granted, device, boot_id, seq)
+VALUES %s
+ON CONFLICT DO NOTHING
+"""
+ACCESS_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s)"
+
+# RETURNING gives the rows actually inserted (not the conflicts) for the rollups
+LDR_SQL = """
+INSERT INTO public.ldr_readings (timestamp, card_id, ldr_raw, ldr_voltage, light_level, device, boot_id, seq)
+VALUES %s
+ON CONFLICT DO NOTHING
+RETURNING device, timestamp, ldr_raw
+"""
+LDR_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s, %s)"
+
+USER_UPSERT_SQL = """
+INSERT INTO public.users (tag_id, user_name)
+VALUES %s
+ON CONFLICT (tag_id) DO UPDATE SET user_name = EXCLUDED.user_name
+"""
+USER_TEMPLATE = "(%s, %s)"
+
+USER_DELETE_SQL = "DELETE FROM public.users WHERE tag_id = ANY(%s)"
+
+# Raised by the streaming detectors (detectors.py)
+ALERT_SQL = """
+INSERT INTO public.alerts (timestamp, device, detector, key, value, score, message)
+VALUES %s
+"""
+ALERT_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s)"
+
+# One row per (device, sensor) with its newest reading, upserted in the same
+# transaction as the history rows so the dashboard can read current state
+# with a primary-key lookup. Older rows (spool replay) never overwrite newer.
+LATEST_SQL = """
+INSERT INTO public.sensor_latest (device, sensor, timestamp, value, label)
+VALUES %s
+ON CONFLICT (device, sensor) DO UPDATE
+SET timestamp = EXCLUDED.timestamp, value = EXCLUDED.value, label = EXCLUDED.label
+WHERE sensor_latest.timestamp <= EXCLUDED.timestamp
+"""
+LATEST_TEMPLATE = "(%s, %s, %s, %s, %s)"
+
+# Sent in the history transaction, so listeners (the dashboard) only hear
+# about rows once they are committed. Payload: [[device, sensor], ...].
+NOTIFY_CHANGES = True
+NOTIFY_CHANNEL = "sensor_changes"
+NOTIFY_SQL = "SELECT pg_notify(%s, %s)"
+
+# ----------------------------
+# Prepared statements: parsed and planned once per connection, then run
+# with one array per column so a whole batch is a single EXECUTE.
+# ----------------------------
+PREPARED_STATEMENTS = True
+
+PREPARE_HISTORY_SQL = """
+PREPARE bridge_access (timestamptz[], text[], text[], boolean[], text[], bigint[], bigint[]) AS
+INSERT INTO public.rfid_checkin (timestamp, tag_id, user_name, access_granted, device, boot_id, seq)
+SELECT * FROM unnest($1, $2, $3, $4, $5, $6, $7)
+ON CONFLICT DO NOTHING;
+
+PREPARE bridge_ldr (timestamptz[], text[], integer[], double precision[], text[], text[], bigint[], bigint[]) AS
+INSERT INTO public.ldr_readings (timestamp, card_id, ldr_raw, ldr_voltage, light_level, device, boot_id, seq)
+SELECT * FROM unnest($1, $2, $3, $4, $5, $6, $7, $8)
+ON CONFLICT DO NOTHING
+RETURNING device, timestamp, ldr_raw;
+
+PREPARE bridge_latest (text[], text[], timestamptz[], double precision[], text[]) AS
+INSERT INTO public.sensor_latest (device, sensor, timestamp, value, label)
+SELECT * FROM unnest($1, $2, $3, $4, $5)
+ON CONFLICT (device, sensor) DO UPDATE
+SET timestamp = EXCLUDED.timestamp, value = EXCLUDED.value, label = EXCLUDED.label
+WHERE sensor_latest.timestamp <= EXCLUDED.timestamp;
+"""
+
+PREPARE_USER_SQL = """
+PREPARE bridge_user (text[], text[]) AS
+INSERT INTO public.users (tag_id, user_name)
+SELECT * FROM unnest($1, $2)
+ON CONFLICT (tag_id) DO UPDATE SET user_name = EXCLUDED.user_name;
+"""
+# Every array is cast to its parameter type: how a Python list is sent
+# depends on its values (all None, empty), and e.g. ARRAY[NULL, NULL] is
+# text[], which the server won't coerce to bigint[].
+EXECUTE_ACCESS = ("EXECUTE bridge_access (%s::timestamptz[], %s::text[], %s::text[], %s::boolean[], %s::text[], "
+                  "%s::bigint[], %s::bigint[])")
+EXECUTE_LDR = ("EXECUTE bridge_ldr (%s::timestamptz[], %s::text[], %s::integer[], %s::double precision[], "
+               "%s::text[], %s::text[], %s::bigint[], %s::bigint[])")
+EXECUTE_USER = "EXECUTE bridge_user (%s::text[], %s::text[])"
+EXECUTE_LATEST = ("EXECUTE bridge_latest (%s::text[], %s::text[], %s::timestamptz[], %s::double precision[], "
+                  "%s::text[])")
+
+# Flush when this many rows are pending, or when the oldest pending row
+# is older than BATCH_MAX_AGE seconds (whichever comes first).
+BATCH_MAX_ROWS = 500
+BATCH_MAX_AGE = 0.2
+
+KINDS = ("access", "ldr", "user", "alert")
+
+FlushStats = namedtuple("FlushStats", ["rows", "total", "latency_ms"])
+
+
+# ----------------------------
+# Row builders (parsed dict -> typed SQL parameters)
+# All parsing and validation happens here, on the Pi, in one step; a bad
+# value raises ValueError/TypeError and the event is skipped.
+# ----------------------------
+def parse_timestamp(value):
+    """
+    "2025-10-27 10:30:45" (Pico) or "2025-10-27T10:30:45Z" -> aware UTC datetime.
+    Naive timestamps are taken as UTC.
+    """
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
+
+def _optional_int(value):
+    return None if value is None else int(value)
+
+def access_row(data):
+    return (
+        parse_timestamp(data["timestamp"]),
+        data.get("tag_id"),
+        data.get("user_name"),
+        bool(data.get("access_granted")),
+        data.get("device"),
+        _optional_int(data.get("boot")),
+        _optional_int(data.get("seq")),
+    )
+
+def ldr_row(data):
+    raw = int(data.get("ldr_raw"))
+    if not 0 <= raw <= 65535:
+        raise ValueError(f"ldr_raw out of range: {raw}")
+    return (
+        parse_timestamp(data["timestamp"]),
+        data.get("card_id"),
+        raw,
+        float(data.get("ldr_voltage")),
+        data.get("light_level"),
+        data.get("device"),
+        _optional_int(data.get("boot")),
+        _optional_int(data.get("seq")),
+    )
+
+def user_row(data):
+    # The Pico sends USER_UPDATE with card_id; older captures used tag_id
+    tag = data.get("card_id") or data.get("tag_id")
+    if not tag:
+        raise ValueError("user update without card_id")
+    return (
+        tag,
+        data.get("user_name"),
+        data.get("action") == "deregister",
+    )
+
+def alert_row(data):
+    return (
+        parse_timestamp(data["timestamp"]),
+        data.get("device"),
+        data["detector"],
+        data.get("key"),
+        None if data.get("value") is None else float(data["value"]),
+        None if data.get("score") is None else float(data["score"]),
+        data.get("message"),
+    )
+
+ROW_BUILDERS = {"access": access_row, "ldr": ldr_row, "user": user_row, "alert": alert_row}
+
+
+def latest_rows(access, ldr):
+    """
+    Newest reading per (device, sensor) in a batch, as sensor_latest rows.
+    """
+    latest = {}
+    for row in access:
+        key = (row[4] or "", "rfid")
+        if key not in latest or row[0] >= latest[key][2]:
+            latest[key] = key + (row[0], 1.0 if row[3] else 0.0, row[1])
+    for row in ldr:
+        key = (row[5] or "", "ldr")
+        if key not in latest or row[0] >= latest[key][2]:
+            latest[key] = key + (row[0], float(row[2]), row[4])
+    return list(latest.values())
+
+
+def columns(rows):
+    """
+    Row tuples -> one list per column, for the unnest() prepared statements.
+    """
+    return [list(col) for col in zip(*rows)]
+
+
+def log_flush(stats):
+    if log.isEnabledFor(logging.DEBUG):
+        parts = ", ".join(f"{k}={n}" for k, n in stats.rows.items() if n)
+        log.debug("Flushed %d rows (%s) in %.1f ms", stats.total, parts, stats.latency_ms)
+
+
+class BatchWriter:
+    """
+    Buffers parsed serial events per kind and writes them as multi-row
+    INSERTs, one transaction per flush. Rows stay pending until their
+    flush commits, so a failed flush is retried on the next connection.
+
+    rollup: optional functions.rollups.Rollup; every LDR row a flush
+    inserts is added to it once committed (duplicates skipped by ON
+    CONFLICT and dropped bad rows are not), and its closed buckets are
+    written after the history rows.
+    """
+
+    def __init__(self, conn, max_rows=BATCH_MAX_ROWS, max_age=BATCH_MAX_AGE, on_flush=log_flush,
+                 prepared=PREPARED_STATEMENTS, rollup=None, notify=NOTIFY_CHANGES):
+        self.conn = conn
+        self.rollup = rollup
+        self.notify = notify
+        self.prepared = prepared
+        self._prepared_on = None
+        self._user_prepared = False
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.on_flush = on_flush
+        self.pending = {kind: [] for kind in KINDS}
+        self.oldest = None
+
+    @property
+    def count(self):
+        return sum(len(rows) for rows in self.pending.values())
+
+    def add(self, kind, data, autoflush=True):
+        """
+        Queues one event. Returns False if the payload could not be
+        converted to a row (the event is dropped). autoflush=False leaves
+        flushing at max_rows to the caller (spool replay).
+        """
+        try:
+            row = ROW_BUILDERS[kind](data)
+        except (KeyError, TypeError, ValueError) as e:
+            PARSE_FAILURES.inc(kind)
+            log.warning("Skipping bad %s event: %s", kind, e)
+            return False
+
+        self.pending[kind].append(row)
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+
+        if autoflush and self.count >= self.max_rows:
+            self.flush()
+        return True
+
+    def discard(self):
+        """
+        Drops everything pending, e.g. rows the database refused; returns
+        them as {kind: rows}.
+        """
+        dropped = {kind: rows for kind, rows in self.pending.items() if rows}
+        self.pending = {kind: [] for kind in KINDS}
+        self.oldest = None
+        return dropped
+
+    def due(self):
+        if self.rollup is not None and self.rollup.due():
+            return True
+        return self.oldest is not None and time.monotonic() - self.oldest >= self.max_age
+
+    def flush(self, final=False):
+        """
+        Writes everything pending. final=True (at shutdown) also writes the
+        rollup buckets that are still open.
+        """
+        if not self.count:
+            self._flush_rollups(final)
+            return None
+
+        start = time.monotonic()
+        rows = {kind: len(pending) for kind, pending in self.pending.items()}
+        total = sum(rows.values())
+        access, ldr = self.pending["access"], self.pending["ldr"]
+
+        if access or ldr:
+            try:
+                self._write_history(access, ldr)
+            except psycopg2.DataError as e:
+                # One bad value fails the whole statement; retry row by row
+                # so the rest of the batch isn't retried forever.
+                log.warning("Bad row in batch, retrying row by row: %s", e)
+                for row in access:
+                    self._write_row(row, None)
+                for row in ldr:
+                    self._write_row(None, row)
+            self.pending["access"], self.pending["ldr"] = [], []
+
+        if self.pending["user"]:
+            self._flush_users(self.pending["user"])
+            self.pending["user"] = []
+
+        if self.pending["alert"]:
+            self._flush_alerts(self.pending["alert"])
+            self.pending["alert"] = []
+
+        seconds = time.monotonic() - start
+        stats = FlushStats(rows=rows, total=total, latency_ms=seconds * 1000)
+        self.oldest = None
+        INSERT_LATENCY.observe(seconds)
+        BATCH_ROWS.observe(total)
+        self._flush_rollups(final)
+
+        if self.on_flush:
+            self.on_flush(stats)
+        return stats
+
+    def _prepare(self):
+        # Prepared statements live on the server session, so a new
+        # connection (after a reconnect) needs them again.
+        if self._prepared_on is not self.conn:
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    cur.execute(PREPARE_HISTORY_SQL)
+            self._prepared_on = self.conn
+            self._user_prepared = False
+            try:
+                with self.conn:
+                    with self.conn.cursor() as cur:
+                        cur.execute(PREPARE_USER_SQL)
+                self._user_prepared = True
+            except psycopg2.ProgrammingError as e:
+                # Usually the missing UNIQUE on users.tag_id; the plain
+                # upsert below reports it.
+                log.warning("Could not prepare user upsert: %s", e)
+
+    def _write_history(self, access, ldr):
+        if self.prepared:
+            self._prepare()
+        inserted = []
+        fetch = self.rollup is not None
+        with self.conn:
+            with self.conn.cursor() as cur:
+                latest = latest_rows(access, ldr)
+                if self.prepared:
+                    if access:
+                        cur.execute(EXECUTE_ACCESS, columns(access))
+                    if ldr:
+                        cur.execute(EXECUTE_LDR, columns(ldr))
+                        if fetch:
+                            inserted = cur.fetchall()
+                    cur.execute(EXECUTE_LATEST, columns(latest))
+                else:
+                    if access:
+                        execute_values(cur, ACCESS_SQL, access, template=ACCESS_TEMPLATE, page_size=len(access))
+                    if ldr:
+                        inserted = execute_values(cur, LDR_SQL, ldr, template=LDR_TEMPLATE, page_size=len(ldr),
+                                                  fetch=fetch)
+                    execute_values(cur, LATEST_SQL, latest, template=LATEST_TEMPLATE)
+                if self.notify:
+                    changed = [[row[0], row[1]] for row in latest]
+                    cur.execute(NOTIFY_SQL, (NOTIFY_CHANNEL, json.dumps(changed)))
+        # Committed: only now do the new rows count towards the rollups
+        if fetch:
+            for device, ts, raw in inserted:
+                self.rollup.add(device, ts, raw)
+
+    def _write_row(self, access, ldr):
+        try:
+            self._write_history([access] if access else [], [ldr] if ldr else [])
+        except psycopg2.DataError as e:
+            log.warning("Dropping bad row: %s %s", access or ldr, e)
+
+    def _flush_rollups(self, final=False):
+        # Own transaction after the history: a failure puts the buckets back
+        # without the history rows being written twice.
+        if self.rollup is None or not (final or self.rollup.due()):
+            return
+        drained = self.rollup.drain(everything=final)
+        if not drained:
+            return
+        try:
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    self.rollup.write(cur, drained)
+        except Exception:
+            self.rollup.restore(drained)
+            raise
+
+    def _flush_alerts(self, alerts):
+        with self.conn:
+            with self.conn.cursor() as cur:
+                execute_values(cur, ALERT_SQL, alerts, template=ALERT_TEMPLATE)
+
+    def _flush_users(self, users):
+        # ON CONFLICT can't touch the same tag twice in one statement,
+        # so keep only the last update per tag: a register or a deregister.
+        latest = dict((row[0], row) for row in users).values()
+        registered = [row[:2] for row in latest if not row[2]]
+        deregistered = [row[0] for row in latest if row[2]]
+        try:
+            if self.prepared:
+                self._prepare()
+            with self.conn:
+                with self.conn.cursor() as cur:
+                    if deregistered:
+                        cur.execute(USER_DELETE_SQL, (deregistered,))
+                    if registered and self.prepared and self._user_prepared:
+                        cur.execute(EXECUTE_USER, columns(registered))
+                    elif registered:
+                        execute_values(cur, USER_UPSERT_SQL, registered, template=USER_TEMPLATE)
+        except (psycopg2.ProgrammingError, psycopg2.IntegrityError) as e:
+            log.error("USER upsert error: %s", e)
+            log.error("Tip: run `python functions/migrations.py` to add the unique key on users.tag_id.")
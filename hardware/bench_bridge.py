@@ -0,0 +1,222 @@
+"""
+Ingestion benchmark: runs the bridge's reader and writer threads against
+the Pico emulator and reports sustained throughput, end-to-end latency
+(emulator write -> DB commit) and loss.
+
+    python bench_bridge.py --rate 2000 --seconds 10
+    python bench_bridge.py --rate 2000 --malformed 0.01 --disconnect-every 3
+    python bench_bridge.py --pg        # local PostgreSQL using the PG_* settings in bridge.py
+
+Without --pg the rows go to a throwaway SQLite file with the same tables.
+If the reader or a writer thread dies, the run is reported as FAILED
+(exit status 1) instead of counting what it missed as lost.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import bridge
+from batching import BatchWriter, latest_rows
+from emulator import PicoEmulator
+from functions.rollups import Rollup
+from pipeline import EventQueue
+from spool import Spool
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rfid_checkin (
+    timestamp text, tag_id text, user_name text, access_granted boolean,
+    device text, boot_id integer, seq integer
+);
+CREATE UNIQUE INDEX IF NOT EXISTS rfid_checkin_event_key ON rfid_checkin (device, boot_id, seq);
+CREATE TABLE IF NOT EXISTS ldr_readings (
+    timestamp text, card_id text, ldr_raw integer, ldr_voltage real, light_level text,
+    device text, boot_id integer, seq integer
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ldr_readings_event_key ON ldr_readings (device, boot_id, seq);
+CREATE TABLE IF NOT EXISTS users (tag_id text PRIMARY KEY, user_name text);
+CREATE TABLE IF NOT EXISTS sensor_latest (
+    device text, sensor text, timestamp text, value real, label text, PRIMARY KEY (device, sensor)
+);
+CREATE TABLE IF NOT EXISTS alerts (
+    timestamp text, device text, detector text, key text, value real, score real, message text
+);
+"""
+
+
+class SqliteBatchWriter(BatchWriter):
+    """
+    BatchWriter with its SQL calls swapped for SQLite equivalents.
+    """
+
+    def _write_history(self, access, ldr):
+        with self.conn:
+            if access:
+                self.conn.executemany("INSERT OR IGNORE INTO rfid_checkin VALUES (?, ?, ?, ?, ?, ?, ?)", iso_rows(access))
+            if ldr:
+                self.conn.executemany("INSERT OR IGNORE INTO ldr_readings VALUES (?, ?, ?, ?, ?, ?, ?, ?)", iso_rows(ldr))
+            latest = [row[:2] + (row[2].isoformat(),) + row[3:] for row in latest_rows(access, ldr)]
+            self.conn.executemany(
+                "INSERT INTO sensor_latest VALUES (?, ?, ?, ?, ?) ON CONFLICT (device, sensor) DO UPDATE "
+                "SET timestamp = excluded.timestamp, value = excluded.value, label = excluded.label "
+                "WHERE sensor_latest.timestamp <= excluded.timestamp", latest)
+
+    def _flush_alerts(self, alerts):
+        with self.conn:
+            self.conn.executemany("INSERT INTO alerts VALUES (?, ?, ?, ?, ?, ?, ?)", iso_rows(alerts))
+
+    def _flush_users(self, users):
+        latest = dict((row[0], row) for row in users).values()
+        with self.conn:
+            self.conn.executemany("DELETE FROM users WHERE tag_id = ?", [row[:1] for row in latest if row[2]])
+            self.conn.executemany("INSERT OR REPLACE INTO users VALUES (?, ?)", [row[:2] for row in latest if not row[2]])
+
+
+def iso_rows(rows):
+    return [(row[0].isoformat(),) + row[1:] for row in rows]
+
+
+def sqlite_connect(path):
+    def connect():
+        conn = sqlite3.connect(path)
+        conn.executescript(SQLITE_SCHEMA)
+        return conn
+    return connect
+
+
+def timed(writer_cls, committed, prepared=True, rollups=False):
+    """
+    Subclass of writer_cls that records when each (boot, seq) was committed.
+    """
+    class TimedWriter(writer_cls):
+        def flush(self, final=False):
+            keys = [(row[-2], row[-1]) for kind in ("access", "ldr") for row in self.pending[kind]]
+            stats = super().flush(final)
+            now = time.time()
+            for key in keys:
+                committed.setdefault(key, now)
+            return stats
+
+    return lambda conn: TimedWriter(conn, on_flush=None, prepared=prepared, rollup=Rollup() if rollups else None)
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    i = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[i]
+
+
+def run(rate, seconds, malformed=0.0, disconnect_every=None, binary=False, pg=False, writers=1, prepared=True):
+    workdir = tempfile.mkdtemp(prefix="bench_bridge_")
+    try:
+        link = os.path.join(workdir, "ttyPICO")
+        emu = PicoEmulator(link, rate, malformed=malformed, disconnect_every=disconnect_every, binary=binary).plug()
+
+        committed = {}
+        if pg:
+            connect, make_writer = bridge.try_connect_db, timed(BatchWriter, committed, prepared, bridge.ROLLUPS)
+        else:
+            connect, make_writer = sqlite_connect(os.path.join(workdir, "bench.db")), timed(SqliteBatchWriter, committed)
+
+        queue = EventQueue(bridge.QUEUE_SIZE, "block")
+        spool = Spool(os.path.join(workdir, "spool"))
+        stop = threading.Event()
+        threads = [threading.Thread(target=bridge.read_serial, args=(queue, stop, link, bridge.make_detectors()),
+                                    name="reader", daemon=True)]
+        threads += [threading.Thread(target=bridge.write_db, args=(queue, spool, stop, connect, make_writer),
+                                     name=f"writer-{i}", daemon=True)
+                    for i in range(writers)]
+        for t in threads:
+            t.start()
+
+        # Let the reader open the port (open_serial settles for 0.2 s) before sending
+        time.sleep(0.5)
+        start = time.time()
+        emu.start()
+        time.sleep(seconds)
+        emu.stop()
+        sent_at_stop = time.time()
+
+        # Drain: wait until nothing new has been committed for a second
+        last = -1
+        while len(committed) != last:
+            last = len(committed)
+            time.sleep(1.0)
+        # A thread that died stops the counts early; that's a failure, not loss
+        dead = [t.name for t in threads if not t.is_alive()]
+        stop.set()
+        for t in threads[1:]:
+            t.join(timeout=5)
+
+        latencies = sorted((committed[k] - emu.sent[k]) * 1000 for k in committed if k in emu.sent)
+        stored = len(latencies)
+        sent = len(emu.sent)
+        duration = max(committed.values()) - start if committed else 0.0
+        return {
+            "rate_target": rate,
+            "seconds": seconds,
+            "format": "binary" if binary else "text",
+            "database": "postgres" if pg else "sqlite",
+            "prepared": pg and prepared,
+            "sent": sent,
+            "send_rate": sent / (sent_at_stop - start),
+            "stored": stored,
+            "lost": sent - stored,
+            "loss_pct": 100.0 * (sent - stored) / sent if sent else 0.0,
+            "throughput": stored / duration if duration else 0.0,
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else float("nan"),
+            },
+            "malformed_sent": emu.malformed,
+            "user_updates_sent": emu.user_updates,
+            "disconnects": emu.disconnects,
+            "queue": queue.stats(),
+            "dead_threads": dead,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bridge ingestion against an emulated Pico")
+    parser.add_argument("--rate", type=float, default=1000, help="target events per second")
+    parser.add_argument("--seconds", type=float, default=10, help="how long the emulator sends")
+    parser.add_argument("--malformed", type=float, default=0.0, help="share of junk lines (0-1)")
+    parser.add_argument("--disconnect-every", type=float, default=None, help="seconds between disconnects")
+    parser.add_argument("--binary", action="store_true", help="binary frames instead of text lines")
+    parser.add_argument("--writers", type=int, default=1, help="DB writer threads")
+    parser.add_argument("--pg", action="store_true", help="use PostgreSQL (bridge.py PG_* settings)")
+    parser.add_argument("--plain", action="store_true", help="with --pg: execute_values instead of prepared statements")
+    parser.add_argument("--json", help="also write the result to this file")
+    args = parser.parse_args()
+
+    result = run(args.rate, args.seconds, args.malformed, args.disconnect_every, args.binary, args.pg, args.writers,
+                 not args.plain)
+
+    lat = result["latency_ms"]
+    print(f"sent {result['sent']} events at {result['send_rate']:.0f}/s ({result['format']}, {result['database']})")
+    if result["dead_threads"]:
+        print(f"FAILED: {', '.join(result['dead_threads'])} thread died, stored {result['stored']} "
+              f"(the rest is not loss)")
+    else:
+        print(f"stored {result['stored']}, lost {result['lost']} ({result['loss_pct']:.2f}%)")
+    print(f"throughput {result['throughput']:.0f} events/s")
+    print(f"latency p50 {lat['p50']:.1f} ms, p95 {lat['p95']:.1f} ms, p99 {lat['p99']:.1f} ms, max {lat['max']:.1f} ms")
+    print(f"malformed {result['malformed_sent']}, disconnects {result['disconnects']}, queue {result['queue']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if result["dead_threads"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Per-event cost of the streaming detectors (detectors.py).
+
+Feeds a synthetic mix of LDR readings and access scans through the same
+DetectorStage the bridge uses and prints the cost per event after 10^3 ..
+10^N events, for a few different numbers of devices/tags. With O(1) state
+per key the columns stay flat however many events have been seen.
+
+    python bench_detectors.py --events 1000000 --keys 1,100,10000
+"""
+import argparse
+import logging
+import random
+import time
+
+import bridge
+
+CHUNK = 10000
+
+
+def make_chunk(start, n, keys, rng):
+    """
+    n events, 100 per second from `start`: 3/4 LDR readings (noise plus the
+    odd jump), 1/4 access scans of which half are denied.
+    """
+    events = []
+    for i in range(n):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start + i * 0.01))
+        key = rng.randrange(keys)
+        if i % 4:
+            raw = rng.gauss(20000, 300) + (30000 if rng.random() < 0.001 else 0)
+            events.append(("ldr", {"timestamp": stamp, "ldr_raw": int(raw), "device": f"pico{key}"}))
+        else:
+            events.append(("access", {"timestamp": stamp, "tag_id": f"tag{key}", "access_granted": rng.random() < 0.5,
+                                      "device": "pico0"}))
+    return events
+
+
+def run(total, keys, seed=1):
+    """
+    Returns ([(events seen, ns per event over the last chunk)], alerts, tracked keys).
+    """
+    rng = random.Random(seed)
+    stage = bridge.make_detectors()
+    checkpoints = []
+    next_mark = 1000
+    seen = 0
+    alerts = 0
+    start = time.time() - total * 0.01
+
+    while seen < total:
+        n = min(CHUNK, total - seen, next_mark - seen)
+        events = make_chunk(start + seen * 0.01, n, keys, rng)
+        t = time.perf_counter()
+        for kind, data in events:
+            alerts += len(stage.observe(kind, data))
+        elapsed = time.perf_counter() - t
+        seen += n
+        if seen >= next_mark:
+            checkpoints.append((seen, elapsed / n * 1e9))
+            next_mark *= 10
+
+    tracked = sum(len(d.state) for d in stage.detectors)
+    return checkpoints, alerts, tracked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-event cost of the streaming detectors")
+    parser.add_argument("--events", type=int, default=1000000, help="events per run")
+    parser.add_argument("--keys", default="1,100,10000", help="comma-separated numbers of devices/tags")
+    args = parser.parse_args()
+
+    logging.getLogger("detectors").setLevel(logging.ERROR)   # alerts are expected here
+    results = {}
+    for keys in [int(k) for k in args.keys.split(",")]:
+        results[keys] = run(args.events, keys)
+
+    print("ns/event after N events (columns: devices/tags)")
+    print(f"{'N':>10} " + " ".join(f"{keys:>10}" for keys in results))
+    rows = max(len(r[0]) for r in results.values())
+    for i in range(rows):
+        seen = next(r[0][i][0] for r in results.values() if i < len(r[0]))
+        cells = [f"{r[0][i][1]:10.0f}" if i < len(r[0]) else " " * 10 for r in results.values()]
+        print(f"{seen:>10} " + " ".join(cells))
+    for keys, (_, alerts, tracked) in results.items():
+        print(f"{keys} keys: {alerts} alerts, {tracked} keys tracked")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,32 @@
 import json
+import logging
+import os
+import sys
+import termios
 import time
+import threading
 import serial
 import psycopg2
 from serial.serialutil import SerialException
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from functions.connection import Backoff, ConnectionManager
+from functions.migrations import try_migrate
+from functions.partitions import try_maintain
+from functions.rollups import Rollup
+
+from batching import BatchWriter
+from dedupe import DedupeFilter
+from detectors import DeniedBurstDetector, DetectorStage, LightJumpDetector
+from framing import StreamDecoder
+from logsetup import setup_logging
+from metrics import LAST_EVENT_AGE, LINES_READ, PARSE_FAILURES, QUEUE_DEPTH, RECONNECTS, serve, write_textfile
+from pipeline import Event, EventQueue
+from spool import Spool
+from users import UserDirectory
+
+log = logging.getLogger("bridge")
+
 # ----------------------------
 # Serial (Pico -> Pi)
 # ----------------------------
@@ -23,147 +46,436 @@ PG_PASS = "V(eGroen267$"
 PG_SSLMODE = "disable"   # tunnel already encrypts traffic
 
 # ----------------------------
-# SQL 
+# Reader -> writer queue
+# QUEUE_POLICY: "block", "drop_oldest" or "spill" (to QUEUE_SPILL_PATH)
+# ----------------------------
+QUEUE_SIZE = 10000
+QUEUE_POLICY = "spill"
+QUEUE_SPILL_PATH = "bridge_spill.jsonl"
+DB_WRITERS = 1
+STATS_INTERVAL = 60
+
+# ----------------------------
+# Spool: events land here while the DB is unreachable
+# Batches the DB refuses for another reason (constraint, type or SQL
+# error) are appended to DEAD_LETTER_PATH instead of being retried.
 # ----------------------------
-ACCESS_SQL = """
-INSERT INTO public.rfid_checkin (timestamp, tag_id, user_name, access_granted)
-VALUES ((%s::timestamp AT TIME ZONE 'UTC'), %s, %s, %s)
-"""
+SPOOL_DIR = "spool"
+DEAD_LETTER_PATH = "bridge_dead_letter.jsonl"
 
-LDR_SQL = """
-INSERT INTO public.ldr_readings (timestamp, card_id, ldr_raw, ldr_voltage, light_level)
-VALUES ((%s::timestamp AT TIME ZONE 'UTC'), %s, %s, %s, %s)
-"""
+# ----------------------------
+# Reconnecting: jittered exponential backoff between attempts (seconds),
+# and an idle connection is pinged every DB_PING_INTERVAL
+# ----------------------------
+DB_BACKOFF_BASE = 0.5
+DB_BACKOFF_MAX = 30
+DB_PING_INTERVAL = 10
+SERIAL_BACKOFF_MAX = 5
 
-USER_UPSERT_SQL = """
-INSERT INTO public.users (tag_id, user_name)
-VALUES (%s, %s)
-ON CONFLICT (tag_id) DO UPDATE SET user_name = EXCLUDED.user_name
-"""
+# ----------------------------
+# Logging and metrics
+# LOG_LEVEL "DEBUG" also logs every flushed batch. The same message is
+# logged at most LOG_BURST times per LOG_INTERVAL seconds.
+# METRICS_PORT serves /metrics (None to disable); METRICS_TEXTFILE is
+# rewritten every STATS_INTERVAL for node_exporter's textfile collector.
+# ----------------------------
+LOG_LEVEL = "INFO"
+LOG_INTERVAL = 10
+LOG_BURST = 5
+METRICS_PORT = 9108
+METRICS_TEXTFILE = None
 
-def open_serial():
-    while True:
+# ----------------------------
+# Partitions of rfid_checkin / ldr_readings (see functions/partitions.py)
+# PARTITION_INTERVAL: "day", "week", "month" or "year". Partitions are
+# created PARTITIONS_AHEAD intervals in advance; ones that ended more than
+# PARTITION_RETENTION intervals ago are detached (None keeps everything),
+# or dropped with PARTITION_DROP.
+# ----------------------------
+PARTITION_INTERVAL = "month"
+PARTITIONS_AHEAD = 3
+PARTITION_RETENTION = None
+PARTITION_DROP = False
+PARTITION_CHECK_INTERVAL = 6 * 3600
+
+# ----------------------------
+# Minute/hour/day rollups of the LDR readings (see functions/rollups.py);
+# the dashboard's light history reads these instead of ldr_readings.
+# ----------------------------
+ROLLUPS = True
+
+# ----------------------------
+# Streaming detectors, run on every event in the reader (see detectors.py).
+# Alerts go to the alerts table and bridge_alerts_total. DETECTORS = False
+# turns them off; make_detectors() is the place to add your own.
+# ----------------------------
+DETECTORS = True
+LDR_ALPHA = 0.05          # EWMA weight of a new reading
+LDR_ZSCORE = 4.0          # alert when this many sd away from the mean
+DENIED_WINDOW = 60        # seconds
+DENIED_LIMIT = 5          # denied scans of one tag within DENIED_WINDOW
+
+# In-memory copy of public.users (see users.py), compared with the table
+# by checksum every USER_RECONCILE_INTERVAL seconds
+USER_RECONCILE_INTERVAL = 60
+
+# A port that is re-enumerating fails with any of these, not only
+# SerialException (e.g. termios.error EIO from reset_input_buffer)
+SERIAL_ERRORS = (SerialException, OSError, termios.error)
+
+def close_serial(ser):
+    if ser is None:
+        return
+    try:
+        ser.close()
+    except Exception:
+        pass
+
+def open_serial(port=SERIAL_PORT, stop=None):
+    """
+    Opens the port, retrying with backoff until it works. Returns None if
+    `stop` is set while waiting.
+    """
+    backoff = Backoff(0.25, SERIAL_BACKOFF_MAX)
+    while stop is None or not stop.is_set():
+        ser = None
         try:
-            ser = serial.Serial(SERIAL_PORT, BAUD, timeout=1)
-            ser.dtr = False
-            ser.rts = False
+            ser = serial.Serial(port, BAUD, timeout=1)
+            try:
+                ser.dtr = False
+                ser.rts = False
+            except OSError:
+                pass  # no modem lines (e.g. the emulator's pty)
             time.sleep(0.2)
             ser.reset_input_buffer()
-            print("Serial connected:", SERIAL_PORT)
+            log.info("Serial connected: %s", port)
             return ser
-        except SerialException as e:
-            print("Waiting for Pico...", e)
-            time.sleep(1)
+        except SERIAL_ERRORS as e:
+            log.warning("Waiting for Pico... %s", e)
+            close_serial(ser)   # half-opened
+            delay = backoff.next_delay()
+            if stop is None:
+                time.sleep(delay)
+            else:
+                stop.wait(delay)
+    return None
 
-def connect_db():
-    while True:
-        try:
-            conn = psycopg2.connect(
-                host=PG_HOST,
-                port=PG_PORT,
-                dbname=PG_DB,
-                user=PG_USER,
-                password=PG_PASS,
-                sslmode=PG_SSLMODE,
-                connect_timeout=10
-            )
-            conn.autocommit = True
-            print("DB connected:", PG_DB, "as", PG_USER)
-            return conn
-        except Exception as e:
-            print("DB connect error:", e)
-            time.sleep(5)
+def try_connect_db():
+    """
+    Single connection attempt. Returns the connection or None.
+    """
+    try:
+        conn = psycopg2.connect(
+            host=PG_HOST,
+            port=PG_PORT,
+            dbname=PG_DB,
+            user=PG_USER,
+            password=PG_PASS,
+            sslmode=PG_SSLMODE,
+            connect_timeout=10
+        )
+        log.info("DB connected: %s as %s", PG_DB, PG_USER)
+        try_migrate(conn)
+        maintain_partitions(conn)
+        return conn
+    except Exception as e:
+        log.warning("DB connect error: %s", e)
+        return None
+
+def maintain_partitions(conn):
+    return try_maintain(conn, interval=PARTITION_INTERVAL, ahead=PARTITIONS_AHEAD,
+                        retention=PARTITION_RETENTION, drop=PARTITION_DROP)
+
+def check_partitions():
+    """
+    Periodic check on a short-lived connection (try_connect_db migrates and
+    maintains partitions).
+    """
+    conn = try_connect_db()
+    if conn is not None:
+        conn.close()
 
 def parse_line(line: str):
     """
     Returns: (kind, data_dict) or (None, None)
     kind in {"access", "ldr", "user"}
+    Raises ValueError for bad JSON or a payload that isn't a JSON object.
     """
-    if line.startswith("ACCESS_LOG:"):
-        payload = line.split("ACCESS_LOG:", 1)[1].strip()
-        return "access", json.loads(payload)
+    kind = line_kind(line)
+    if kind == "text":
+        return None, None
 
-    if line.startswith("LDR_LOG:"):
-        payload = line.split("LDR_LOG:", 1)[1].strip()
-        return "ldr", json.loads(payload)
+    data = json.loads(line.split(":", 1)[1].strip())
+    if not isinstance(data, dict):
+        raise ValueError(f"{kind} payload is not a JSON object: {data!r}")
+    return kind, data
 
-    if line.startswith("USER_UPDATE:"):
-        payload = line.split("USER_UPDATE:", 1)[1].strip()
-        return "user", json.loads(payload)
+def line_kind(line):
+    """
+    Event kind a text line claims to be, for counting parse failures.
+    """
+    for prefix, kind in (("ACCESS_LOG:", "access"), ("LDR_LOG:", "ldr"), ("USER_UPDATE:", "user")):
+        if line.startswith(prefix):
+            return kind
+    return "text"
 
-    return None, None
+def parse_chunk(decoder, chunk, port=SERIAL_PORT):
+    """
+    Feeds raw serial bytes to a StreamDecoder and yields (kind, data) for
+    every complete binary frame or recognised text line in them.
+    """
+    corrupt = decoder.corrupt
+    lines = 0
+    for kind, data in decoder.feed(chunk):
+        lines += 1
+        if kind is None:
+            try:
+                kind, data = parse_line(data)
+            except ValueError as e:
+                PARSE_FAILURES.inc(line_kind(data))
+                log.warning("Bad serial line: %s", e)
+                continue
+            if not kind:
+                continue
+        yield kind, data
 
-def main():
-    ser = open_serial()
-    conn = connect_db()
-    cur = conn.cursor()
+    if lines:
+        LINES_READ.inc(port, amount=lines)
+    if decoder.corrupt > corrupt:
+        PARSE_FAILURES.inc("frame", amount=decoder.corrupt - corrupt)
+        log.warning("Corrupt frames skipped: %d", decoder.corrupt - corrupt)
 
-    while True:
-        try:
-            raw = ser.readline()
-            if not raw:
-                continue
+def make_detectors():
+    if not DETECTORS:
+        return None
+    return DetectorStage([
+        LightJumpDetector(alpha=LDR_ALPHA, threshold=LDR_ZSCORE),
+        DeniedBurstDetector(window=DENIED_WINDOW, limit=DENIED_LIMIT),
+    ])
 
-            line = raw.decode(errors="replace").strip()
-            if not line:
-                continue
+def prepare_event(kind, data, port, dedupe=None, detectors=None, users=None):
+    """
+    Everything the reader does with one parsed event besides queueing it.
+    Returns the Events to queue: none for a duplicate, else the event and
+    the alerts it raised. Raises on a payload with bad values (e.g. a seq
+    that isn't a number); the caller skips it.
+    """
+    data.setdefault("device", port)
+    if dedupe is not None and not dedupe.accept(data):
+        return []
+    LAST_EVENT_AGE.touch(data["device"])
+    if users is not None:
+        if kind == "user":
+            users.apply(data)
+        elif kind == "access":
+            users.enrich(data)
+    events = [Event(kind, data, port, time.time())]
+    if detectors is not None:
+        events += [Event("alert", alert, port, time.time()) for alert in detectors.observe(kind, data)]
+    return events
 
-            kind, data = parse_line(line)
-            if not kind:
+def skip_event(kind, e):
+    PARSE_FAILURES.inc(kind)
+    log.warning("Skipping bad %s event: %s", kind, e)
+
+def read_serial(queue, stop, port=SERIAL_PORT, detectors=None, users=None):
+    """
+    Reader thread: only reads and decodes serial data, never touches the DB.
+    Alerts from `detectors` are queued behind the event that raised them;
+    `users` (a UserDirectory) follows USER_UPDATEs and fills in user_name.
+    """
+    ser = open_serial(port, stop)
+    decoder = StreamDecoder()
+    dedupe = DedupeFilter()
+
+    # Only `stop` ends this loop: the thread is a daemon, so dying here
+    # would leave the bridge running without reading anything.
+    while not stop.is_set():
+        try:
+            chunk = ser.read(ser.in_waiting or 1)
+            if not chunk:
                 continue
 
-            if kind == "access":
-                cur.execute(ACCESS_SQL, (
-                    data.get("timestamp"),
-                    data.get("tag_id"),
-                    data.get("user_name"),
-                    bool(data.get("access_granted")),
-                ))
-                print("Inserted ACCESS:", data.get("tag_id"))
-
-            elif kind == "ldr":
-                cur.execute(LDR_SQL, (
-                    data.get("timestamp"),
-                    data.get("card_id"),
-                    int(data.get("ldr_raw")),
-                    float(data.get("ldr_voltage")),
-                    data.get("light_level"),
-                ))
-                print("Inserted LDR:", data.get("card_id"))
-
-            elif kind == "user":
+            for kind, data in parse_chunk(decoder, chunk, port):
                 try:
-                    cur.execute(USER_UPSERT_SQL, (
-                        data.get("tag_id"),
-                        data.get("user_name"),
-                    ))
-                    print("Upserted USER:", data.get("tag_id"))
+                    events = prepare_event(kind, data, port, dedupe, detectors, users)
                 except Exception as e:
-                    print("USER upsert error:", e)
-                    print("Tip: add UNIQUE constraint on users.tag_id to enable ON CONFLICT.")
+                    # One odd payload must not stop the reader thread
+                    skip_event(kind, e)
+                    continue
+                for event in events:
+                    queue.put(event)
 
-        except SerialException as e:
-            print("Serial disconnected:", e)
-            try:
-                ser.close()
-            except:
-                pass
-            ser = open_serial()
+        except SERIAL_ERRORS as e:
+            log.warning("Serial disconnected: %s", e)
+            close_serial(ser)
+            ser = open_serial(port, stop)
+            decoder = StreamDecoder()
 
         except Exception as e:
-            print("Runtime/Insert error:", e)
-            # Reconnect DB on failure
-            try:
-                cur.close()
-            except:
-                pass
-            try:
-                conn.close()
-            except:
-                pass
-            conn = connect_db()
-            cur = conn.cursor()
-            time.sleep(1)
+            log.exception("Serial reader error, reading on: %s", e)
+            decoder = StreamDecoder()
+            stop.wait(1)   # don't spin if it keeps failing
+
+    close_serial(ser)
+
+# Only these mean the connection is gone; any other psycopg2 error is
+# about the statement and would fail the same way on a new connection.
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+def dead_letter(rows, error, path=DEAD_LETTER_PATH):
+    """
+    Appends rows the database refused ({kind: rows} from
+    BatchWriter.discard()) to a JSON-lines file, one line per row.
+    """
+    if not rows:
+        return
+    total = sum(len(r) for r in rows.values())
+    log.error("Batch refused by the database, %d rows moved to %s: %s", total, path, error)
+    try:
+        with open(path, "a") as f:
+            for kind, kind_rows in rows.items():
+                for row in kind_rows:
+                    f.write(json.dumps({"kind": kind, "row": row, "error": str(error)}, default=str) + "\n")
+    except OSError as e:
+        log.error("Could not write %s, rows lost: %s", path, e)
+
+def reconcile_users(users, conn):
+    """
+    users.reconcile() for the writers: a failure other than the connection
+    is logged and retried at the next interval.
+    """
+    try:
+        users.reconcile(conn)
+    except CONNECTION_ERRORS:
+        raise
+    except Exception as e:
+        log.error("User directory reconcile failed: %s", e)
+
+def connect_manager(connect=try_connect_db):
+    return ConnectionManager(connect, name="bridge-db", base_delay=DB_BACKOFF_BASE, max_delay=DB_BACKOFF_MAX,
+                             ping_interval=DB_PING_INTERVAL)
+
+def new_writer(conn):
+    return BatchWriter(conn, rollup=Rollup() if ROLLUPS else None)
+
+def write_db(queue, spool, stop, connect=try_connect_db, make_writer=new_writer, users=None):
+    """
+    Writer thread: drains the queue into a BatchWriter on its own connection.
+    While the DB is down, events go to the spool instead; after reconnecting
+    the spool is replayed before any new events are written. It also
+    (re)loads `users` when its checksum no longer matches the table.
+    connect/make_writer let the benchmark swap in another database.
+    """
+    db = connect_manager(connect)
+    writer = make_writer(db.try_get())
+
+    while True:
+        event = queue.get(timeout=writer.max_age)
+
+        if writer.conn is None:
+            if event is not None:
+                spool.append(event)
+            elif stop.is_set():
+                spool.close()
+                if writer.count:
+                    log.error("DB down at shutdown, unflushed rows lost: %d", writer.count)
+                return
+            # Returns None right away until the backoff allows the next attempt
+            writer.conn = db.try_get()
+            if writer.conn is not None:
+                RECONNECTS.inc()
+            continue
+
+        try:
+            if not spool.empty():
+                spool.replay(writer, retryable=CONNECTION_ERRORS)
+
+            if event is not None:
+                # From here on the row is the writer's (pending or set aside)
+                in_hand, event = event, None
+                writer.add(in_hand.kind, in_hand.data)
+            elif stop.is_set():
+                writer.flush(final=True)
+                return
+            elif writer.count == 0 and not db.ping():
+                # Idle and the liveness ping found the connection dead
+                writer.conn = None
+                continue
+
+            if users is not None and users.reconcile_due():
+                reconcile_users(users, writer.conn)
+
+            if writer.due():
+                writer.flush()
+                db.ok()
+
+        except CONNECTION_ERRORS as e:
+            log.warning("DB connection lost, spooling events: %s", e)
+            # Reconnect after the backoff; pending rows are kept and retried
+            db.failed(e)
+            writer.conn = None
+            if event is not None:
+                spool.append(event)   # the replay failed before it was added
+
+        except Exception as e:
+            # The batch itself can't be written. Retrying it would fail
+            # forever and hold up every event behind it, so set it aside
+            # and keep the connection.
+            dead_letter(writer.discard(), e)
+            if event is not None:
+                spool.append(event)   # not part of the refused batch; goes after the spool
+
+def start_metrics(depth):
+    QUEUE_DEPTH.set_function(depth)
+    if METRICS_PORT is not None:
+        try:
+            serve(METRICS_PORT)
+            log.info("Metrics on http://0.0.0.0:%d/metrics", METRICS_PORT)
+        except OSError as e:
+            log.warning("Metrics endpoint disabled: %s", e)
+
+def export_metrics():
+    if METRICS_TEXTFILE:
+        try:
+            write_textfile(METRICS_TEXTFILE)
+        except OSError as e:
+            log.warning("Could not write %s: %s", METRICS_TEXTFILE, e)
+
+def main():
+    listener = setup_logging(LOG_LEVEL, LOG_INTERVAL, LOG_BURST)
+    queue = EventQueue(QUEUE_SIZE, QUEUE_POLICY, QUEUE_SPILL_PATH)
+    spool = Spool(SPOOL_DIR)
+    stop = threading.Event()
+    start_metrics(queue.depth)
+
+    detectors = make_detectors()
+    users = UserDirectory(USER_RECONCILE_INTERVAL)
+
+    threads = [threading.Thread(target=read_serial, args=(queue, stop, SERIAL_PORT, detectors, users),
+                                name="serial-reader", daemon=True)]
+    for i in range(DB_WRITERS):
+        threads.append(threading.Thread(target=write_db, args=(queue, spool, stop, try_connect_db, new_writer, users),
+                                        name=f"db-writer-{i}", daemon=True))
+    for t in threads:
+        t.start()
+
+    try:
+        next_partition_check = time.monotonic() + PARTITION_CHECK_INTERVAL
+        while True:
+            time.sleep(STATS_INTERVAL)
+            if time.monotonic() >= next_partition_check:
+                check_partitions()
+                next_partition_check = time.monotonic() + PARTITION_CHECK_INTERVAL
+            log.info("Queue: %s", queue.stats())
+            export_metrics()
+    except KeyboardInterrupt:
+        log.info("Stopping, flushing queued events...")
+        stop.set()
+        for t in threads[1:]:
+            t.join(timeout=10)
+        export_metrics()
+        listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
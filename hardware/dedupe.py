@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+WINDOW = 4096        # remember this many recent seqs per device boot
+MAX_STREAMS = 256    # (device, boot) pairs kept, least recently used dropped
+
+
+class SeqWindow:
+    """
+    Sliding bitmap of the last `size` sequence numbers seen for one
+    (device, boot). check() is O(1) amortised: a slot is only cleared
+    once when the window moves past it.
+    """
+
+    def __init__(self, size=WINDOW):
+        self.size = size
+        self.slots = bytearray(size)
+        self.high = -1
+
+    def check(self, seq):
+        """
+        Returns True the first time `seq` is seen, False for a duplicate.
+        Seqs older than the window are let through (the DB's unique index
+        catches those).
+        """
+        if seq > self.high:
+            if seq - self.high >= self.size:
+                self.slots = bytearray(self.size)
+            else:
+                for s in range(self.high + 1, seq):
+                    self.slots[s % self.size] = 0
+            self.slots[seq % self.size] = 1
+            self.high = seq
+            return True
+
+        if self.high - seq >= self.size:
+            return True
+
+        i = seq % self.size
+        if self.slots[i]:
+            return False
+        self.slots[i] = 1
+        return True
+
+
+class DedupeFilter:
+    """
+    Drops events whose (device, boot, seq) was already seen recently.
+    Events without a seq (old firmware, hand-made logs) always pass.
+    """
+
+    def __init__(self, window=WINDOW, max_streams=MAX_STREAMS):
+        self.window = window
+        self.max_streams = max_streams
+        self.streams = OrderedDict()
+        self.duplicates = 0
+
+    def accept(self, data):
+        seq = data.get("seq")
+        if seq is None:
+            return True
+
+        key = (data.get("device"), data.get("boot"))
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = SeqWindow(self.window)
+            if len(self.streams) > self.max_streams:
+                self.streams.popitem(last=False)
+        else:
+            self.streams.move_to_end(key)
+
+        if stream.check(int(seq)):
+            return True
+        self.duplicates += 1
+        return False
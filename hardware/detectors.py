@@ -0,0 +1,164 @@
+"""
+Streaming anomaly detectors, run on every event as it comes off the serial
+port (no queries, no re-scanning tables).
+
+A detector is any object with observe(kind, data) returning a list of
+alert dicts (usually empty). The bridge wraps its detectors in a
+DetectorStage; alerts are queued as "alert" events so they reach the
+alerts table through the same batching and spool as everything else.
+
+Each detector keeps a fixed amount of state per device or tag, so the cost
+per event does not grow with the number of events seen (see
+bench_detectors.py).
+"""
+import logging
+import math
+from collections import OrderedDict
+
+from batching import parse_timestamp
+from metrics import ALERTS
+
+log = logging.getLogger("detectors")
+
+MAX_KEYS = 10000   # devices/tags tracked per detector, least recently seen dropped
+
+
+def alert(data, detector, key, value, score, message):
+    return {
+        "timestamp": data["timestamp"],
+        "device": data.get("device"),
+        "detector": detector,
+        "key": key,
+        "value": value,
+        "score": round(score, 3),
+        "message": message,
+    }
+
+
+class KeyedState:
+    """
+    OrderedDict capped at max_keys, least recently used dropped first.
+    """
+
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self.items = OrderedDict()
+
+    def get(self, key, new):
+        state = self.items.get(key)
+        if state is None:
+            state = self.items[key] = new()
+            if len(self.items) > self.max_keys:
+                self.items.popitem(last=False)
+        else:
+            self.items.move_to_end(key)
+        return state
+
+    def __len__(self):
+        return len(self.items)
+
+
+class LightJumpDetector:
+    """
+    EWMA mean and variance of ldr_raw per device; a reading more than
+    `threshold` standard deviations from the mean is an alert (lamp
+    failure, someone covering the sensor). min_std keeps a perfectly
+    steady room from alerting on ADC noise.
+    """
+    name = "ldr_zscore"
+
+    def __init__(self, alpha=0.05, threshold=4.0, warmup=30, min_std=500.0, cooldown=60, max_keys=MAX_KEYS):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.min_std = min_std
+        self.cooldown = cooldown
+        # device -> [mean, variance, count, last alert time]
+        self.state = KeyedState(max_keys)
+
+    def observe(self, kind, data):
+        if kind != "ldr":
+            return []
+        x = float(data["ldr_raw"])
+        state = self.state.get(data.get("device") or "", lambda: [x, 0.0, 0, None])
+        mean, var, n, last = state
+
+        diff = x - mean
+        z = diff / max(math.sqrt(var), self.min_std)
+        incr = self.alpha * diff
+        state[0] = mean + incr
+        state[1] = (1 - self.alpha) * (var + diff * incr)
+        state[2] = n + 1
+
+        if n < self.warmup or abs(z) < self.threshold:
+            return []
+        now = parse_timestamp(data["timestamp"]).timestamp()
+        if last is not None and now - last < self.cooldown:
+            return []
+        state[3] = now
+        return [alert(data, self.name, data.get("device") or "", x, z,
+                      f"ldr_raw {x:.0f} is {z:+.1f} sd from the recent mean {mean:.0f}")]
+
+
+class DeniedBurstDetector:
+    """
+    Denied scans per tag_id over a sliding `window` seconds, estimated from
+    the current and previous fixed window (two counters per tag instead of
+    a list of timestamps). `limit` or more is an alert.
+    """
+    name = "denied_burst"
+
+    def __init__(self, window=60, limit=5, cooldown=None, max_keys=MAX_KEYS):
+        self.window = window
+        self.limit = limit
+        self.cooldown = window if cooldown is None else cooldown
+        # tag_id -> [window start, count in it, count in the one before, last alert time]
+        self.state = KeyedState(max_keys)
+
+    def observe(self, kind, data):
+        if kind != "access" or data.get("access_granted"):
+            return []
+        now = parse_timestamp(data["timestamp"]).timestamp()
+        start = now - now % self.window
+        tag = data.get("tag_id") or "unknown"
+        state = self.state.get(tag, lambda: [start, 0, 0, None])
+
+        if start != state[0]:
+            # Moved on: the old current window is the previous one only if adjacent
+            state[2] = state[1] if start - state[0] == self.window else 0
+            state[1] = 0
+            state[0] = start
+        state[1] += 1
+
+        weight = 1 - (now - start) / self.window
+        count = state[1] + state[2] * weight
+        if count < self.limit:
+            return []
+        if state[3] is not None and now - state[3] < self.cooldown:
+            return []
+        state[3] = now
+        return [alert(data, self.name, tag, count, count / self.limit,
+                      f"{count:.0f} denied scans for {tag} in the last {self.window} s")]
+
+
+class DetectorStage:
+    """
+    Runs every detector on an event. A detector that chokes on a payload
+    only skips that event; the event itself still goes to the database.
+    """
+
+    def __init__(self, detectors):
+        self.detectors = list(detectors)
+
+    def observe(self, kind, data):
+        alerts = []
+        for detector in self.detectors:
+            try:
+                found = detector.observe(kind, data)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+            for a in found:
+                ALERTS.inc(a["detector"])
+                log.warning("Alert %s [%s]: %s", a["detector"], a["key"], a["message"])
+            alerts.extend(found)
+        return alerts
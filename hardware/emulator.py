@@ -0,0 +1,201 @@
+"""
+Pretends to be a Pico on a pseudo-terminal, for load testing the bridge.
+
+Writes ACCESS_LOG / LDR_LOG / USER_UPDATE lines (or binary frames) at a
+target rate, with an optional share of malformed lines and periodic
+disconnects. The port is exposed as a stable symlink that is re-pointed
+to a fresh pty on every reconnect, like a Pico re-enumerating.
+
+    python emulator.py /tmp/ttyPICO --rate 2000 --malformed 0.01
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import tty
+
+from framing import encode_frame
+
+DEFAULT_MIX = {"access": 0.3, "ldr": 0.6, "user": 0.1}
+TAGS = ["0C9B5023", "A1B2C3D4", "1234567890", "0987654321", "1122334455"]
+NAMES = ["John Doe", "Jane Smith", "Bob Johnson", "Unknown"]
+LEVELS = [(0.3, "Dark"), (1.0, "Dim"), (2.0, "Normal"), (3.0, "Bright")]
+PREFIXES = {"access": "ACCESS_LOG:", "ldr": "LDR_LOG:", "user": "USER_UPDATE:"}
+MALFORMED = [
+    'LDR_LOG: {"timestamp": "2025-10-27 10:30:45", "ldr_raw": ',
+    "ACCESS_LOG: not json at all",
+    "\x00\xff\xfe garbage",
+    "Card scanned: 0C9B5023",
+]
+
+
+def make_event(kind, seq, boot, device, rnd=random):
+    ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    tag = rnd.choice(TAGS)
+    ids = {"device": device, "boot": boot, "seq": seq}
+
+    if kind == "access":
+        name = rnd.choice(NAMES)
+        return dict(timestamp=ts, tag_id=tag, access_granted=name != "Unknown", user_name=name, **ids)
+    if kind == "ldr":
+        voltage, level = rnd.choice(LEVELS)
+        return dict(timestamp=ts, card_id=tag, ldr_raw=int(voltage / 3.3 * 65535),
+                    ldr_voltage=voltage, light_level=level, **ids)
+    return dict(action=rnd.choice(["register", "deregister"]), card_id=tag, user_name=rnd.choice(NAMES), **ids)
+
+
+class PicoEmulator:
+    """
+    Runs in a background thread. `sent` maps (boot, seq) to the time.time()
+    each access/ldr event was written (those are the rows the bridge
+    should end up storing); `user_updates` and `malformed` count the rest.
+    """
+
+    def __init__(self, link_path, rate=1000, mix=None, malformed=0.0, disconnect_every=None,
+                 binary=False, device="E661410403A7582F", seed=None):
+        self.link_path = link_path
+        self.rate = rate
+        self.mix = mix or DEFAULT_MIX
+        self.malformed_share = malformed
+        self.disconnect_every = disconnect_every
+        self.binary = binary
+        self.device = device
+        self.rnd = random.Random(seed)
+        self.boot = self.rnd.getrandbits(32)
+
+        self.sent = {}
+        self.user_updates = 0
+        self.malformed = 0
+        self.disconnects = 0
+        self.master = None
+        self.slave = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ----------------------------
+    # pty handling
+    # ----------------------------
+    def _plug(self):
+        master, slave = os.openpty()
+        tty.setraw(master)
+        # Non-blocking so stop() never hangs on a full pty buffer
+        os.set_blocking(master, False)
+        tmp = self.link_path + ".tmp"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(os.ttyname(slave), tmp)
+        os.replace(tmp, self.link_path)
+
+        old_master, old_slave = self.master, self.slave
+        self.master, self.slave = master, slave
+        for fd in (old_master, old_slave):
+            if fd is not None:
+                os.close(fd)
+
+    def plug(self):
+        """
+        Creates the port without sending anything yet, so a reader can
+        open it first.
+        """
+        if self.master is None:
+            self._plug()
+        return self
+
+    def start(self):
+        self.plug()
+        self._thread = threading.Thread(target=self._run, name="pico-emulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+        if os.path.lexists(self.link_path):
+            os.remove(self.link_path)
+
+    # ----------------------------
+    # Writer loop
+    # ----------------------------
+    def _line(self, seq):
+        if self.malformed_share and self.rnd.random() < self.malformed_share:
+            return self.rnd.choice(MALFORMED).encode("latin-1") + b"\r\n", "malformed"
+
+        kind = self.rnd.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        data = make_event(kind, seq, self.boot, self.device, self.rnd)
+        if self.binary:
+            fields = {k: v for k, v in data.items() if k not in ("device", "boot", "seq")}
+            return encode_frame(kind, fields, seq, self.boot, self.device), kind
+        return f"{PREFIXES[kind]} {json.dumps(data)}\r\n".encode(), kind
+
+    def _run(self):
+        seq = 0
+        interval = 1.0 / self.rate
+        start = next_send = time.monotonic()
+        next_disconnect = start + self.disconnect_every if self.disconnect_every else None
+
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if next_disconnect and now >= next_disconnect:
+                self._plug()
+                self.disconnects += 1
+                next_disconnect = now + self.disconnect_every
+
+            if now < next_send:
+                time.sleep(min(next_send - now, 0.01))
+                continue
+
+            payload, kind = self._line(seq)
+            if not self._write_all(payload):
+                continue
+            next_send += interval
+
+            if kind == "malformed":
+                self.malformed += 1
+                continue
+            if kind == "user":
+                self.user_updates += 1
+            else:
+                self.sent[(self.boot, seq)] = time.time()
+            seq += 1
+
+    def _write_all(self, payload):
+        view = memoryview(payload)
+        while view and not self._stop.is_set():
+            try:
+                view = view[os.write(self.master, view):]
+            except BlockingIOError:
+                # Bridge isn't keeping up: the pty buffer is full
+                time.sleep(0.001)
+            except OSError:
+                return False
+        return not view
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate a Pico on a pseudo-terminal")
+    parser.add_argument("link", help="symlink path the bridge should open, e.g. /tmp/ttyPICO")
+    parser.add_argument("--rate", type=float, default=1000, help="events per second")
+    parser.add_argument("--malformed", type=float, default=0.0, help="share of junk lines (0-1)")
+    parser.add_argument("--disconnect-every", type=float, default=None, help="seconds between disconnects")
+    parser.add_argument("--binary", action="store_true", help="send binary frames instead of text")
+    args = parser.parse_args()
+
+    emu = PicoEmulator(args.link, args.rate, malformed=args.malformed,
+                       disconnect_every=args.disconnect_every, binary=args.binary).start()
+    print("Emulating Pico on", args.link)
+    try:
+        while True:
+            time.sleep(5)
+            print("sent:", len(emu.sent), "malformed:", emu.malformed, "disconnects:", emu.disconnects)
+    except KeyboardInterrupt:
+        emu.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Compact binary frames between the Pico and the bridge.
+
+    A5 5A | len u16 | type u8 | boot u32 | seq u32 | device | payload | crc16 u16
+
+All integers little-endian. `len` counts everything between it and the
+CRC. The CRC is CRC16-CCITT (poly 0x1021, init 0xFFFF) over those same
+bytes, the same thing binascii.crc_hqx computes. boot is a random id the
+Pico picks at power-up and seq counts its events from 0, so (device,
+boot, seq) identifies one event; device is the Pico's machine.unique_id(). The encoder on the Pico side lives
+in main.py; encode_frame() below is the reference used by tests and the
+emulator.
+
+Payloads (tag = u8 length + raw bytes, shown as hex; str = u8 length + UTF-8):
+    access  ts7, tag, granted u8, user_name str
+    ldr     ts7, tag, ldr_raw u16, ldr_voltage u16 (centivolts), level u8
+    user    action u8, tag, user_name str (empty = none)
+ts7 is year u16, month, day, hour, minute, second (u8 each).
+
+Text lines (`LDR_LOG: {...}` etc.) can be interleaved with frames on the
+same link; StreamDecoder tells them apart by the magic bytes.
+"""
+import struct
+from binascii import crc_hqx
+
+MAGIC = b"\xa5\x5a"
+HEADER = struct.Struct("<2sH")     # magic, len
+BODY = struct.Struct("<BII")       # type, boot, seq
+TS = struct.Struct("<HBBBBB")
+MAX_FRAME = 512
+MAX_LINE = 4096
+
+TYPES = {1: "access", 2: "ldr", 3: "user"}
+TYPE_IDS = {kind: type_id for type_id, kind in TYPES.items()}
+LEVELS = ("Dark", "Dim", "Normal", "Bright")
+ACTIONS = ("register", "deregister")
+
+
+def crc16(data):
+    return crc_hqx(data, 0xFFFF)
+
+
+# ----------------------------
+# Encoding (reference, mirrors main.py)
+# ----------------------------
+def _ts(timestamp):
+    date, clock = timestamp.replace("T", " ").rstrip("Z").split(" ")
+    y, mo, d = (int(x) for x in date.split("-"))
+    h, mi, s = (int(x) for x in clock.split(":"))
+    return TS.pack(y, mo, d, h, mi, s)
+
+def _tag(tag_id):
+    raw = bytes.fromhex(tag_id or "")
+    return bytes([len(raw)]) + raw
+
+def _str(value):
+    raw = (value or "").encode()[:255]
+    return bytes([len(raw)]) + raw
+
+def encode_frame(kind, data, seq, boot=0, device=""):
+    if kind == "access":
+        payload = _ts(data["timestamp"]) + _tag(data["tag_id"]) + bytes([1 if data["access_granted"] else 0]) + _str(data["user_name"])
+    elif kind == "ldr":
+        payload = (_ts(data["timestamp"]) + _tag(data["card_id"])
+                   + struct.pack("<HHB", data["ldr_raw"], round(data["ldr_voltage"] * 100), LEVELS.index(data["light_level"])))
+    elif kind == "user":
+        payload = bytes([ACTIONS.index(data["action"])]) + _tag(data["card_id"]) + _str(data.get("user_name"))
+    else:
+        raise ValueError(f"unknown frame kind: {kind}")
+
+    body = BODY.pack(TYPE_IDS[kind], boot & 0xFFFFFFFF, seq & 0xFFFFFFFF) + _tag(device) + payload
+    return MAGIC + struct.pack("<H", len(body)) + body + struct.pack("<H", crc16(body))
+
+
+# ----------------------------
+# Decoding
+# ----------------------------
+def _read_ts(mv, pos):
+    y, mo, d, h, mi, s = TS.unpack_from(mv, pos)
+    return f"{y:04d}-{mo:02d}-{d:02d} {h:02d}:{mi:02d}:{s:02d}", pos + TS.size
+
+def _read_tag(mv, pos):
+    n = mv[pos]
+    return mv[pos + 1:pos + 1 + n].hex().upper(), pos + 1 + n
+
+def _read_str(mv, pos):
+    n = mv[pos]
+    return str(mv[pos + 1:pos + 1 + n], "utf-8", "replace"), pos + 1 + n
+
+def decode_payload(type_id, mv):
+    """
+    Decodes one frame payload (a memoryview) into the same dict the text
+    format carries. Raises ValueError/IndexError/struct.error if malformed.
+    """
+    kind = TYPES.get(type_id)
+    if kind == "access":
+        ts, pos = _read_ts(mv, 0)
+        tag, pos = _read_tag(mv, pos)
+        granted = bool(mv[pos])
+        name, pos = _read_str(mv, pos + 1)
+        return kind, {"timestamp": ts, "tag_id": tag, "access_granted": granted, "user_name": name}
+    if kind == "ldr":
+        ts, pos = _read_ts(mv, 0)
+        tag, pos = _read_tag(mv, pos)
+        raw, centivolts, level = struct.unpack_from("<HHB", mv, pos)
+        return kind, {"timestamp": ts, "card_id": tag, "ldr_raw": raw, "ldr_voltage": centivolts / 100, "light_level": LEVELS[level]}
+    if kind == "user":
+        action = ACTIONS[mv[0]]
+        tag, pos = _read_tag(mv, 1)
+        name, pos = _read_str(mv, pos)
+        data = {"action": action, "card_id": tag}
+        if name:
+            data["user_name"] = name
+        return kind, data
+    raise ValueError(f"unknown frame type: {type_id}")
+
+
+class StreamDecoder:
+    """
+    Splits a raw serial byte stream into binary frames and text lines.
+
+    feed() returns a list of (kind, data): decoded frames come back as
+    (kind, dict) with the frame's device, boot and seq added to data; text
+    lines come back as (None, line) for parse_line(). Frames with a bad
+    CRC or payload are counted in `corrupt` and skipped.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.frames = 0
+        self.lines = 0
+        self.corrupt = 0
+
+    def feed(self, chunk):
+        self.buf += chunk
+        with memoryview(self.buf) as mv:
+            out, pos = self._scan(mv)
+        # every view into buf is gone once _scan returns
+        del self.buf[:pos]
+        return out
+
+    def _scan(self, mv):
+        out = []
+        pos = 0
+        end = len(mv)
+
+        while pos < end:
+            if mv[pos] == MAGIC[0] and (pos + 1 == end or mv[pos + 1] == MAGIC[1]):
+                if end - pos < HEADER.size:
+                    break
+                _, length = HEADER.unpack_from(mv, pos)
+                if length < BODY.size + 1 or length > MAX_FRAME:
+                    # Not a real frame header, resync on the next byte
+                    self.corrupt += 1
+                    pos += 1
+                    continue
+                total = HEADER.size + length + 2
+                if end - pos < total:
+                    break
+
+                body = mv[pos + HEADER.size:pos + HEADER.size + length]
+                (crc,) = struct.unpack_from("<H", mv, pos + HEADER.size + length)
+                if crc16(body) != crc:
+                    self.corrupt += 1
+                    pos += 1
+                    continue
+
+                type_id, boot, seq = BODY.unpack_from(body, 0)
+                try:
+                    device, start = _read_tag(body, BODY.size)
+                    kind, data = decode_payload(type_id, body[start:])
+                except (ValueError, IndexError, struct.error):
+                    self.corrupt += 1
+                    pos += total
+                    continue
+                data["device"] = device
+                data["boot"] = boot
+                data["seq"] = seq
+                out.append((kind, data))
+                self.frames += 1
+                pos += total
+                continue
+
+            # Text: up to the next newline, or up to a frame that starts mid-line
+            newline = self.buf.find(b"\n", pos)
+            magic = self.buf.find(MAGIC, pos)
+            stop = newline if newline >= 0 else end
+            if 0 <= magic < stop:
+                stop = magic
+            elif newline < 0:
+                if end - pos > MAX_LINE:
+                    pos = end
+                break
+
+            line = str(mv[pos:stop], "utf-8", "replace").strip()
+            if line:
+                out.append((None, line))
+                self.lines += 1
+            pos = stop + 1 if stop == newline else stop
+
+        return out, pos
@@ -0,0 +1,75 @@
+"""
+Leveled, rate-limited logging for the bridge.
+
+Records go through a QueueHandler, so the serial reader only pays for a
+queue put; a background listener thread does the formatting and the
+stdout writes. RateLimitFilter lets the same message through `burst`
+times per `interval` seconds and then reports how many were suppressed.
+"""
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval=10.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        # Keyed on the unformatted message, so "Bad row: %s" counts as one message
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self.windows[key] = [now, 1, 0]
+            else:
+                window[1] += 1
+                if window[1] > self.burst:
+                    window[2] += 1
+                    return False
+                suppressed = 0
+
+        if suppressed:
+            message = record.getMessage()
+            record.msg = "%s (%d similar messages suppressed)"
+            record.args = (message, suppressed)
+        return True
+
+
+_listener = None
+
+
+def setup_logging(level="INFO", interval=10.0, burst=5, stream=None):
+    """
+    Configures the root logger once. Returns the QueueListener (stop() it to
+    flush on exit).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RateLimitFilter(interval, burst))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    return _listener
@@ -1,8 +1,11 @@
 import machine
 import time
 import json
+import sys
+import struct
 import uos
 import utime
+import ubinascii
 import ssd1306
 from mfrc522 import MFRC522
 
@@ -43,6 +46,25 @@ USER_FILE = "user_info.json"     # ONLY user file (card_id -> username)
 ACCESS_LOG_FILE = "access_log.json"
 LDR_LOG_FILE = "ldr_log.json"
 
+# === SERIAL OUTPUT FORMAT ===
+# "text":   LDR_LOG: {...} lines, readable in a terminal
+# "binary": compact CRC-checked frames (see framing.py on the bridge side)
+# The bridge detects either format by itself.
+SERIAL_FORMAT = "text"
+
+# === EVENT IDENTITY ===
+# Every event carries (device, boot, seq) so the bridge can drop duplicates:
+# device is this Pico's chip id, boot is random per power-up, seq counts up.
+DEVICE_ID = ubinascii.hexlify(machine.unique_id()).decode().upper()
+BOOT_ID = int.from_bytes(uos.urandom(4), "little")
+_event_seq = 0
+
+def next_seq():
+    global _event_seq
+    seq = _event_seq
+    _event_seq = (_event_seq + 1) & 0xFFFFFFFF
+    return seq
+
 # === SERVO CALIBRATION ===
 SERVO_HOME = 4915
 SERVO_RIGHT_90 = 8192
@@ -83,6 +105,62 @@ def load_users():
 def save_users(users):
     _save_json(USER_FILE, users)
 
+# === BINARY FRAMES (Pico -> Pi) ===
+# A5 5A | len u16 | type u8 | boot u32 | seq u32 | device | payload | crc16 u16
+# (little-endian)
+FRAME_TYPES = {"access": 1, "ldr": 2, "user": 3}
+LIGHT_LEVELS = ("Dark", "Dim", "Normal", "Bright")
+USER_ACTIONS = ("register", "deregister")
+def _crc16(data):
+    # CRC16-CCITT, poly 0x1021, init 0xFFFF
+    crc = 0xFFFF
+    for b in data:
+        crc ^= b << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return crc
+
+def _frame_ts(ts):
+    # "YYYY-MM-DD HH:MM:SS" -> year u16 + 5 x u8
+    return struct.pack("<HBBBBB", int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+                       int(ts[11:13]), int(ts[14:16]), int(ts[17:19]))
+
+def _frame_tag(card_id):
+    raw = ubinascii.unhexlify(card_id)
+    return bytes([len(raw)]) + raw
+
+def _frame_str(value):
+    raw = (value or "").encode()[:255]
+    return bytes([len(raw)]) + raw
+
+def _write_frame(kind, seq, payload):
+    body = struct.pack("<BII", FRAME_TYPES[kind], BOOT_ID, seq) + _frame_tag(DEVICE_ID) + payload
+    frame = b"\xa5\x5a" + struct.pack("<H", len(body)) + body + struct.pack("<H", _crc16(body))
+    sys.stdout.buffer.write(frame)
+
+def send_access(entry):
+    if SERIAL_FORMAT == "binary":
+        _write_frame("access", entry["seq"], _frame_ts(entry["timestamp"]) + _frame_tag(entry["tag_id"])
+                     + bytes([1 if entry["access_granted"] else 0]) + _frame_str(entry["user_name"]))
+    else:
+        print("ACCESS_LOG:", json.dumps(entry))
+
+def send_ldr(entry):
+    if SERIAL_FORMAT == "binary":
+        _write_frame("ldr", entry["seq"], _frame_ts(entry["timestamp"]) + _frame_tag(entry["card_id"])
+                     + struct.pack("<HHB", entry["ldr_raw"], int(entry["ldr_voltage"] * 100 + 0.5),
+                                   LIGHT_LEVELS.index(entry["light_level"])))
+    else:
+        print("LDR_LOG:", json.dumps(entry))
+
+def send_user_update(msg):
+    if SERIAL_FORMAT == "binary":
+        _write_frame("user", msg["seq"], bytes([USER_ACTIONS.index(msg["action"])]) + _frame_tag(msg["card_id"])
+                     + _frame_str(msg.get("user_name")))
+    else:
+        print("USER_UPDATE:", json.dumps(msg))
+
 # === LOG HELPERS ===
 def now_timestamp():
     t = utime.localtime()
@@ -112,7 +190,10 @@ def log_ldr_event(ts, card_id):
         "card_id": card_id,
         "ldr_raw": raw,
         "ldr_voltage": voltage,
-        "light_level": level
+        "light_level": level,
+        "device": DEVICE_ID,
+        "boot": BOOT_ID,
+        "seq": next_seq()
     }
 
     logs = _load_json(LDR_LOG_FILE, [])
@@ -122,14 +203,17 @@ def log_ldr_event(ts, card_id):
     _save_json(LDR_LOG_FILE, logs)
 
     # For Raspberry Pi bridge:
-    print("LDR_LOG:", json.dumps(entry))
+    send_ldr(entry)
 
 def log_access_event(ts, card_id, granted, user_name):
     entry = {
         "timestamp": ts,
         "tag_id": card_id,
         "access_granted": granted,
-        "user_name": user_name
+        "user_name": user_name,
+        "device": DEVICE_ID,
+        "boot": BOOT_ID,
+        "seq": next_seq()
     }
 
     logs = _load_json(ACCESS_LOG_FILE, [])
@@ -139,13 +223,13 @@ def log_access_event(ts, card_id, granted, user_name):
     _save_json(ACCESS_LOG_FILE, logs)
 
     # For Raspberry Pi bridge:
-    print("ACCESS_LOG:", json.dumps(entry))
+    send_access(entry)
 
 def emit_user_update(action, card_id, user_name=None):
-    msg = {"action": action, "card_id": card_id}
+    msg = {"action": action, "card_id": card_id, "device": DEVICE_ID, "boot": BOOT_ID, "seq": next_seq()}
     if user_name is not None:
         msg["user_name"] = user_name
-    print("USER_UPDATE:", json.dumps(msg))
+    send_user_update(msg)
 
 # === OLED DISPLAY FUNCTIONS ===
 def display_message(lines, clear=True):
@@ -0,0 +1,205 @@
+"""
+Minimal Prometheus-style metrics for the bridge (no extra dependencies).
+
+Metrics live in module-level objects below; the bridge updates them and
+they are exposed either over HTTP (serve()) or as a node_exporter textfile
+(write_textfile()). Lines/sec is rate(bridge_lines_read_total[1m]).
+"""
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Gauge:
+    """
+    Either set() directly or give it a function that is called at scrape
+    time and returns a number (or a dict of label tuple -> number).
+    """
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.function = None
+        registry.register(self)
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        values = dict(self.values)
+        if self.function is not None:
+            result = self.function()
+            values.update(result if isinstance(result, dict) else {(): result})
+        return [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in sorted(values.items())]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value):
+        with self.lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def samples(self):
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class LastSeen(Gauge):
+    """
+    Seconds since touch() was last called, per label value.
+    """
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.seen = {}
+        self.set_function(self.ages)
+
+    def touch(self, *label_values):
+        self.seen[label_values] = time.time()
+
+    def ages(self):
+        now = time.time()
+        return {key: round(now - t, 3) for key, t in list(self.seen.items())}
+
+
+# ----------------------------
+# Bridge metrics
+# ----------------------------
+LINES_READ = Counter("bridge_lines_read_total", "Text lines and binary frames decoded from serial", ["port"])
+PARSE_FAILURES = Counter("bridge_parse_failures_total", "Serial input that could not be used", ["kind"])
+INSERT_LATENCY = Histogram("bridge_insert_latency_seconds", "Time to write one batch to the database",
+                           [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5])
+BATCH_ROWS = Histogram("bridge_batch_rows", "Rows per flushed batch", [1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000])
+RECONNECTS = Counter("bridge_db_reconnects_total", "Database connections re-established after a failure")
+QUEUE_DEPTH = Gauge("bridge_queue_depth", "Events waiting between the serial reader and the DB writers")
+LAST_EVENT_AGE = LastSeen("bridge_last_event_age_seconds", "Seconds since the last event per device", ["device"])
+ALERTS = Counter("bridge_alerts_total", "Alerts raised by the streaming detectors", ["detector"])
+USER_MISMATCHES = Counter("bridge_user_mismatches_total", "Access events that disagreed with the user directory",
+                          ["reason"])
+
+
+# ----------------------------
+# Exporters
+# ----------------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every 15 s shouldn't end up in the bridge log
+
+
+def serve(port, host="0.0.0.0", registry=REGISTRY):
+    """
+    Serves /metrics from a daemon thread. Returns the server (server_port
+    holds the real port when port=0).
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def write_textfile(path, registry=REGISTRY):
+    """
+    For node_exporter's textfile collector: written to a temp file and
+    renamed so the collector never reads half a file.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
@@ -0,0 +1,261 @@
+"""
+Asyncio bridge for several Picos on one Pi.
+
+Watches serial devices matching one or more globs (hot-plug: new ports
+are picked up on the next rescan, unplugged ones are dropped), tags each
+event with its source port and writes everything through a small shared
+pool of DB connections.
+
+    python multibridge.py "/dev/ttyACM*" --pool-size 2
+"""
+import argparse
+import asyncio
+import glob
+import logging
+import os
+import termios
+import time
+import tty
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import BatchWriter, BATCH_MAX_ROWS
+from bridge import (BAUD, CONNECTION_ERRORS, LOG_BURST, LOG_INTERVAL, LOG_LEVEL, PARTITION_CHECK_INTERVAL, ROLLUPS,
+                    SPOOL_DIR, STATS_INTERVAL, USER_RECONCILE_INTERVAL, check_partitions, connect_manager, dead_letter,
+                    export_metrics, make_detectors, parse_chunk, prepare_event, reconcile_users, skip_event,
+                    start_metrics)
+from dedupe import DedupeFilter
+from functions.rollups import Rollup
+from framing import StreamDecoder
+from logsetup import setup_logging
+from metrics import RECONNECTS
+from spool import Spool
+from users import UserDirectory
+
+log = logging.getLogger("multibridge")
+
+SERIAL_GLOB = "/dev/ttyACM*"
+RESCAN_INTERVAL = 2
+DB_POOL_SIZE = 2
+QUEUE_SIZE = 10000
+
+BAUD_RATES = {9600: termios.B9600, 57600: termios.B57600, 115200: termios.B115200}
+
+
+# ----------------------------
+# Serial side
+# ----------------------------
+def open_port(path, baud=BAUD):
+    """
+    Opens a tty (real device or pty) non-blocking in raw mode.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        speed = BAUD_RATES.get(baud, termios.B115200)
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        termios.tcflush(fd, termios.TCIFLUSH)
+    except termios.error:
+        pass
+    return fd
+
+async def read_port(path, queue, counts=None, dedupe=None, detectors=None, users=None):
+    """
+    Reads text lines and binary frames from one port until it disappears,
+    putting parsed events on the queue tagged with `path`.
+    """
+    loop = asyncio.get_running_loop()
+    fd = open_port(path)
+    readable = asyncio.Event()
+    loop.add_reader(fd, readable.set)
+    decoder = StreamDecoder()
+    log.info("Serial connected: %s", path)
+
+    try:
+        while True:
+            await readable.wait()
+            readable.clear()
+            try:
+                chunk = os.read(fd, 4096)
+            except BlockingIOError:
+                continue
+            except OSError:
+                break
+            if not chunk:
+                break
+
+            for kind, data in parse_chunk(decoder, chunk, path):
+                try:
+                    events = prepare_event(kind, data, path, dedupe, detectors, users)
+                except Exception as e:
+                    # Skip the event, keep the port
+                    skip_event(kind, e)
+                    continue
+                if events and counts is not None:
+                    counts[path] = counts.get(path, 0) + 1
+                for event in events:
+                    await queue.put(event)
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+        log.info("Serial disconnected: %s", path)
+
+
+class PortWatcher:
+    """
+    Keeps one read_port task per device matching `patterns`.
+    """
+
+    def __init__(self, patterns, queue, rescan=RESCAN_INTERVAL):
+        self.patterns = patterns
+        self.queue = queue
+        self.rescan = rescan
+        self.readers = {}
+        self.counts = {}
+        # shared by all ports: a Pico that re-enumerates on another port keeps its window
+        self.dedupe = DedupeFilter()
+        self.detectors = make_detectors()
+        self.users = UserDirectory(USER_RECONCILE_INTERVAL)
+
+    def scan(self):
+        for task_path, task in list(self.readers.items()):
+            if task.done():
+                del self.readers[task_path]
+
+        for pattern in self.patterns:
+            for path in glob.glob(pattern):
+                if path not in self.readers:
+                    self.readers[path] = asyncio.create_task(self._read(path))
+
+    async def _read(self, path):
+        try:
+            await read_port(path, self.queue, self.counts, self.dedupe, self.detectors, self.users)
+        except OSError as e:
+            log.warning("Can't open %s: %s", path, e)
+
+    async def run(self):
+        try:
+            while True:
+                self.scan()
+                await asyncio.sleep(self.rescan)
+        finally:
+            for task in self.readers.values():
+                task.cancel()
+
+
+# ----------------------------
+# DB side
+# ----------------------------
+async def write_events(queue, spool, executor, users=None):
+    """
+    One of DB_POOL_SIZE writers, each holding one pooled connection.
+    Blocking psycopg2 work runs in the executor, and spool writes (fsync)
+    in a thread, so the serial readers never wait on the DB or the disk.
+    Spooled events are older than anything still queued, so while the
+    spool has data no writer takes new events: each replays first (one at
+    a time, on the spool's replay lock). Whichever writer is free
+    reconciles `users`.
+    """
+    loop = asyncio.get_running_loop()
+    db = connect_manager()
+    conn = await loop.run_in_executor(executor, db.try_get)
+    # Flushing is driven from here (in the executor), never from add()
+    writer = BatchWriter(conn, max_rows=float("inf"), rollup=Rollup() if ROLLUPS else None)
+
+    def replay():
+        spool.replay(writer, retryable=CONNECTION_ERRORS)
+        db.ok()
+
+    def flush():
+        writer.flush()
+        db.ok()
+
+    async def guarded(work, *args):
+        try:
+            await loop.run_in_executor(executor, work, *args)
+        except CONNECTION_ERRORS as e:
+            log.warning("DB connection lost, spooling events: %s", e)
+            db.failed(e)
+            writer.conn = None
+        except Exception as e:
+            # Refused batch: set it aside and keep writing (see bridge.write_db)
+            await asyncio.to_thread(dead_letter, writer.discard(), e)
+
+    while True:
+        if writer.conn is not None and not spool.empty():
+            await guarded(replay)
+            continue
+
+        try:
+            event = await asyncio.wait_for(queue.get(), timeout=writer.max_age)
+        except asyncio.TimeoutError:
+            event = None
+
+        if writer.conn is None:
+            if event is not None:
+                await asyncio.to_thread(spool.append, event)
+            if db.available():
+                writer.conn = await loop.run_in_executor(executor, db.try_get)
+                if writer.conn is not None:
+                    RECONNECTS.inc()
+            continue
+
+        if event is not None:
+            writer.add(event.kind, event.data)
+        elif writer.count == 0 and db.ping_due():
+            if not await loop.run_in_executor(executor, db.ping):
+                writer.conn = None
+                continue
+
+        if users is not None and users.reconcile_due():
+            await guarded(reconcile_users, users, writer.conn)
+        if writer.conn is not None and (writer.count >= BATCH_MAX_ROWS or writer.due()):
+            await guarded(flush)
+
+
+async def report(queue, watcher):
+    next_partition_check = time.monotonic() + PARTITION_CHECK_INTERVAL
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        if time.monotonic() >= next_partition_check:
+            await asyncio.to_thread(check_partitions)
+            next_partition_check = time.monotonic() + PARTITION_CHECK_INTERVAL
+        log.info("Queue depth: %d ports: %s events: %s duplicates: %d", queue.qsize(), sorted(watcher.readers),
+                 watcher.counts, watcher.dedupe.duplicates)
+        export_metrics()
+
+
+async def run(patterns, pool_size=DB_POOL_SIZE, spool_dir=SPOOL_DIR):
+    queue = asyncio.Queue(QUEUE_SIZE)
+    spool = Spool(spool_dir)
+    watcher = PortWatcher(patterns, queue)
+    start_metrics(queue.qsize)
+
+    with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db") as executor:
+        tasks = [asyncio.create_task(watcher.run()), asyncio.create_task(report(queue, watcher))]
+        tasks += [asyncio.create_task(write_events(queue, spool, executor, watcher.users)) for _ in range(pool_size)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            spool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bridge several Pico serial ports to PostgreSQL")
+    parser.add_argument("patterns", nargs="*", default=[SERIAL_GLOB], help="device paths or globs")
+    parser.add_argument("--pool-size", type=int, default=DB_POOL_SIZE, help="shared DB connections")
+    args = parser.parse_args()
+
+    listener = setup_logging(LOG_LEVEL, LOG_INTERVAL, LOG_BURST)
+    try:
+        asyncio.run(run(args.patterns, args.pool_size))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.stop()
+
+if __name__ == "__main__":
+    main()
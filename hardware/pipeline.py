@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+# One parsed serial line on its way to the database.
+# source: serial port it came from, received: time.time() when read.
+Event = namedtuple("Event", ["kind", "data", "source", "received"])
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+SPILL = "spill"
+POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+
+class EventQueue:
+    """
+    Bounded queue between the serial reader and the DB writers.
+
+    When full, `policy` decides what happens to a new event:
+      block        wait until a writer makes room (reader stalls)
+      drop_oldest  discard the oldest queued event
+      spill        append to a file on disk, read back in order later
+    """
+
+    def __init__(self, maxsize=10000, policy=BLOCK, spill_path=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown queue policy: {policy}")
+        if policy == SPILL and not spill_path:
+            raise ValueError("spill policy needs a spill_path")
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spill_path = spill_path
+        self.items = deque()
+        self.cond = threading.Condition()
+
+        self.put_count = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.spill_pending = 0
+        self.corrupt = 0
+        self._spill_offset = 0
+
+        if spill_path and os.path.exists(spill_path):
+            # Left over from a previous run: replay it before new events
+            last = b"\n"
+            with open(spill_path, "rb") as f:
+                for last in f:
+                    self.spill_pending += 1
+            if not last.endswith(b"\n"):
+                # Torn last line (crash mid-write): end it so the next
+                # spilled event starts on a line of its own
+                with open(spill_path, "a") as f:
+                    f.write("\n")
+
+    def put(self, event):
+        with self.cond:
+            self.put_count += 1
+
+            if self.spill_pending:
+                # Keep order: once spilling, everything goes to disk until drained
+                self._spill(event)
+            elif len(self.items) < self.maxsize:
+                self.items.append(event)
+            elif self.policy == BLOCK:
+                while len(self.items) >= self.maxsize:
+                    self.cond.wait()
+                self.items.append(event)
+            elif self.policy == DROP_OLDEST:
+                self.items.popleft()
+                self.dropped += 1
+                self.items.append(event)
+            else:
+                self._spill(event)
+
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Returns the next event, or None if nothing arrived within timeout.
+        """
+        with self.cond:
+            if not self.items and self.spill_pending:
+                self._unspill()
+
+            end = None if timeout is None else time.monotonic() + timeout
+            while not self.items:
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+                if not self.items and self.spill_pending:
+                    self._unspill()
+
+            event = self.items.popleft()
+            self.cond.notify_all()
+            return event
+
+    def depth(self):
+        with self.cond:
+            return len(self.items) + self.spill_pending
+
+    def stats(self):
+        with self.cond:
+            return {
+                "depth": len(self.items),
+                "spill_depth": self.spill_pending,
+                "put": self.put_count,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "corrupt": self.corrupt,
+            }
+
+    # ----------------------------
+    # Spill file (caller holds self.cond)
+    # ----------------------------
+    def _spill(self, event):
+        with open(self.spill_path, "a") as f:
+            f.write(json.dumps(event._asdict()) + "\n")
+        self.spilled += 1
+        self.spill_pending += 1
+
+    def _unspill(self):
+        room = self.maxsize - len(self.items)
+        with open(self.spill_path, "r") as f:
+            f.seek(self._spill_offset)
+            while room > 0 and self.spill_pending:
+                line = f.readline()
+                if not line:
+                    break
+                self.spill_pending -= 1
+                try:
+                    event = Event(**json.loads(line))
+                except (ValueError, TypeError):
+                    # torn write from a crash mid-spill
+                    self.corrupt += 1
+                    continue
+                self.items.append(event)
+                room -= 1
+            self._spill_offset = f.tell()
+
+        if not self.spill_pending:
+            os.remove(self.spill_path)
+            self._spill_offset = 0
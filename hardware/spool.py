@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from pipeline import Event
+
+log = logging.getLogger("spool")
+
+SEGMENT_BYTES = 1024 * 1024   # start a new segment file after ~1 MB
+FSYNC_EVERY = 100             # fsync after this many appended events...
+FSYNC_INTERVAL = 1.0          # ...or this many seconds, whichever first
+
+
+class Spool:
+    """
+    Append-only on-disk buffer for events that arrive while the DB is
+    unreachable. Events are written as JSON lines into numbered segment
+    files (seg-000001.jsonl, ...). replay() writes them back in order and
+    deletes a segment only after its rows have been committed. Segments
+    the database refuses are kept as bad-000001.jsonl, ... for a look.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, fsync_every=FSYNC_EVERY, fsync_interval=FSYNC_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.lock = threading.RLock()
+        self.replaying = threading.Lock()   # one replay at a time; appends don't wait for it
+
+        os.makedirs(directory, exist_ok=True)
+        existing = self.segments()
+        self.next_id = (self._segment_id(existing[-1]) + 1) if existing else 1
+        self.has_data = bool(existing)
+
+        self.active = None
+        self.active_path = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    # ----------------------------
+    # Segments
+    # ----------------------------
+    def segments(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("seg-") and n.endswith(".jsonl"))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _segment_id(self, path):
+        return int(os.path.basename(path)[4:-6])
+
+    def _open_segment(self):
+        self.active_path = os.path.join(self.directory, f"seg-{self.next_id:06d}.jsonl")
+        self.next_id += 1
+        self.active = open(self.active_path, "a")
+
+    def _close_segment(self):
+        if self.active is not None:
+            self._sync()
+            self.active.close()
+            self.active = None
+            self.active_path = None
+
+    def _sync(self):
+        if self.active is not None and self.unsynced:
+            self.active.flush()
+            os.fsync(self.active.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def empty(self):
+        # Cheap enough to call for every event
+        return not self.has_data
+
+    # ----------------------------
+    # Write side
+    # ----------------------------
+    def append(self, event):
+        with self.lock:
+            if self.active is None:
+                self._open_segment()
+
+            self.active.write(json.dumps(event._asdict()) + "\n")
+            self.unsynced += 1
+            self.has_data = True
+
+            if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+                self._sync()
+            if self.active.tell() >= self.segment_bytes:
+                self._close_segment()
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            self._close_segment()
+
+    # ----------------------------
+    # Replay
+    # ----------------------------
+    def _read_segment(self, path):
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield Event(**json.loads(line))
+                except (ValueError, TypeError):
+                    # torn write from a crash mid-append
+                    continue
+
+    def replay(self, writer, retryable=(Exception,)):
+        """
+        Writes every spooled event through `writer` (a BatchWriter), oldest
+        segment first. A segment is one unit: all its rows are added and
+        flushed together, then the file is removed. If that fails the rows
+        are taken out of the writer again; a `retryable` error (the
+        connection) is raised and the segment replayed next time, any other
+        error means the segment can't be written and it is set aside.
+        The spool lock is only held to close the active segment, so events
+        can be appended while the rows go to the database.
+        Returns (rows, seconds).
+        """
+        with self.replaying:
+            with self.lock:
+                self._close_segment()
+                segments = self.segments()
+            start = time.monotonic()
+            rows = 0
+
+            # Rows queued before the replay aren't the segments' to drop
+            writer.flush()
+            for path in segments:
+                events = list(self._read_segment(path))
+                try:
+                    for event in events:
+                        writer.add(event.kind, event.data, autoflush=False)
+                    writer.flush()
+                except retryable:
+                    writer.discard()
+                    raise
+                except Exception as e:
+                    writer.discard()
+                    bad = os.path.join(self.directory, "bad-" + os.path.basename(path)[4:])
+                    os.replace(path, bad)
+                    log.error("Spool segment refused by the database, kept as %s: %s", bad, e)
+                    continue
+                os.remove(path)
+                rows += len(events)
+
+            with self.lock:
+                self.has_data = self.active is not None or bool(self.segments())
+
+            seconds = time.monotonic() - start
+            if segments:
+                rate = rows / seconds if seconds > 0 else float("inf")
+                log.info("Spool replayed %d rows from %d segments in %.2f s (%.0f rows/s)", rows, len(segments), seconds, rate)
+            return rows, seconds
@@ -0,0 +1,125 @@
+"""
+In-memory copy of public.users for the bridge.
+
+Loaded once from the table, then kept current by the USER_UPDATE events
+passing through the reader, so resolving a card to a user is a dict lookup
+instead of a query per event. Now and then the writer compares a checksum
+of the table (row count plus a sum of per-row hashes, computed by the
+database) with the one kept here, and only reloads when they differ.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from metrics import USER_MISMATCHES
+
+log = logging.getLogger("users")
+
+RECONCILE_INTERVAL = 60   # seconds between checksum comparisons
+SETTLE = 10               # skip the comparison this long after a local change (rows may still be in flight)
+
+# Same per-row hash as entry_hash(): first 60 bits of md5(tag \x1f name)
+CHECKSUM_SQL = """
+SELECT count(*), coalesce(sum(('x' || substr(md5(tag_id || chr(31) || coalesce(user_name, '')), 1, 15))::bit(60)::bigint), 0)
+FROM public.users
+"""
+
+
+def entry_hash(tag, name):
+    digest = hashlib.md5(f"{tag}\x1f{name or ''}".encode("utf-8")).hexdigest()
+    return int(digest[:15], 16)
+
+
+class UserDirectory:
+    """
+    Shared by the reader (apply/enrich) and the writers (reconcile).
+    Lookups don't lock: a reload swaps in a new dict.
+    """
+
+    def __init__(self, interval=RECONCILE_INTERVAL, settle=SETTLE):
+        self.interval = interval
+        self.settle = settle
+        self.lock = threading.Lock()
+        self.users = {}
+        self.checksum = 0
+        self.loaded = False
+        self.changed = 0.0
+        self.next_check = 0.0
+        self.reloads = 0
+
+    def __len__(self):
+        return len(self.users)
+
+    def resolve(self, tag):
+        return self.users.get(tag)
+
+    def apply(self, data):
+        """
+        One USER_UPDATE event: register adds or renames, deregister removes.
+        """
+        tag = data.get("card_id") or data.get("tag_id")
+        if not tag:
+            return
+        with self.lock:
+            if tag in self.users:
+                self.checksum -= entry_hash(tag, self.users.pop(tag))
+            if data.get("action") != "deregister":
+                self.users[tag] = data.get("user_name")
+                self.checksum += entry_hash(tag, data.get("user_name"))
+            self.changed = time.monotonic()
+
+    def enrich(self, data):
+        """
+        Access event: the directory's name wins over the one the Pico sent,
+        and access granted to a tag nobody registered is reported.
+        """
+        if not self.loaded:
+            return
+        tag = data.get("tag_id")
+        if tag in self.users:
+            name = self.users[tag]
+            if data.get("user_name") != name:
+                USER_MISMATCHES.inc("name")
+                data["user_name"] = name
+        elif data.get("access_granted"):
+            USER_MISMATCHES.inc("unregistered")
+            log.warning("Access granted to unregistered tag %s", tag)
+
+    def reconcile_due(self):
+        return time.monotonic() >= self.next_check
+
+    def reconcile(self, conn):
+        """
+        Compares checksums and reloads only on a difference. Returns True if
+        the table was loaded. Raises psycopg2 errors like any other query.
+        """
+        with self.lock:
+            if not self.reconcile_due():
+                return False
+            self.next_check = time.monotonic() + self.interval
+            if self.loaded and time.monotonic() - self.changed < self.settle:
+                return False
+            local = (len(self.users), self.checksum)
+            changed = self.changed
+
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(CHECKSUM_SQL)
+                count, checksum = cur.fetchone()
+                if self.loaded and (count, int(checksum)) == local:
+                    return False
+                cur.execute("SELECT tag_id, user_name FROM public.users")
+                rows = cur.fetchall()
+
+        users = dict(rows)
+        with self.lock:
+            if self.changed != changed:
+                return False   # an update arrived meanwhile; compare again next time
+            if self.loaded:
+                log.info("User directory out of sync with the table, reloaded %d users", len(users))
+            self.users = users
+            self.checksum = sum(entry_hash(tag, name) for tag, name in users.items())
+            self.loaded = True
+            self.reloads += 1
+        return True